@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark: per-row process_freight loop vs streaming process_freights
+Usage:
+    python scripts/bench_process_freights.py --rows 1000000 --cities 3500
+    python scripts/bench_process_freights.py --rows 100000 --workers 2
+"before" is the old path: one pydantic Freight per row, parse caches bypassed
+(the uncached _parse_price / _parse_city_and_region). "after" is
+process_freights (cached parsing, FreightRecord). Both get the same synthetic rows.
+"""
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+for sub in ('src/core', 'src/optimization/legacy', 'src/optimization'):
+    sys.path.insert(0, str(REPO_ROOT / sub))
+
+import data_processor as dp  # noqa: E402
+
+PREFIXES = ('г. ', 'п. ', 'с. ', 'пгт. ', '')
+BODY_TYPES = ('тент', 'реф', 'термос', 'изотерм', 'борт')
+
+
+def make_rows(n: int, n_cities: int, seed: int = 1):
+    """n raw ATI-like rows over n_cities distinct location strings (and a few hundred prices)."""
+    rnd = random.Random(seed)
+    locations = [f"{PREFIXES[i % len(PREFIXES)]}Город{i}, Район{i % 97} (Область{i % 85})"
+                 for i in range(n_cities)]
+    prices = [f"{rnd.randrange(5, 400) * 1000:,} руб.".replace(',', ' ') for _ in range(500)]
+    for i in range(n):
+        yield {
+            'id': str(i),
+            'loading_points': [rnd.choice(locations)],
+            'unloading_points': [rnd.choice(locations), rnd.choice(locations)][:rnd.randint(1, 2)],
+            'distance': str(rnd.randrange(50, 3000)),
+            'cargo': 'ТНП',
+            'weight': f"{rnd.randrange(1, 20)},5",
+            'volume': str(rnd.randrange(10, 90)),
+            'prices': {'с_НДС': rnd.choice(prices), 'без_НДС': rnd.choice(prices)},
+            'loading_date': '2026-10-%02d' % rnd.randint(1, 28),
+            'body_type': rnd.choice(BODY_TYPES),
+            'loading_method': 'n/a',
+            'possible_reload': 'n/a',
+        }
+
+
+def run_before(rows) -> int:
+    cached = dp._parse_price_cached, dp._parse_city_and_region_cached
+    dp._parse_price_cached, dp._parse_city_and_region_cached = dp._parse_price, dp._parse_city_and_region
+    try:
+        n = 0
+        for raw in rows:
+            try:
+                dp.process_freight(raw)
+                n += 1
+            except Exception:
+                pass
+        return n
+    finally:
+        dp._parse_price_cached, dp._parse_city_and_region_cached = cached
+
+
+def run_after(rows, workers: int) -> int:
+    dp._parse_price_cached.cache_clear()
+    dp._parse_city_and_region_cached.cache_clear()
+    return sum(1 for _ in dp.process_freights(rows, workers=workers))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="process_freight vs process_freights throughput")
+    ap.add_argument('--rows', type=int, default=1_000_000)
+    ap.add_argument('--cities', type=int, default=3500, help="distinct location strings")
+    ap.add_argument('--workers', type=int, default=0, help="process_freights pool size (0 = inline)")
+    ap.add_argument('--skip-before', action='store_true')
+    args = ap.parse_args()
+
+    # rows are generated on the fly in both runs (same seed), generation time is measured apart
+    t0 = time.perf_counter()
+    for _ in make_rows(args.rows, args.cities):
+        pass
+    gen = time.perf_counter() - t0
+    print(f"rows={args.rows} cities={args.cities} generation {gen:.1f}s (subtracted below)")
+
+    results = {}
+    if not args.skip_before:
+        t0 = time.perf_counter()
+        n = run_before(make_rows(args.rows, args.cities))
+        results['before'] = (n, time.perf_counter() - t0 - gen)
+    t0 = time.perf_counter()
+    n = run_after(make_rows(args.rows, args.cities), args.workers)
+    results['after'] = (n, time.perf_counter() - t0 - gen)
+
+    for name, (n, sec) in results.items():
+        print(f"{name:6s} {n} rows {sec:.1f}s  {n / sec / 1000:.1f}k rows/s")
+    if 'before' in results:
+        print(f"speedup x{results['before'][1] / results['after'][1]:.2f}")
+
+
+if __name__ == '__main__':
+    main()
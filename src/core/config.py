@@ -138,6 +138,12 @@ RUSSIAN_REGIONS = [
 # путь к файлу с кешем расстояний
 EXACT_DISTANCE_CACHE_PATH = str(DATA_DIR / "exact_distance_cache.json")
 
+# --- для geo_utils ---
+# кеш координат городов (тот же файл, что читает load_existing_cache("cities_cache"))
+CITIES_CACHE_PATH = str(CACHE_DIR / "cities_cache.json")
+# поправка «по прямой» -> «по дороге»
+ROAD_CURVATURE_FACTOR = 1.15
+
 # Максимальный пробег за сутки (норма для планирования)
 DAILY_DRIVING_DISTANCE = 800  # км/сутки
 
@@ -1,4 +1,5 @@
 
+from dataclasses import dataclass, field
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 
@@ -47,7 +48,62 @@ class Route(BaseModel):
     estimated_time: float
     total_time_days: float
     empty_run_after: float = 0.0
+    revenue_per_hour: float = 0.0
 
     @property
     def revenue_per_km(self) -> float:
         return self.total_revenue / self.total_distance if self.total_distance > 0 else 0.0
+
+
+# --- Лёгкие внутренние двойники (slots, без валидации) ---
+# Для горячих циклов (планировщик, потоковая нормализация, surge); pydantic-модели
+# остаются для внешних границ (API-схемы), обязательные поля проверяет process_freight_record.
+
+@dataclass(slots=True)
+class FreightRecord:
+    id: str
+    loading_points: List[str]
+    unloading_points: List[str]
+    distance: float
+    cargo: str
+    weight: float
+    volume: float
+    loading_date: str
+    prices: Dict[str, float] = field(default_factory=dict)
+    loading_dt: Optional[str] = None
+    body_type: Optional[str] = "n/a"
+    loading_method: Optional[str] = "n/a"
+    possible_reload: Optional[str] = "n/a"
+    details: Optional[List[str]] = field(default_factory=list)
+    revenue_rub: Optional[float] = None
+    loading_lat: Optional[float] = None
+    loading_lon: Optional[float] = None
+    unloading_lat: Optional[float] = None
+    unloading_lon: Optional[float] = None
+    loading_region: Optional[str] = None
+    unloading_region: Optional[str] = None
+
+@dataclass(slots=True)
+class RouteSegmentRecord:
+    freight: FreightRecord
+    empty_run_before: float
+    segment_time: float
+    arrive_time: Optional[str] = None
+    depart_time: Optional[str] = None
+
+@dataclass(slots=True)
+class RouteRecord:
+    segments: List[RouteSegmentRecord]
+    total_distance: float
+    total_revenue: float
+    estimated_time: float
+    total_time_days: float
+    empty_run_after: float = 0.0
+    revenue_per_hour: float = 0.0
+    total_profit: float = 0.0
+    profit_per_hour: float = 0.0
+
+    @property
+    def revenue_per_km(self) -> float:
+        return self.total_revenue / self.total_distance if self.total_distance > 0 else 0.0
+
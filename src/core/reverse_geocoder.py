@@ -0,0 +1,200 @@
+import math
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.core.geo_utils import haversine_km, load_cities_cache
+
+# Офлайн обратное геокодирование: lat/lon -> ближайший известный город.
+# Точки раскладываются по сетке cell_deg x cell_deg; запрос смотрит только клетки,
+# попадающие в радиус, поэтому стоимость не зависит от числа городов.
+# Колонки сетки замкнуты по долготе (±180° — соседние клетки), ширина окна по долготе
+# берётся по самой высокой широте полосы поиска.
+
+DEFAULT_RADIUS_KM = 50.0
+DEFAULT_CELL_DEG = 0.5
+_KM_PER_DEG_LAT = 111.2
+
+logger = logging.getLogger('ReverseGeocoder')
+
+
+def _coords_of(entry) -> Optional[Tuple[float, float]]:
+    """Coordinates from a cities-cache entry: {'lat','lon'} / {'latitude','longitude'} / [lat, lon]."""
+    try:
+        if isinstance(entry, dict):
+            lat = entry.get('lat', entry.get('latitude'))
+            lon = entry.get('lon', entry.get('longitude'))
+        elif isinstance(entry, (list, tuple)) and len(entry) >= 2:
+            lat, lon = entry[0], entry[1]
+        else:
+            return None
+        if lat is None or lon is None:
+            return None
+        return float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+
+
+class ReverseGeocoder:
+    def __init__(self, points: Iterable[Tuple[str, float, float]], cell_deg: float = DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.ncols = int(math.ceil(360.0 / cell_deg))
+        self.names: List[str] = []
+        self.lats: List[float] = []
+        self.lons: List[float] = []
+        self.grid: Dict[Tuple[int, int], List[int]] = {}
+        seen = set()
+        for name, lat, lon in points:
+            if not name or name in seen or lat is None or lon is None:
+                continue
+            seen.add(name)
+            idx = len(self.names)
+            self.names.append(name)
+            self.lats.append(float(lat))
+            self.lons.append(float(lon))
+            self.grid.setdefault(self._cell(lat, lon), []).append(idx)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        j = int(math.floor(((lon + 180.0) % 360.0) / self.cell_deg))
+        return int(math.floor(lat / self.cell_deg)), min(j, self.ncols - 1)
+
+    def nearest(self, lat: float, lon: float, radius_km: float = DEFAULT_RADIUS_KM) -> Optional[Tuple[str, float]]:
+        """(city, distance_km) of the nearest known point within radius_km, else None."""
+        if lat is None or lon is None or not self.names:
+            return None
+        ci, cj = self._cell(lat, lon)
+        dlat = radius_km / _KM_PER_DEG_LAT
+        di = int(math.ceil(dlat / self.cell_deg))
+        # самая узкая по долготе клетка полосы — на её дальнем от экватора краю
+        edge_lat = min(90.0, max(abs(lat - dlat), abs(lat + dlat)))
+        cos_min = math.cos(math.radians(edge_lat))
+        if cos_min < 1e-6:
+            cols = range(self.ncols)               # полоса задевает полюс — все долготы
+        else:
+            dj = int(math.ceil(dlat / cos_min / self.cell_deg))
+            if 2 * dj + 1 >= self.ncols:
+                cols = range(self.ncols)
+            else:
+                cols = [j % self.ncols for j in range(cj - dj, cj + dj + 1)]
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+
+        # cheap equirectangular ranking, exact haversine only for the winner
+        best_idx, best_d2 = -1, float('inf')
+        for i in range(ci - di, ci + di + 1):
+            for j in cols:
+                for idx in self.grid.get((i, j), ()):
+                    dy = self.lats[idx] - lat
+                    dx = ((self.lons[idx] - lon + 180.0) % 360.0 - 180.0) * cos_lat
+                    d2 = dx * dx + dy * dy
+                    if d2 < best_d2:
+                        best_idx, best_d2 = idx, d2
+        if best_idx < 0:
+            return None
+        dist = haversine_km(lat, lon, self.lats[best_idx], self.lons[best_idx])
+        if dist > radius_km:
+            return None
+        return self.names[best_idx], dist
+
+    def city_at(self, lat: float, lon: float, radius_km: float = DEFAULT_RADIUS_KM) -> Optional[str]:
+        hit = self.nearest(lat, lon, radius_km)
+        return hit[0] if hit else None
+
+    def cities_at(self, coords: Iterable[Tuple[Optional[float], Optional[float]]],
+                  radius_km: float = DEFAULT_RADIUS_KM) -> List[Optional[str]]:
+        """Batch variant for ingestion; repeated coordinates are resolved once."""
+        memo: Dict[Tuple[float, float], Optional[str]] = {}
+        out: List[Optional[str]] = []
+        for lat, lon in coords:
+            if lat is None or lon is None:
+                out.append(None)
+                continue
+            key = (round(lat, 4), round(lon, 4))
+            if key not in memo:
+                memo[key] = self.city_at(lat, lon, radius_km)
+            out.append(memo[key])
+        return out
+
+
+def iter_freight_points(freight_rows: Iterable[dict]) -> Iterable[Tuple[str, float, float]]:
+    """(city, lat, lon) from freight rows' loading/unloading coordinates."""
+    for row in freight_rows:
+        for city_key, lat_key, lon_key in (
+            ('loading_city', 'loading_lat', 'loading_lon'),
+            ('unloading_city', 'unloading_lat', 'unloading_lon')
+        ):
+            city = row.get(city_key)
+            lat = row.get(lat_key); lon = row.get(lon_key)
+            if city and lat is not None and lon is not None:
+                yield city, lat, lon
+
+
+def _freights_db_path() -> str:
+    from src.optimization.legacy.config import DATABASE_PATH
+    return DATABASE_PATH
+
+def load_freight_points(db_path: Optional[str] = None) -> List[Tuple[str, float, float]]:
+    """(city, lat, lon) per city from the freights table's loading/unloading coordinates;
+    [] if the database or table is not there."""
+    try:
+        db_path = db_path or _freights_db_path()
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except Exception as e:
+        logger.warning(f"Reverse geocoder: база грузов недоступна ({e}) — только кэш городов")
+        return []
+    try:
+        return conn.execute('''
+            SELECT city, MIN(lat), MIN(lon) FROM (
+                SELECT loading_city AS city, loading_lat AS lat, loading_lon AS lon FROM freights
+                WHERE loading_city IS NOT NULL AND loading_lat IS NOT NULL AND loading_lon IS NOT NULL
+                UNION ALL
+                SELECT unloading_city, unloading_lat, unloading_lon FROM freights
+                WHERE unloading_city IS NOT NULL AND unloading_lat IS NOT NULL AND unloading_lon IS NOT NULL
+            ) GROUP BY city
+        ''').fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"Reverse geocoder: координаты грузов не прочитаны ({e}) — только кэш городов")
+        return []
+    finally:
+        conn.close()
+
+def build_reverse_geocoder(freight_rows: Optional[Iterable[dict]] = None,
+                           cell_deg: float = DEFAULT_CELL_DEG,
+                           freights_db: Optional[str] = None) -> ReverseGeocoder:
+    """Index over the cities cache plus freight loading/unloading coordinates: freight_rows
+    when given, otherwise the freights table (freights_db, default — the legacy freights.db).
+    Cities cache wins for names present in both."""
+    def points():
+        for name, entry in load_cities_cache().items():
+            c = _coords_of(entry)
+            if c:
+                yield name, c[0], c[1]
+        if freight_rows is not None:
+            yield from iter_freight_points(freight_rows)
+        else:
+            yield from load_freight_points(freights_db)
+    geocoder = ReverseGeocoder(points(), cell_deg=cell_deg)
+    logger.info(f"Reverse geocoder: {len(geocoder)} точек")
+    return geocoder
+
+
+_default: Optional[ReverseGeocoder] = None
+_default_lock = threading.Lock()
+
+def get_reverse_geocoder() -> ReverseGeocoder:
+    """Process-wide geocoder over the cities cache and freight coordinates (built on first use)."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = build_reverse_geocoder()
+    return _default
+
+def set_reverse_geocoder(geocoder: Optional[ReverseGeocoder]) -> None:
+    """Replace the process-wide geocoder (e.g. one built from a different freight source)."""
+    global _default
+    with _default_lock:
+        _default = geocoder
@@ -32,6 +32,7 @@ class Segment:
     status: str = "planned"  # planned|booked|in_transit|done|canceled
     locked: int = 0          # 1=locked, 0=unlocked
     note: str = ""
+    unloading_region: Optional[str] = None  # регион выгрузки (Postgres: trip_segments.dest_region)
 
 @dataclass
 class Trip:
@@ -50,3 +51,14 @@ class Trip:
 
     plan_revenue_per_day: float = 0.0
     last_replan_at: Optional[str] = None
+
+@dataclass
+class PlanCommit:
+    """One replan outcome to persist: the new plan (if accepted) and its replan_log entry."""
+    trip_id: int
+    accepted: bool
+    delta_revenue_per_day: float = 0.0
+    reason: str = ""
+    segments: List[Segment] = field(default_factory=list)
+    plan_metrics: Optional[TripMetrics] = None
+    log: bool = True          # write a replan_log row
@@ -1,3 +1,4 @@
+import io
 import logging
 from typing import List, Dict, Any, Optional
 from sqlalchemy import create_engine, text, exc
@@ -54,64 +55,147 @@ def init_database():
         logger.error(f"Error initializing database: {str(e)}")
         raise
 
-def insert_freights_batch(freights: List[Dict[str, Any]]):
-    """Вставка грузов пачками с проверкой дубликатов"""
+_FREIGHT_COLUMNS = (
+    'id', 'hash', 'loading_city', 'unloading_city', 'distance', 'cargo', 'weight',
+    'volume', 'body_type', 'loading_date', 'revenue_rub', 'profit_per_km',
+    'loading_lat', 'loading_lon', 'unloading_lat', 'unloading_lon',
+    'loading_region', 'unloading_region'
+)
+
+# Поля, которые обновляются при повторной вставке того же id (одинаково для обоих путей)
+_FREIGHT_UPSERT_SET = """
+    hash = EXCLUDED.hash,
+    loading_date = EXCLUDED.loading_date,
+    revenue_rub = EXCLUDED.revenue_rub,
+    profit_per_km = EXCLUDED.profit_per_km,
+    unloading_lat = EXCLUDED.unloading_lat,
+    unloading_lon = EXCLUDED.unloading_lon
+"""
+
+COPY_CHUNK_SIZE = 20_000
+
+def _freight_values(freight: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'id': freight.get('id'),
+        'hash': freight.get('hash'),
+        'loading_city': freight.get('loading_city', ''),
+        'unloading_city': freight.get('unloading_city', ''),
+        'distance': freight.get('distance', 0),
+        'cargo': freight.get('cargo', ''),
+        'weight': freight.get('weight', 0),
+        'volume': freight.get('volume', 0),
+        'body_type': freight.get('body_type', ''),
+        'loading_date': freight.get('loading_date', ''),
+        'revenue_rub': freight.get('revenue_rub', 0),
+        'profit_per_km': freight.get('profit_per_km', 0),
+        'loading_lat': freight.get('loading_lat'),
+        'loading_lon': freight.get('loading_lon'),
+        'unloading_lat': freight.get('unloading_lat'),
+        'unloading_lon': freight.get('unloading_lon'),
+        'loading_region': freight.get('loading_region'),
+        'unloading_region': freight.get('unloading_region')
+    }
+
+def _copy_text(value: Any) -> str:
+    """Значение для COPY ... FROM STDIN (text format)."""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+_STAGE_COLUMNS = ', '.join(_FREIGHT_COLUMNS)
+
+# Временная таблица живёт в сессии (соединения из пула переиспользуются), строки — до commit.
+_CREATE_STAGE_SQL = f"""
+    CREATE TEMP TABLE IF NOT EXISTS freights_stage (
+        seq BIGINT,
+        id TEXT, hash TEXT, loading_city TEXT, unloading_city TEXT, distance REAL, cargo TEXT,
+        weight REAL, volume REAL, body_type TEXT, loading_date TEXT, revenue_rub REAL,
+        profit_per_km REAL, loading_lat REAL, loading_lon REAL, unloading_lat REAL,
+        unloading_lon REAL, loading_region TEXT, unloading_region TEXT
+    ) ON COMMIT DELETE ROWS
+"""
+
+# DISTINCT ON: повтор id внутри пачки — побеждает последний (как при executemany),
+# иначе ON CONFLICT DO UPDATE упал бы на "cannot affect row a second time".
+_MERGE_STAGE_SQL = f"""
+    INSERT INTO freights ({_STAGE_COLUMNS})
+    SELECT DISTINCT ON (id) {_STAGE_COLUMNS}
+      FROM freights_stage
+     ORDER BY id, seq DESC
+    ON CONFLICT (id) DO UPDATE SET {_FREIGHT_UPSERT_SET}
+"""
+
+def _copy_stage(cur, rows: List[Dict[str, Any]], seq0: int) -> None:
+    copy_sql = f"COPY freights_stage (seq, {_STAGE_COLUMNS}) FROM STDIN"
+    if hasattr(cur, 'copy'):  # psycopg 3
+        with cur.copy(copy_sql) as copy:
+            for i, row in enumerate(rows, seq0):
+                copy.write_row((i, *(row[c] for c in _FREIGHT_COLUMNS)))
+    else:  # psycopg2
+        buf = io.StringIO()
+        for i, row in enumerate(rows, seq0):
+            buf.write(str(i))
+            for c in _FREIGHT_COLUMNS:
+                buf.write('\t')
+                buf.write(_copy_text(row[c]))
+            buf.write('\n')
+        buf.seek(0)
+        cur.copy_expert(copy_sql, buf)
+
+def _bulk_upsert_freights(values: List[Dict[str, Any]], chunk_size: int = COPY_CHUNK_SIZE) -> None:
+    """COPY в freights_stage + один INSERT ... SELECT ... ON CONFLICT на кусок; всё в одной транзакции.
+       Драйвер — тот, что у engine (psycopg2 или psycopg 3)."""
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        cur.execute(_CREATE_STAGE_SQL)
+        for start in range(0, len(values), chunk_size):
+            chunk = values[start:start + chunk_size]
+            _copy_stage(cur, chunk, start)
+            cur.execute(_MERGE_STAGE_SQL)
+            cur.execute("TRUNCATE freights_stage")
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+def insert_freights_batch(freights: List[Dict[str, Any]], bulk: bool = True):
+    """Вставка грузов пачками с проверкой дубликатов.
+       bulk=True — COPY во временную таблицу и set-based upsert (кусками по COPY_CHUNK_SIZE);
+       bulk=False — прежний executemany через SQLAlchemy."""
     if not freights:
         logger.warning("Attempted to insert empty freights list")
         return
-    
+
+    values = [_freight_values(freight) for freight in freights]
+    if bulk:
+        try:
+            _bulk_upsert_freights(values)
+            logger.info(f"Inserted/updated {len(freights)} freights (COPY)")
+            return
+        except (AttributeError, NotImplementedError) as e:
+            # драйвер без COPY — уходим на executemany
+            logger.warning(f"COPY недоступен ({e}), используем executemany")
+        except Exception as e:
+            logger.error(f"Error inserting freights: {str(e)}")
+            raise
+
     try:
         with get_db() as db:
-            # Подготавливаем данные для вставки
-            values = []
-            for freight in freights:
-                values.append({
-                    'id': freight.get('id'),
-                    'hash': freight.get('hash'),
-                    'loading_city': freight.get('loading_city', ''),
-                    'unloading_city': freight.get('unloading_city', ''),
-                    'distance': freight.get('distance', 0),
-                    'cargo': freight.get('cargo', ''),
-                    'weight': freight.get('weight', 0),
-                    'volume': freight.get('volume', 0),
-                    'body_type': freight.get('body_type', ''),
-                    'loading_date': freight.get('loading_date', ''),
-                    'revenue_rub': freight.get('revenue_rub', 0),
-                    'profit_per_km': freight.get('profit_per_km', 0),
-                    'loading_lat': freight.get('loading_lat'),
-                    'loading_lon': freight.get('loading_lon'),
-                    'unloading_lat': freight.get('unloading_lat'),
-                    'unloading_lon': freight.get('unloading_lon'),
-                    'loading_region': freight.get('loading_region'),
-                    'unloading_region': freight.get('unloading_region')
-                })
-            
             # Используем ON CONFLICT для обработки дубликатов
-            stmt = text("""
-                INSERT INTO freights (
-                    id, hash, loading_city, unloading_city, distance, cargo, weight, 
-                    volume, body_type, loading_date, revenue_rub, profit_per_km,
-                    loading_lat, loading_lon, unloading_lat, unloading_lon,
-                    loading_region, unloading_region
-                ) VALUES (
-                    :id, :hash, :loading_city, :unloading_city, :distance, :cargo, 
-                    :weight, :volume, :body_type, :loading_date, :revenue_rub, 
-                    :profit_per_km, :loading_lat, :loading_lon, :unloading_lat, 
-                    :unloading_lon, :loading_region, :unloading_region
-                )
-                ON CONFLICT (id) 
-                DO UPDATE SET
-                    hash = EXCLUDED.hash,
-                    loading_date = EXCLUDED.loading_date,
-                    revenue_rub = EXCLUDED.revenue_rub,
-                    profit_per_km = EXCLUDED.profit_per_km,
-                    unloading_lat = EXCLUDED.unloading_lat,
-                    unloading_lon = EXCLUDED.unloading_lon
+            stmt = text(f"""
+                INSERT INTO freights ({_STAGE_COLUMNS})
+                VALUES ({', '.join(':' + c for c in _FREIGHT_COLUMNS)})
+                ON CONFLICT (id)
+                DO UPDATE SET {_FREIGHT_UPSERT_SET}
             """)
-            
+
             db.execute(stmt, values)
             logger.info(f"Inserted/updated {len(freights)} freights")
-            
+
     except exc.SQLAlchemyError as e:
         logger.error(f"Error inserting freights: {str(e)}")
         raise
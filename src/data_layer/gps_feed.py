@@ -1,10 +1,20 @@
 
 from __future__ import annotations
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Dict, Iterable, List
 from datetime import datetime
 import sqlite3
+import threading
+import time
 from pathlib import Path
 
+from src.core.geo_utils import haversine_km
+
+# In-process TTL cache over gps_latest: vehicle_id -> (city, expires_at monotonic).
+LATEST_CACHE_TTL_SEC = 30.0
+_latest_cache: Dict[str, Tuple[Optional[str], float]] = {}
+_latest_lock = threading.Lock()
+_migrated_paths: set = set()
+
 # DB path discovery (SQLite) — fallback if config is unavailable.
 def _db_path() -> str:
     try:
@@ -21,6 +31,9 @@ def _conn() -> sqlite3.Connection:
     return conn
 
 def migrate_gps() -> None:
+    path = _db_path()
+    if path in _migrated_paths:
+        return
     conn = _conn()
     cur = conn.cursor()
     cur.execute('''
@@ -34,28 +47,358 @@ def migrate_gps() -> None:
             speed_kmh REAL
         );
     ''')
-    cur.execute('CREATE INDEX IF NOT EXISTS idx_gps_vehicle_ts ON gps_positions(vehicle_id, ts DESC);')
+    # one ascending index (rowid = id is appended implicitly): compaction pages over it in
+    # (vehicle_id, ts, id) order, per-vehicle "latest" reads scan it backwards
+    old = cur.execute("SELECT 1 FROM pragma_index_xinfo('idx_gps_vehicle_ts') WHERE name = 'ts' AND desc = 1").fetchone()
+    if old:
+        cur.execute('DROP INDEX idx_gps_vehicle_ts;')
+    cur.execute('DROP INDEX IF EXISTS idx_gps_vehicle_ts_id;')
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_gps_vehicle_ts ON gps_positions(vehicle_id, ts);')
+    # one row per vehicle, maintained on ingest — replans never scan the history
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS gps_latest (
+            vehicle_id TEXT PRIMARY KEY,
+            ts TEXT NOT NULL,
+            lat REAL,
+            lon REAL,
+            city TEXT,
+            speed_kmh REAL
+        );
+    ''')
+    # backfill once from history (DBs created before gps_latest existed)
+    if cur.execute('SELECT 1 FROM gps_latest LIMIT 1').fetchone() is None:
+        cur.execute('''
+            INSERT OR IGNORE INTO gps_latest(vehicle_id, ts, lat, lon, city, speed_kmh)
+            SELECT p.vehicle_id, p.ts, p.lat, p.lon, p.city, p.speed_kmh
+              FROM gps_positions p
+             WHERE p.id = (SELECT p2.id FROM gps_positions p2
+                            WHERE p2.vehicle_id = p.vehicle_id
+                            ORDER BY p2.ts DESC LIMIT 1)
+        ''')
     conn.commit()
     conn.close()
+    _migrated_paths.add(path)
+
+_UPSERT_LATEST_SQL = '''
+    INSERT INTO gps_latest(vehicle_id, ts, lat, lon, city, speed_kmh) VALUES(?,?,?,?,?,?)
+    ON CONFLICT(vehicle_id) DO UPDATE SET
+        ts=excluded.ts, lat=excluded.lat, lon=excluded.lon,
+        city=excluded.city, speed_kmh=excluded.speed_kmh
+    WHERE excluded.ts >= gps_latest.ts
+'''
+
+def _cache_put(vehicle_id: str, city: Optional[str]) -> None:
+    with _latest_lock:
+        _latest_cache[vehicle_id] = (city, time.monotonic() + LATEST_CACHE_TTL_SEC)
 
-def set_current_position(vehicle_id: str, city: str, lat: float = None, lon: float = None,
+def invalidate_position_cache(vehicle_id: Optional[str] = None) -> None:
+    """Drop cached position for one vehicle (or the whole cache)."""
+    with _latest_lock:
+        if vehicle_id is None:
+            _latest_cache.clear()
+        else:
+            _latest_cache.pop(vehicle_id, None)
+
+def _resolve_city(lat: Optional[float], lon: Optional[float]) -> Optional[str]:
+    if lat is None or lon is None:
+        return None
+    try:
+        from src.core.reverse_geocoder import get_reverse_geocoder
+        return get_reverse_geocoder().city_at(lat, lon)
+    except Exception:
+        return None
+
+def set_current_position(vehicle_id: str, city: Optional[str] = None, lat: float = None, lon: float = None,
                          speed_kmh: float = None, ts: Optional[str] = None) -> None:
     migrate_gps()
     conn = _conn()
     cur = conn.cursor()
-    cur.execute(
-        'INSERT INTO gps_positions(vehicle_id, ts, lat, lon, city, speed_kmh) VALUES(?,?,?,?,?,?)',
-        (vehicle_id, ts or datetime.utcnow().isoformat(timespec="seconds"), lat, lon, city, speed_kmh)
-    )
+    # no city from the tracker -> nearest known city (offline, no geocoding API)
+    city = city or _resolve_city(lat, lon)
+    row = (vehicle_id, ts or datetime.utcnow().isoformat(timespec="seconds"), lat, lon, city, speed_kmh)
+    cur.execute('INSERT INTO gps_positions(vehicle_id, ts, lat, lon, city, speed_kmh) VALUES(?,?,?,?,?,?)', row)
+    cur.execute(_UPSERT_LATEST_SQL, row)
     conn.commit()
     conn.close()
+    # an out-of-order point may not have won the upsert — let the next read refetch
+    invalidate_position_cache(vehicle_id)
+
+def ingest_positions(points: Iterable[dict]) -> int:
+    """Batch ingest: dicts with vehicle_id, ts, lat, lon, city, speed_kmh (all but vehicle_id optional).
+    Missing cities are reverse-geocoded in one pass; history and gps_latest go in one transaction."""
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    pts = [p for p in points if p.get('vehicle_id')]
+    if not pts:
+        return 0
+    need = [i for i, p in enumerate(pts) if not p.get('city') and p.get('lat') is not None and p.get('lon') is not None]
+    resolved: Dict[int, Optional[str]] = {}
+    if need:
+        try:
+            from src.core.reverse_geocoder import get_reverse_geocoder
+            cities = get_reverse_geocoder().cities_at((pts[i]['lat'], pts[i]['lon']) for i in need)
+            resolved = dict(zip(need, cities))
+        except Exception:
+            resolved = {}
+    rows = [(p['vehicle_id'], p.get('ts') or now, p.get('lat'), p.get('lon'),
+             p.get('city') or resolved.get(i), p.get('speed_kmh')) for i, p in enumerate(pts)]
+    migrate_gps()
+    conn = _conn()
+    cur = conn.cursor()
+    cur.executemany('INSERT INTO gps_positions(vehicle_id, ts, lat, lon, city, speed_kmh) VALUES(?,?,?,?,?,?)', rows)
+    cur.executemany(_UPSERT_LATEST_SQL, rows)
+    conn.commit()
+    conn.close()
+    for vid in {r[0] for r in rows}:
+        invalidate_position_cache(vid)
+    return len(rows)
+
+def get_current_cities(vehicle_ids: Iterable[str]) -> Dict[str, Optional[str]]:
+    """Bulk variant of get_current_city: one gps_latest read for all cache misses."""
+    ids: List[str] = list(dict.fromkeys(vehicle_ids))
+    result: Dict[str, Optional[str]] = {}
+    missing: List[str] = []
+    now = time.monotonic()
+    with _latest_lock:
+        for vid in ids:
+            hit = _latest_cache.get(vid)
+            if hit and hit[1] > now:
+                result[vid] = hit[0]
+            else:
+                missing.append(vid)
+    if not missing:
+        return result
 
-def get_current_city(vehicle_id: str) -> Optional[str]:
     migrate_gps()
     conn = _conn()
     cur = conn.cursor()
-    row = cur.execute(
-        'SELECT city FROM gps_positions WHERE vehicle_id = ? ORDER BY ts DESC LIMIT 1', (vehicle_id,)
-    ).fetchone()
+    found: Dict[str, Optional[str]] = {}
+    # stay well below SQLITE_MAX_VARIABLE_NUMBER
+    for i in range(0, len(missing), 500):
+        chunk = missing[i:i + 500]
+        marks = ','.join('?' * len(chunk))
+        for vid, city, lat, lon in cur.execute(
+                f'SELECT vehicle_id, city, lat, lon FROM gps_latest WHERE vehicle_id IN ({marks})', chunk):
+            found[vid] = city or _resolve_city(lat, lon)
     conn.close()
-    return row[0] if row else None
+    for vid in missing:
+        city = found.get(vid)
+        _cache_put(vid, city)
+        result[vid] = city
+    return result
+
+def get_current_city(vehicle_id: str) -> Optional[str]:
+    return get_current_cities([vehicle_id]).get(vehicle_id)
+
+# ---------------------------------------------------------------------
+# History compaction: gps_positions older than N days -> gps_daily
+# ---------------------------------------------------------------------
+MOVING_SPEED_KMH = 5.0      # slower than this counts as standing
+MAX_MOVING_GAP_HOURS = 2.0  # longer gaps between points are not counted as movement
+
+def migrate_gps_daily() -> None:
+    conn = _conn()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS gps_daily (
+            vehicle_id TEXT NOT NULL,
+            day TEXT NOT NULL,               -- YYYY-MM-DD (UTC)
+            points INTEGER NOT NULL DEFAULT 0,
+            km REAL NOT NULL DEFAULT 0,
+            moving_hours REAL NOT NULL DEFAULT 0,
+            first_ts TEXT,
+            last_ts TEXT,
+            first_city TEXT,
+            last_city TEXT,
+            min_lat REAL, max_lat REAL,
+            min_lon REAL, max_lon REAL,
+            PRIMARY KEY (vehicle_id, day)
+        );
+    ''')
+    conn.commit()
+    conn.close()
+
+# merge-upsert: a day compacted twice (late points) accumulates instead of being overwritten
+_UPSERT_DAILY_SQL = '''
+    INSERT INTO gps_daily(vehicle_id, day, points, km, moving_hours, first_ts, last_ts,
+                          first_city, last_city, min_lat, max_lat, min_lon, max_lon)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT(vehicle_id, day) DO UPDATE SET
+        points=gps_daily.points + excluded.points,
+        km=gps_daily.km + excluded.km,
+        moving_hours=gps_daily.moving_hours + excluded.moving_hours,
+        first_city=CASE WHEN excluded.first_ts < gps_daily.first_ts OR gps_daily.first_city IS NULL
+                        THEN COALESCE(excluded.first_city, gps_daily.first_city) ELSE gps_daily.first_city END,
+        last_city=CASE WHEN excluded.last_ts > gps_daily.last_ts OR gps_daily.last_city IS NULL
+                       THEN COALESCE(excluded.last_city, gps_daily.last_city) ELSE gps_daily.last_city END,
+        first_ts=MIN(gps_daily.first_ts, excluded.first_ts),
+        last_ts=MAX(gps_daily.last_ts, excluded.last_ts),
+        min_lat=COALESCE(MIN(gps_daily.min_lat, excluded.min_lat), gps_daily.min_lat, excluded.min_lat),
+        max_lat=COALESCE(MAX(gps_daily.max_lat, excluded.max_lat), gps_daily.max_lat, excluded.max_lat),
+        min_lon=COALESCE(MIN(gps_daily.min_lon, excluded.min_lon), gps_daily.min_lon, excluded.min_lon),
+        max_lon=COALESCE(MAX(gps_daily.max_lon, excluded.max_lon), gps_daily.max_lon, excluded.max_lon)
+'''
+
+class _DayAgg:
+    __slots__ = ('vehicle_id', 'day', 'points', 'km', 'moving_hours', 'first_ts', 'last_ts',
+                 'first_city', 'last_city', 'min_lat', 'max_lat', 'min_lon', 'max_lon',
+                 '_prev', 'ids', 'rows')
+
+    def __init__(self, vehicle_id: str, day: str, keep_rows: bool):
+        self.vehicle_id = vehicle_id
+        self.day = day
+        self.points = 0
+        self.km = 0.0
+        self.moving_hours = 0.0
+        self.first_ts = self.last_ts = None
+        self.first_city = self.last_city = None
+        self.min_lat = self.max_lat = self.min_lon = self.max_lon = None
+        self._prev = None  # (ts datetime, lat, lon)
+        self.ids: List[int] = []
+        self.rows: Optional[list] = [] if keep_rows else None
+
+    def add(self, row: tuple) -> None:
+        row_id, _vid, ts, lat, lon, city, speed = row
+        self.ids.append(row_id)
+        self.points += 1
+        if self.first_ts is None:
+            self.first_ts = ts
+        self.last_ts = ts
+        if city:
+            self.first_city = self.first_city or city
+            self.last_city = city
+        try:
+            t = datetime.fromisoformat(ts)
+        except ValueError:
+            t = None
+        if lat is not None and lon is not None:
+            self.min_lat = lat if self.min_lat is None else min(self.min_lat, lat)
+            self.max_lat = lat if self.max_lat is None else max(self.max_lat, lat)
+            self.min_lon = lon if self.min_lon is None else min(self.min_lon, lon)
+            self.max_lon = lon if self.max_lon is None else max(self.max_lon, lon)
+            if self._prev is not None:
+                pt, plat, plon = self._prev
+                seg_km = haversine_km(plat, plon, lat, lon)
+                self.km += seg_km
+                if t is not None and pt is not None:
+                    dt_h = (t - pt).total_seconds() / 3600.0
+                    if 0 < dt_h <= MAX_MOVING_GAP_HOURS:
+                        v = speed if speed is not None else seg_km / dt_h
+                        if v >= MOVING_SPEED_KMH:
+                            self.moving_hours += dt_h
+            self._prev = (t, lat, lon)
+        if self.rows is not None:
+            self.rows.append(row)
+
+    def as_row(self) -> tuple:
+        return (self.vehicle_id, self.day, self.points, round(self.km, 3), round(self.moving_hours, 4),
+                self.first_ts, self.last_ts, self.first_city, self.last_city,
+                self.min_lat, self.max_lat, self.min_lon, self.max_lon)
+
+def _archive_rows(archive_dir: str, aggs: List[_DayAgg]) -> List[Tuple[Path, Path]]:
+    """Write one page's raw rows to temp gzip JSONL files, one per month.
+    Returns (tmp, final) pairs; they are renamed only after the page's DELETE commits."""
+    import gzip
+    import json
+    Path(archive_dir).mkdir(parents=True, exist_ok=True)
+    by_month: Dict[str, Tuple[int, List[str]]] = {}
+    for a in aggs:
+        for (rid, vid, ts, lat, lon, city, speed) in a.rows or []:
+            first_id, lines = by_month.setdefault(a.day[:7], (rid, []))
+            if rid < first_id:
+                by_month[a.day[:7]] = (rid, lines)
+            lines.append(json.dumps({'vehicle_id': vid, 'ts': ts, 'lat': lat, 'lon': lon,
+                                     'city': city, 'speed_kmh': speed}, ensure_ascii=False))
+    out: List[Tuple[Path, Path]] = []
+    for month, (first_id, lines) in by_month.items():
+        # the smallest archived id names the part: committed iff that row is gone from gps_positions
+        final = Path(archive_dir) / f'gps_positions_{month}.{first_id}.jsonl.gz'
+        tmp = final.with_name(final.name + '.tmp')
+        with gzip.open(tmp, 'wt', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        out.append((tmp, final))
+    return out
+
+def _recover_archive_parts(conn: sqlite3.Connection, archive_dir: str) -> None:
+    """Temp parts left by an interrupted run: publish if their page committed, else drop."""
+    import os
+    for tmp in Path(archive_dir).glob('gps_positions_*.jsonl.gz.tmp'):
+        try:
+            first_id = int(tmp.name.split('.')[1])
+        except (IndexError, ValueError):
+            continue
+        if conn.execute('SELECT 1 FROM gps_positions WHERE id = ?', (first_id,)).fetchone():
+            tmp.unlink()                   # DELETE не закоммичен — строки ещё в таблице
+        else:
+            os.replace(tmp, tmp.with_name(tmp.name[:-len('.tmp')]))
+
+def compact_gps_history(older_than_days: int = 90, chunk_rows: int = 50_000,
+                        archive_dir: Optional[str] = None, vacuum: bool = False) -> Dict[str, int]:
+    """Roll raw positions older than N whole days into gps_daily and delete them.
+
+    Rows are read in keyset pages of ``chunk_rows`` ordered by (vehicle_id, ts). Each page
+    commits the finished (vehicle, day) aggregates together with the deletion of exactly
+    those raw rows (by id), so an interrupted run never double-counts or loses history. With
+    ``archive_dir`` each page's raw rows go to per-month gzip JSONL parts
+    (``gps_positions_YYYY-MM.<first id>.jsonl.gz``), written as temp files and renamed only
+    after the page's DELETE commits.
+    """
+    import os
+    from datetime import timedelta
+    migrate_gps()
+    migrate_gps_daily()
+    cutoff = (datetime.utcnow().date() - timedelta(days=older_than_days)).isoformat()
+    keep_rows = archive_dir is not None
+    stats = {'rows': 0, 'days': 0, 'deleted': 0}
+
+    conn = _conn()
+    cur = conn.cursor()
+    current: Optional[_DayAgg] = None
+    last_key: Tuple[str, str, int] = ('', '', -1)
+    try:
+        if keep_rows and Path(archive_dir).is_dir():
+            _recover_archive_parts(conn, archive_dir)
+        while True:
+            page = cur.execute('''
+                SELECT id, vehicle_id, ts, lat, lon, city, speed_kmh
+                  FROM gps_positions
+                 WHERE ts < ? AND (vehicle_id, ts, id) > (?, ?, ?)
+                 ORDER BY vehicle_id, ts, id
+                 LIMIT ?
+            ''', (cutoff, *last_key, chunk_rows)).fetchall()
+            done: List[_DayAgg] = []
+            for row in page:
+                vid, ts = row[1], row[2]
+                day = ts[:10]
+                if current is None or current.vehicle_id != vid or current.day != day:
+                    if current is not None:
+                        done.append(current)
+                    current = _DayAgg(vid, day, keep_rows)
+                current.add(row)
+            if not page and current is not None:
+                done.append(current)
+                current = None
+            if done:
+                parts = _archive_rows(archive_dir, done) if keep_rows else []
+                try:
+                    cur.executemany(_UPSERT_DAILY_SQL, [a.as_row() for a in done])
+                    # by rowid: exactly the rows that went into the aggregates, late inserts survive
+                    ids = [(i,) for a in done for i in a.ids]
+                    cur.executemany('DELETE FROM gps_positions WHERE id = ?', ids)
+                    conn.commit()
+                except BaseException:
+                    conn.rollback()
+                    for tmp, _ in parts:
+                        tmp.unlink(missing_ok=True)
+                    raise
+                for tmp, final in parts:
+                    os.replace(tmp, final)
+                stats['deleted'] += len(ids)
+                stats['days'] += len(done)
+            if not page:
+                break
+            stats['rows'] += len(page)
+            last_key = (page[-1][1], page[-1][2], page[-1][0])
+        if vacuum and stats['deleted']:
+            conn.execute('VACUUM')
+    finally:
+        conn.close()
+    return stats
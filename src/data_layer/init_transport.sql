@@ -26,3 +26,74 @@ CREATE TABLE IF NOT EXISTS transport (
 CREATE INDEX IF NOT EXISTS idx_transport_loading_city   ON transport(loading_city);
 CREATE INDEX IF NOT EXISTS idx_transport_unloading_main ON transport(unloading_main);
 CREATE INDEX IF NOT EXISTS idx_transport_parsed_at      ON transport(parsed_at DESC);
+
+-- Рейсы транспортного ядра (планировщик trip_store_pg пишет сюда же,
+-- vehicle_availability_mv читает trips.truck_id и trip_segments.dest_region)
+CREATE TABLE IF NOT EXISTS trips (
+    id BIGSERIAL PRIMARY KEY,
+    vehicle_id TEXT,                     -- идентификатор ТС у планировщика
+    truck_id UUID,                       -- trucks.id, если vehicle_id — UUID
+    garage_city TEXT,
+    start_dt TIMESTAMPTZ,
+    end_target_dt TIMESTAMPTZ,
+    status TEXT NOT NULL DEFAULT 'active',   -- active|paused|done|canceled
+    updated_at TIMESTAMPTZ
+);
+
+-- колонки планировщика; IF NOT EXISTS — для баз, где trips создана раньше
+ALTER TABLE trips
+    ADD COLUMN IF NOT EXISTS vehicle_id TEXT,
+    ADD COLUMN IF NOT EXISTS truck_id UUID,
+    ADD COLUMN IF NOT EXISTS garage_city TEXT,
+    ADD COLUMN IF NOT EXISTS start_dt TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS end_target_dt TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'active',
+    ADD COLUMN IF NOT EXISTS freeze_until_dt TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS benefit_threshold_pct REAL NOT NULL DEFAULT 7.5,
+    ADD COLUMN IF NOT EXISTS replan_max_per_day INTEGER NOT NULL DEFAULT 6,
+    ADD COLUMN IF NOT EXISTS actual_km REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS actual_hours REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS actual_revenue REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS plan_km REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS plan_hours REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS plan_revenue REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS plan_revenue_per_day REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS last_replan_at TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_trips_truck_id ON trips(truck_id);
+
+-- Участки рейса (один груз = один участок)
+CREATE TABLE IF NOT EXISTS trip_segments (
+    id BIGSERIAL PRIMARY KEY,
+    trip_id BIGINT NOT NULL REFERENCES trips(id) ON DELETE CASCADE,
+    seq INTEGER,
+    segment_order INTEGER,               -- порядок участка (для MV — тот же seq)
+    loading_city TEXT,
+    unloading_city TEXT,
+    dest_region TEXT,                    -- регион выгрузки -> available_region в MV
+    loading_dt TIMESTAMPTZ,
+    unloading_dt TIMESTAMPTZ,
+    planned_unload_window_start TIMESTAMPTZ,
+    planned_unload_window_end TIMESTAMPTZ,
+    status TEXT NOT NULL DEFAULT 'planned'   -- planned|booked|in_transit|done|canceled
+);
+
+ALTER TABLE trip_segments
+    ADD COLUMN IF NOT EXISTS seq INTEGER,
+    ADD COLUMN IF NOT EXISTS segment_order INTEGER,
+    ADD COLUMN IF NOT EXISTS loading_city TEXT,
+    ADD COLUMN IF NOT EXISTS unloading_city TEXT,
+    ADD COLUMN IF NOT EXISTS dest_region TEXT,
+    ADD COLUMN IF NOT EXISTS loading_dt TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS unloading_dt TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS planned_unload_window_start TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS planned_unload_window_end TIMESTAMPTZ,
+    ADD COLUMN IF NOT EXISTS empty_km_before REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS distance_km REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS revenue REAL NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'planned',
+    ADD COLUMN IF NOT EXISTS locked INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS note TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_trip_segments_trip_seq ON trip_segments(trip_id, seq);
@@ -1,6 +1,6 @@
 import redis
 import json
-from typing import Optional, Any
+from typing import Optional, Any, List
 import logging
 import os
 
@@ -65,6 +65,23 @@ class RedisManager:
             logging.error(f"Ошибка проверки дубликата для хеша {unique_hash}: {e}")
             return False
 
+    def mark_seen_many(self, hashes: List[str], ttl_seconds: int = 7 * 24 * 3600) -> List[bool]:
+        """Пакетный is_duplicate: все SET NX EX одним pipeline (один round trip).
+        Возвращает список флагов "дубликат" в порядке hashes; повтор внутри пакета — дубликат."""
+        if not hashes:
+            return []
+        if not self.redis_client:
+            return [False] * len(hashes)
+
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for unique_hash in hashes:
+                pipe.set(f"{self.hash_key_prefix}{unique_hash}", "1", nx=True, ex=ttl_seconds)
+            return [result is None for result in pipe.execute()]
+        except redis.RedisError as e:
+            logging.error(f"Ошибка пакетной проверки дубликатов ({len(hashes)} хешей): {e}")
+            return [False] * len(hashes)
+
     def cache_data(self, key: str, data: Any, ttl_seconds: int = 3600) -> None:
         """Универсальный метод для кэширования любых данных"""
         if not self.redis_client:
@@ -2,10 +2,11 @@
 from __future__ import annotations
 from typing import List, Optional, Iterable
 from datetime import datetime
+import os
 import sqlite3
 from pathlib import Path
 
-from src.core.trip_models import Trip, TripMetrics, Segment
+from src.core.trip_models import Trip, TripMetrics, Segment, PlanCommit
 
 def _db_path() -> str:
     try:
@@ -136,25 +137,53 @@ def update_trip_actual(trip_id: int, km: float, hours: float, revenue: float) ->
     conn.commit()
     conn.close()
 
-def replace_plan(trip_id: int, segments: List[Segment], plan_metrics: TripMetrics) -> None:
+_INSERT_SEGMENT_SQL = '''
+    INSERT INTO trip_segments(trip_id, seq, loading_city, unloading_city, loading_dt, unloading_dt,
+                              empty_km_before, distance_km, revenue, status, locked, note)
+    VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
+'''
+
+def _write_plan_commits(cur: sqlite3.Cursor, commits: List[PlanCommit]) -> None:
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    replaced = [c for c in commits if c.accepted and c.plan_metrics is not None]
+    if replaced:
+        cur.executemany("DELETE FROM trip_segments WHERE trip_id=? AND status='planned'",
+                        [(c.trip_id,) for c in replaced])
+        cur.executemany(_INSERT_SEGMENT_SQL, [
+            (c.trip_id, s.seq, s.loading_city, s.unloading_city, s.loading_dt, s.unloading_dt,
+             s.empty_km_before, s.distance_km, s.revenue, s.status, s.locked, s.note)
+            for c in replaced for s in c.segments
+        ])
+        cur.executemany('''
+            UPDATE trips
+               SET plan_km=?, plan_hours=?, plan_revenue=?, plan_revenue_per_day=?, last_replan_at=?, updated_at=?
+             WHERE id=?
+        ''', [(c.plan_metrics.km, c.plan_metrics.hours, c.plan_metrics.revenue, c.plan_metrics.revenue_per_day,
+               now, now, c.trip_id) for c in replaced])
+    cur.executemany('''
+        INSERT INTO replan_log(trip_id, ts, accepted, delta_revenue_per_day, reason)
+        VALUES(?,?,?,?,?)
+    ''', [(c.trip_id, now, 1 if c.accepted else 0, c.delta_revenue_per_day, c.reason)
+          for c in commits if c.log])
+
+def commit_plans(commits: List[PlanCommit]) -> None:
+    """Persist many replan outcomes atomically: segment swap, plan metrics and replan_log
+    for every trip in a single transaction (one commit for the whole batch)."""
+    if not commits:
+        return
     conn = _conn()
-    cur = conn.cursor()
-    cur.execute('DELETE FROM trip_segments WHERE trip_id=? AND status IN ("planned")', (trip_id,))
-    for s in segments:
-        cur.execute('''
-            INSERT INTO trip_segments(trip_id, seq, loading_city, unloading_city, loading_dt, unloading_dt,
-                                      empty_km_before, distance_km, revenue, status, locked, note)
-            VALUES(?,?,?,?,?,?,?,?,?,?,?,?)
-        ''', (trip_id, s.seq, s.loading_city, s.unloading_city, s.loading_dt, s.unloading_dt,
-              s.empty_km_before, s.distance_km, s.revenue, s.status, s.locked, s.note))
-    cur.execute('''
-        UPDATE trips
-           SET plan_km=?, plan_hours=?, plan_revenue=?, plan_revenue_per_day=?, last_replan_at=?, updated_at=?
-         WHERE id=?
-    ''', (plan_metrics.km, plan_metrics.hours, plan_metrics.revenue, plan_metrics.revenue_per_day,
-          datetime.utcnow().isoformat(timespec="seconds"), datetime.utcnow().isoformat(timespec="seconds"), trip_id))
-    conn.commit()
-    conn.close()
+    try:
+        with conn:
+            _write_plan_commits(conn.cursor(), commits)
+    finally:
+        conn.close()
+
+def commit_plan(commit: PlanCommit) -> None:
+    commit_plans([commit])
+
+def replace_plan(trip_id: int, segments: List[Segment], plan_metrics: TripMetrics) -> None:
+    commit_plans([PlanCommit(trip_id=trip_id, accepted=True, segments=segments,
+                             plan_metrics=plan_metrics, log=False)])
 
 def list_locked_segments(trip_id: int) -> List[Segment]:
     conn = _conn()
@@ -175,11 +204,17 @@ def list_locked_segments(trip_id: int) -> List[Segment]:
     return result
 
 def log_replan(trip_id: int, accepted: bool, delta_revenue_per_day: float, reason: str = "") -> None:
-    conn = _conn()
-    cur = conn.cursor()
-    cur.execute('''
-        INSERT INTO replan_log(trip_id, ts, accepted, delta_revenue_per_day, reason)
-        VALUES(?,?,?,?,?)
-    ''', (trip_id, datetime.utcnow().isoformat(timespec="seconds"), 1 if accepted else 0, delta_revenue_per_day, reason))
-    conn.commit()
-    conn.close()
+    # log only: no plan_metrics -> trip plan untouched
+    commit_plans([PlanCommit(trip_id=trip_id, accepted=accepted,
+                             delta_revenue_per_day=delta_revenue_per_day, reason=reason)])
+
+# ---------------------------------------------------------------------
+# Backend: TRIP_STORE=postgres переключает API на Postgres (trip_store_pg) —
+# планировщик пишет туда же, откуда читает vehicle_availability_mv.
+# replace_plan/log_replan/commit_plan идут через commit_plans и переключаются вместе с ним.
+# ---------------------------------------------------------------------
+TRIP_STORE = os.getenv("TRIP_STORE", "sqlite").strip().lower()
+if TRIP_STORE in ("postgres", "postgresql", "pg"):
+    from src.data_layer.trip_store_pg import (  # noqa: F811
+        migrate, create_trip, get_trip, update_trip_actual, commit_plans, list_locked_segments,
+    )
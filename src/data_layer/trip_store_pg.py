@@ -0,0 +1,239 @@
+
+from __future__ import annotations
+from typing import Dict, List, Optional, Any
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import threading
+from pathlib import Path
+
+from src.core.trip_models import Trip, TripMetrics, Segment, PlanCommit
+
+# Postgres-реализация trip_repo (включается TRIP_STORE=postgres).
+# Пишет в те же public.trips / public.trip_segments, что читает vehicle_availability_mv;
+# схема этих таблиц — транспортное ядро (init_transport.sql), здесь своя только replan_log.
+# trip_segments.segment_order, planned_unload_window_end и dest_region (регион выгрузки)
+# заполняются из плана, trips.truck_id — из vehicle_id, если это UUID.
+
+def _dsn() -> str:
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    pg_user = os.getenv("POSTGRES_USER", "admin")
+    pg_pass = os.getenv("POSTGRES_PASSWORD", "password")
+    pg_host = os.getenv("POSTGRES_HOST", "postgres")
+    pg_port = os.getenv("POSTGRES_PORT", "5432")
+    pg_db = os.getenv("POSTGRES_DB", "foxproflow")
+    return f"postgresql://{pg_user}:{pg_pass}@{pg_host}:{pg_port}/{pg_db}"
+
+POOL_MIN = int(os.getenv("TRIP_STORE_POOL_MIN", "1"))
+POOL_MAX = int(os.getenv("TRIP_STORE_POOL_MAX", "10"))
+
+_pool: Any = None
+_pool_kind: Optional[str] = None  # 'psycopg' | 'psycopg2'
+_pool_lock = threading.Lock()
+_migrated = False
+
+def _get_pool():
+    """Пул соединений: psycopg_pool (v3), иначе psycopg2.pool."""
+    global _pool, _pool_kind
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    from psycopg_pool import ConnectionPool  # psycopg 3
+                    _pool = ConnectionPool(_dsn(), min_size=POOL_MIN, max_size=POOL_MAX, open=True)
+                    _pool_kind = "psycopg"
+                except ImportError:
+                    from psycopg2.pool import ThreadedConnectionPool  # type: ignore
+                    _pool = ThreadedConnectionPool(POOL_MIN, POOL_MAX, _dsn())
+                    _pool_kind = "psycopg2"
+    return _pool
+
+@contextmanager
+def _tx():
+    """Соединение из пула в одной транзакции: commit при успехе, rollback при ошибке."""
+    pool = _get_pool()
+    if _pool_kind == "psycopg":
+        with pool.connection() as conn:  # psycopg_pool коммитит/откатывает сам
+            yield conn
+        return
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+def _executemany(cur, sql: str, rows: List[tuple]) -> None:
+    """Батч на стороне сервера: psycopg3 executemany идёт pipeline-ом, для psycopg2 — execute_batch."""
+    if not rows:
+        return
+    if _pool_kind == "psycopg2":
+        from psycopg2.extras import execute_batch  # type: ignore
+        execute_batch(cur, sql, rows, page_size=500)
+    else:
+        cur.executemany(sql, rows)
+
+def _iso(v) -> Optional[str]:
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.isoformat(timespec="seconds")
+    return str(v)
+
+TRANSPORT_DDL_PATH = Path(__file__).with_name("init_transport.sql")
+
+_REPLAN_LOG_DDL = '''
+    CREATE TABLE IF NOT EXISTS public.replan_log (
+        id BIGSERIAL PRIMARY KEY,
+        trip_id BIGINT NOT NULL REFERENCES public.trips(id) ON DELETE CASCADE,
+        ts TIMESTAMPTZ NOT NULL DEFAULT now(),
+        accepted BOOLEAN NOT NULL,
+        delta_revenue_per_day REAL NOT NULL,
+        reason TEXT
+    )
+'''
+
+def migrate() -> None:
+    global _migrated
+    if _migrated:
+        return
+    with _tx() as conn:
+        cur = conn.cursor()
+        # trips / trip_segments — DDL транспортного ядра (идемпотентный), не своя копия
+        cur.execute(TRANSPORT_DDL_PATH.read_text(encoding="utf-8-sig"))
+        cur.execute(_REPLAN_LOG_DDL)
+    _migrated = True
+
+def create_trip(vehicle_id: str, garage_city: str, start_dt: str, end_target_dt: Optional[str] = None,
+                benefit_threshold_pct: float = 7.5, replan_max_per_day: int = 6) -> int:
+    migrate()
+    with _tx() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            INSERT INTO public.trips(vehicle_id, truck_id, garage_city, start_dt, end_target_dt,
+                                     benefit_threshold_pct, replan_max_per_day, updated_at)
+            VALUES(%s,
+                   CASE WHEN %s ~* '^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$'
+                        THEN %s::uuid END,
+                   %s, %s, %s, %s, %s, now())
+            RETURNING id
+        ''', (vehicle_id, vehicle_id, vehicle_id, garage_city, start_dt, end_target_dt,
+              benefit_threshold_pct, replan_max_per_day))
+        return int(cur.fetchone()[0])
+
+def get_trip(trip_id: int) -> Optional[Trip]:
+    migrate()
+    with _tx() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT id, vehicle_id, garage_city, start_dt, end_target_dt, status, freeze_until_dt,
+                   benefit_threshold_pct, replan_max_per_day,
+                   actual_km, actual_hours, actual_revenue,
+                   plan_km, plan_hours, plan_revenue, plan_revenue_per_day,
+                   last_replan_at
+            FROM public.trips WHERE id=%s
+        ''', (trip_id,))
+        row = cur.fetchone()
+    if not row:
+        return None
+    (tid, vehicle_id, garage_city, start_dt, end_target_dt, status, freeze_until_dt,
+     benefit_threshold_pct, replan_max_per_day,
+     a_km, a_h, a_rev, p_km, p_h, p_rev, p_rpd, last_replan_at) = row
+    return Trip(
+        id=tid, vehicle_id=vehicle_id, garage_city=garage_city,
+        start_dt=_iso(start_dt), end_target_dt=_iso(end_target_dt), status=status,
+        freeze_until_dt=_iso(freeze_until_dt),
+        benefit_threshold_pct=benefit_threshold_pct, replan_max_per_day=replan_max_per_day,
+        metrics_actual=TripMetrics(a_km, a_h, a_rev),
+        metrics_plan=TripMetrics(p_km, p_h, p_rev),
+        plan_revenue_per_day=p_rpd, last_replan_at=_iso(last_replan_at)
+    )
+
+def update_trip_actual(trip_id: int, km: float, hours: float, revenue: float) -> None:
+    migrate()
+    with _tx() as conn:
+        conn.cursor().execute('''
+            UPDATE public.trips
+               SET actual_km=%s, actual_hours=%s, actual_revenue=%s, updated_at=now()
+             WHERE id=%s
+        ''', (km, hours, revenue, trip_id))
+
+_INSERT_SEGMENT_SQL = '''
+    INSERT INTO public.trip_segments(trip_id, seq, segment_order, loading_city, unloading_city,
+                                     dest_region, loading_dt, unloading_dt, planned_unload_window_end,
+                                     empty_km_before, distance_km, revenue, status, locked, note)
+    VALUES(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+'''
+
+# самый частый регион выгрузки по городу — один запрос на пачку городов
+_CITY_REGION_SQL = '''
+    SELECT DISTINCT ON (unloading_city) unloading_city, unloading_region
+      FROM public.freights
+     WHERE unloading_city = ANY(%s) AND COALESCE(unloading_region, '') <> ''
+     GROUP BY unloading_city, unloading_region
+     ORDER BY unloading_city, COUNT(*) DESC
+'''
+
+def _dest_regions(cur, segments: List[Segment]) -> Dict[str, str]:
+    """unloading_city -> region for segments the plan left without unloading_region."""
+    cities = sorted({s.unloading_city for s in segments if not s.unloading_region and s.unloading_city})
+    if not cities:
+        return {}
+    cur.execute(_CITY_REGION_SQL, (cities,))
+    return dict(cur.fetchall())
+
+def commit_plans(commits: List[PlanCommit]) -> None:
+    """Same contract as the SQLite trip_repo.commit_plans: one transaction for the batch."""
+    if not commits:
+        return
+    migrate()
+    replaced = [c for c in commits if c.accepted and c.plan_metrics is not None]
+    with _tx() as conn:
+        cur = conn.cursor()
+        if replaced:
+            cur.execute("DELETE FROM public.trip_segments WHERE trip_id = ANY(%s) AND status='planned'",
+                        ([c.trip_id for c in replaced],))
+            # dest_region: регион выгрузки из плана, иначе — по городу; по последнему участку
+            # vehicle_availability_mv берёт available_region
+            regions = _dest_regions(cur, [s for c in replaced for s in c.segments])
+            _executemany(cur, _INSERT_SEGMENT_SQL, [
+                (c.trip_id, s.seq, s.seq, s.loading_city, s.unloading_city,
+                 s.unloading_region or regions.get(s.unloading_city),
+                 s.loading_dt, s.unloading_dt, s.unloading_dt, s.empty_km_before, s.distance_km, s.revenue,
+                 s.status, s.locked, s.note)
+                for c in replaced for s in c.segments
+            ])
+            _executemany(cur, '''
+                UPDATE public.trips
+                   SET plan_km=%s, plan_hours=%s, plan_revenue=%s, plan_revenue_per_day=%s,
+                       last_replan_at=now(), updated_at=now()
+                 WHERE id=%s
+            ''', [(c.plan_metrics.km, c.plan_metrics.hours, c.plan_metrics.revenue,
+                   c.plan_metrics.revenue_per_day, c.trip_id) for c in replaced])
+        _executemany(cur, '''
+            INSERT INTO public.replan_log(trip_id, accepted, delta_revenue_per_day, reason)
+            VALUES(%s,%s,%s,%s)
+        ''', [(c.trip_id, bool(c.accepted), c.delta_revenue_per_day, c.reason) for c in commits if c.log])
+
+def list_locked_segments(trip_id: int) -> List[Segment]:
+    migrate()
+    with _tx() as conn:
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT seq, loading_city, unloading_city, loading_dt, unloading_dt,
+                   empty_km_before, distance_km, revenue, status, locked, note, dest_region
+            FROM public.trip_segments
+            WHERE trip_id=%s AND locked=1 AND status IN ('planned','booked','in_transit')
+            ORDER BY seq ASC
+        ''', (trip_id,))
+        rows = cur.fetchall()
+    return [Segment(trip_id=trip_id, seq=seq, loading_city=lc, unloading_city=uc,
+                    loading_dt=_iso(ldt), unloading_dt=_iso(udt), empty_km_before=ekm,
+                    distance_km=dkm, revenue=rev, status=status, locked=locked, note=note,
+                    unloading_region=region)
+            for (seq, lc, uc, ldt, udt, ekm, dkm, rev, status, locked, note, region) in rows]
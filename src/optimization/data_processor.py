@@ -3,17 +3,29 @@ import json
 import os
 import logging
 import re
-from typing import List, Tuple, Dict, Any, Optional
+from collections import deque
+from functools import lru_cache
+from itertools import islice
+from typing import List, Tuple, Dict, Any, Optional, Iterable, Iterator
 from datetime import datetime
-from models import Freight
+from dataclasses import fields
+from models import Freight, FreightRecord
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def extract_price(price_str: str) -> float:
+_PRICE_JUNK_RE = re.compile(r'[^\d.,]')
+_SPACES_RE = re.compile(r'\s+')
+_PARENS_RE = re.compile(r'[()]')
+_CITY_PREFIXES = ("г.", "п.", "д.", "с.", "рп.", "ст.", "ж/д", "н.п.", "пгт.")
+
+# ATI повторяет одни и те же строки городов/цен постоянно — разбор кэшируется по сырой строке
+PARSE_CACHE_SIZE = 200_000
+
+def _parse_price(price_str: str) -> float:
     if not price_str or price_str.strip() in ['-', '']:
         return 0.0
     try:
-        clean_str = re.sub(r'[^\d.,]', '', price_str)
+        clean_str = _PRICE_JUNK_RE.sub('', price_str)
         clean_str = clean_str.replace(',', '.').replace(' ', '')
         if clean_str.count('.') > 1:
             parts = clean_str.split('.')
@@ -22,6 +34,14 @@ def extract_price(price_str: str) -> float:
     except ValueError:
         return 0.0
 
+_parse_price_cached = lru_cache(maxsize=PARSE_CACHE_SIZE)(_parse_price)
+
+def extract_price(price_str: str) -> float:
+    # lru_cache хэширует аргумент: не-строки (список/dict из кривой выгрузки) идут мимо кэша
+    if isinstance(price_str, str):
+        return _parse_price_cached(price_str)
+    return _parse_price(price_str)
+
 def safe_float_convert(value, default=0.0):
     if value is None or str(value).strip() in ['-', 'N/A', '']:
         return default
@@ -31,20 +51,19 @@ def safe_float_convert(value, default=0.0):
     except (ValueError, TypeError):
         return default
 
-def extract_city_and_region(location: str) -> Tuple[str, str]:
+def _parse_city_and_region(location: str) -> Tuple[str, str]:
     if not location:
         return "", ""
-    location = re.sub(r'\s+', ' ', location).strip()
+    location = _SPACES_RE.sub(' ', location).strip()
     region = ""
     if '(' in location:
-        parts = re.split(r'[()]', location)
+        parts = _PARENS_RE.split(location)
         location = parts[0].strip()
         if len(parts) > 1:
             region = parts[1].strip()
     parts = [p.strip() for p in location.split(',') if p.strip()]
     city = parts[0] if parts else ""
-    prefixes = ["г.", "п.", "д.", "с.", "рп.", "ст.", "ж/д", "н.п.", "пгт."]
-    for prefix in prefixes:
+    for prefix in _CITY_PREFIXES:
         if city.startswith(prefix):
             city = city.replace(prefix, "").strip()
             break
@@ -54,6 +73,13 @@ def extract_city_and_region(location: str) -> Tuple[str, str]:
         region = parts[1].strip()
     return city, region
 
+_parse_city_and_region_cached = lru_cache(maxsize=PARSE_CACHE_SIZE)(_parse_city_and_region)
+
+def extract_city_and_region(location: str) -> Tuple[str, str]:
+    if isinstance(location, str):
+        return _parse_city_and_region_cached(location)
+    return _parse_city_and_region(location)
+
 def parse_loading_dt(loading_date_str: Optional[str], default_hour: int = 8) -> Optional[str]:
     """Convert 'YYYY-MM-DD' -> 'YYYY-MM-DDTHH:00:00'. Returns None if cannot parse."""
     if not loading_date_str:
@@ -75,7 +101,9 @@ def parse_loading_dt(loading_date_str: Optional[str], default_hour: int = 8) ->
     except Exception:
         return None
 
-def process_freight(raw_freight: dict) -> Freight:
+_RECORD_FIELDS = frozenset(f.name for f in fields(FreightRecord))
+
+def _freight_kwargs(raw_freight: dict) -> Dict[str, Any]:
     data = raw_freight.copy()
     prices = {}
     price_data = data.pop("prices", {})
@@ -104,9 +132,9 @@ def process_freight(raw_freight: dict) -> Freight:
         if city:
             unloading_points.append(city)
             unloading_regions.append(region)
-    loading_date_str = data.get("loading_date")
-    return Freight(
-        **data,
+    loading_date_str = data.pop("loading_date", None)
+    return dict(
+        data,
         loading_points=loading_points,
         unloading_points=unloading_points,
         weight=weight,
@@ -119,3 +147,100 @@ def process_freight(raw_freight: dict) -> Freight:
         loading_date=loading_date_str or "",
         loading_dt=parse_loading_dt(loading_date_str)
     )
+
+def process_freight(raw_freight: dict) -> Freight:
+    return Freight(**_freight_kwargs(raw_freight))
+
+_REQUIRED_STR_FIELDS = ('cargo', 'loading_date')
+_OPTIONAL_STR_FIELDS = ('loading_dt', 'body_type', 'loading_method', 'possible_reload',
+                        'loading_region', 'unloading_region')
+_OPTIONAL_FLOAT_FIELDS = ('revenue_rub', 'loading_lat', 'loading_lon', 'unloading_lat', 'unloading_lon')
+
+def _check_record_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """Те проверки, что раньше делал pydantic Freight: обязательные строки не None, id — строка,
+       числа — float. Ошибка -> ValueError/TypeError, строка пропускается как раньше."""
+    if kwargs.get('id') is None:
+        raise ValueError("id is required")
+    kwargs['id'] = str(kwargs['id'])
+    for name in _REQUIRED_STR_FIELDS:
+        value = kwargs.get(name)
+        if not isinstance(value, str):
+            raise TypeError(f"{name} must be str, got {type(value).__name__}")
+    for name in _OPTIONAL_STR_FIELDS:
+        value = kwargs.get(name)
+        if value is not None and not isinstance(value, str):
+            raise TypeError(f"{name} must be str or None, got {type(value).__name__}")
+    for name in _OPTIONAL_FLOAT_FIELDS:
+        if kwargs.get(name) is not None:
+            kwargs[name] = float(kwargs[name])
+    details = kwargs.get('details')
+    if details is not None and not isinstance(details, list):
+        raise TypeError(f"details must be list, got {type(details).__name__}")
+    return kwargs
+
+def process_freight_record(raw_freight: dict) -> FreightRecord:
+    """Same normalization as process_freight into a slotted FreightRecord (no pydantic, but the
+       same cheap field checks); unknown keys are dropped, bad or missing required ones raise."""
+    kwargs = _check_record_kwargs(_freight_kwargs(raw_freight))
+    return FreightRecord(**{k: v for k, v in kwargs.items() if k in _RECORD_FIELDS})
+
+def parser_record_to_raw(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Parser JSONL record -> process_freight input. Records of ati_parser keep the page
+    fields under 'raw' (top level is the normalized view); plain raw dicts pass through."""
+    raw = record.get('raw')
+    if not isinstance(raw, dict):
+        return record
+    return {
+        'id': str(raw.get('id') or record.get('hash') or ''),
+        'loading_points': raw.get('loading_points') or [],
+        'unloading_points': raw.get('unloading_points') or [],
+        'distance': raw.get('distance'),
+        'cargo': raw.get('cargo') or record.get('cargo') or '',
+        'weight': raw.get('weight_text'),
+        'volume': raw.get('volume_text'),
+        'prices': raw.get('prices') or {},
+        'loading_date': raw.get('loading_date_text') or record.get('loading_date') or '',
+        'body_type': raw.get('body_type_text') or record.get('body_type') or 'n/a',
+        'loading_method': raw.get('loading_method_text') or 'n/a',
+        'possible_reload': raw.get('possible_reload') or 'n/a',
+    }
+
+def _process_chunk(raws: List[dict]) -> List[Optional[FreightRecord]]:
+    out: List[Optional[FreightRecord]] = []
+    for raw in raws:
+        try:
+            out.append(process_freight_record(raw))
+        except Exception as e:
+            logging.debug(f"Пропуск груза {raw.get('id') if isinstance(raw, dict) else raw!r}: {e}")
+            out.append(None)
+    return out
+
+def process_freights(raw_freights: Iterable[dict], workers: int = 0,
+                     chunk_size: int = 2000) -> Iterator[FreightRecord]:
+    """Streaming process_freight_record over any iterable (rows that fail to normalize are skipped).
+       Yields FreightRecord.
+       workers > 1 fans chunks out to a process pool (for large backfills); order is kept and
+       at most 2 * workers chunks are in flight, so memory stays bounded."""
+    it = iter(raw_freights)
+    if workers <= 1:
+        for raw in it:
+            try:
+                yield process_freight_record(raw)
+            except Exception as e:
+                logging.debug(f"Пропуск груза {raw.get('id') if isinstance(raw, dict) else raw!r}: {e}")
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(islice(it, chunk_size))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_process_chunk, chunk))
+            if not pending:
+                break
+            for freight in pending.popleft().result():
+                if freight is not None:
+                    yield freight
@@ -0,0 +1,121 @@
+import os
+import time
+import logging
+from typing import Any, Callable, Dict, List, Optional
+from models import FreightRecord
+from data_processor import process_freights, parser_record_to_raw
+from jsonl_tail import OffsetCheckpoint, iter_jsonl_batches, list_jsonl_files, logical_size
+
+# Потоковая загрузка JSONL-выгрузок парсеров в freights.
+# Файл читается кусками по chunk_size целых строк -> process_freights -> upsert куском;
+# смещение файла фиксируется в checkpoint только после успешной записи куска,
+# поэтому повторный запуск продолжает с места остановки, а память не зависит от объёма.
+
+DEFAULT_REGIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'parsers', 'regions_data')
+DEFAULT_CHECKPOINT_PATH = os.path.join(DEFAULT_REGIONS_DIR, 'ingest_offsets.json')
+DEFAULT_CHUNK_SIZE = 5000
+REPORT_EVERY_SEC = 10.0
+
+logger = logging.getLogger('FreightIngest')
+
+Sink = Callable[[List[FreightRecord]], int]
+
+
+def freight_to_row(f: FreightRecord) -> Dict[str, Any]:
+    """FreightRecord -> row dict of src.data_layer.database.insert_freights_batch (Postgres)."""
+    revenue = f.revenue_rub or 0.0
+    return {
+        'id': f.id,
+        'hash': None,
+        'loading_city': f.loading_points[0] if f.loading_points else '',
+        'unloading_city': f.unloading_points[0] if f.unloading_points else '',
+        'distance': f.distance,
+        'cargo': f.cargo,
+        'weight': f.weight,
+        'volume': f.volume,
+        'body_type': (f.body_type or 'n/a').lower(),
+        'loading_date': f.loading_date,
+        'revenue_rub': revenue,
+        'profit_per_km': revenue / f.distance if f.distance > 0 else 0.0,
+        'loading_lat': f.loading_lat,
+        'loading_lon': f.loading_lon,
+        'unloading_lat': f.unloading_lat,
+        'unloading_lon': f.unloading_lon,
+        'loading_region': f.loading_region,
+        'unloading_region': f.unloading_region,
+    }
+
+
+def sqlite_sink(freights: List[FreightRecord]) -> int:
+    from database import insert_freights_batch
+    return insert_freights_batch(freights)
+
+def pg_sink(freights: List[FreightRecord]) -> int:
+    from src.data_layer.database import insert_freights_batch
+    insert_freights_batch([freight_to_row(f) for f in freights])   # raises on error
+    return len(freights)
+
+SINKS: Dict[str, Sink] = {'sqlite': sqlite_sink, 'pg': pg_sink}
+
+
+def ingest_jsonl(source: str = DEFAULT_REGIONS_DIR,
+                 checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+                 sink: Optional[Sink] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Stream every *.jsonl / *.jsonl.gz under source (or the single file) into freights, resuming from
+       checkpointed byte offsets. Returns {'files', 'lines', 'freights', 'written', 'bad',
+       'seconds', 'rows_per_sec'}; stops at the first chunk the sink fails to write."""
+    sink = sink or sqlite_sink
+    checkpoint = OffsetCheckpoint(checkpoint_path)
+    stats: Dict[str, Any] = {'files': 0, 'lines': 0, 'freights': 0, 'written': 0, 'bad': 0}
+    started = last_report = time.monotonic()
+
+    for path in list_jsonl_files(source):
+        offset = checkpoint.get(path)
+        try:
+            size = logical_size(path)
+        except OSError:
+            continue
+        if size < offset:
+            offset = 0             # файл пересоздан/обрезан
+        if offset >= size:
+            continue
+        stats['files'] += 1
+        for records, new_offset in iter_jsonl_batches(path, offset, chunk_size, stats):
+            freights = list(process_freights(parser_record_to_raw(r) for r in records))
+            stats['bad'] += len(records) - len(freights)
+            stats['freights'] += len(freights)
+            if freights:
+                written = sink(freights)
+                if not written:
+                    logger.error(f"Кусок {path}@{offset} не записан — останов, смещение не сдвинуто")
+                    return _finish(stats, started)
+                stats['written'] += written
+            offset = new_offset
+            checkpoint.set(path, offset)
+            checkpoint.save()
+            now = time.monotonic()
+            if now - last_report >= REPORT_EVERY_SEC:
+                last_report = now
+                logger.info(f"Ingest: {stats['written']} строк, {stats['written'] / (now - started):.0f} rows/s")
+    return _finish(stats, started)
+
+def _finish(stats: Dict[str, Any], started: float) -> Dict[str, Any]:
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    stats['rows_per_sec'] = round(stats['written'] / stats['seconds'], 1) if stats['seconds'] else 0.0
+    logger.info(f"Ingest завершён: файлов {stats['files']}, строк {stats['lines']}, записано {stats['written']}, "
+                f"пропущено {stats['bad']}, {stats['seconds']} c, {stats['rows_per_sec']} rows/s")
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ap = argparse.ArgumentParser(description="Stream parser JSONL output into freights")
+    ap.add_argument('source', nargs='?', default=DEFAULT_REGIONS_DIR)
+    ap.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH)
+    ap.add_argument('--target', choices=sorted(SINKS), default='sqlite')
+    ap.add_argument('--chunk', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = ap.parse_args()
+    ingest_jsonl(args.source, args.checkpoint, SINKS[args.target], args.chunk)
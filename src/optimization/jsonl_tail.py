@@ -0,0 +1,189 @@
+import os
+import json
+import glob
+import io
+import zlib
+import struct
+import logging
+from typing import Any, Dict, Iterator, List, Tuple
+
+# Чтение JSONL-выгрузок парсера с сохранением смещений (общая часть surge_stream и
+# freight_ingest). Читаются только целые строки: недописанный хвост файла остаётся
+# на следующий проход, смещение в checkpoint всегда указывает на начало строки.
+# Завершённые *.jsonl.gz (jsonl_sink с gzip) читаются так же; смещение — в несжатом потоке.
+
+MAX_LINE_BYTES = 1 << 20          # битая/недописанная строка длиннее — пропускаем
+
+logger = logging.getLogger('JsonlTail')
+
+
+def list_jsonl_files(root: str) -> List[str]:
+    """*.jsonl / *.jsonl.gz under root (recursively), or [root] when root is a file."""
+    if os.path.isfile(root):
+        return [root]
+    return sorted(glob.glob(os.path.join(root, '**', '*.jsonl'), recursive=True)
+                  + glob.glob(os.path.join(root, '**', '*.jsonl.gz'), recursive=True))
+
+_SYNC_FLUSH_MARKER = b'\x00\x00\xff\xff'
+_decoded_sizes: Dict[str, Tuple[Tuple[float, int], int]] = {}
+
+def logical_size(path: str) -> int:
+    """Size of the uncompressed stream: file size, for .gz — ISIZE from the gzip trailer
+    (mod 2**32; jsonl_sink rotates well below that). A .gz cut after a sync flush has no
+    trailer: its size up to the last complete line is decoded once and cached per (mtime, size)."""
+    if not path.endswith('.gz'):
+        return os.path.getsize(path)
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        if st.st_size < 4:
+            return 0
+        f.seek(-4, os.SEEK_END)
+        tail = f.read(4)
+    if tail != _SYNC_FLUSH_MARKER:
+        return struct.unpack('<I', tail)[0]
+    stamp = (st.st_mtime, st.st_size)
+    cached = _decoded_sizes.get(path)
+    if cached is None or cached[0] != stamp:
+        size = complete = 0           # хвост без '\n' уже не допишут — в размер не входит
+        with _GzipStream(path) as g:
+            buf = bytearray(1 << 16)
+            while True:
+                try:
+                    n = g.readinto(buf)
+                except zlib.error:
+                    break
+                if not n:
+                    break
+                nl = buf.rfind(b'\n', 0, n)
+                if nl >= 0:
+                    complete = size + nl + 1
+                size += n
+        size = complete
+        cached = _decoded_sizes[path] = (stamp, size)
+    return cached[1]
+
+class _GzipStream(io.RawIOBase):
+    """Forward-only gzip reader that returns everything decodable: a file cut after the last
+    checkpoint (Z_SYNC_FLUSH, no trailer) just ends instead of raising EOFError."""
+
+    def __init__(self, path: str):
+        self._f = open(path, 'rb')
+        self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buf = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buf:
+            if self._d.eof and self._d.unused_data:        # следующий gzip member
+                tail = self._d.unused_data
+                self._d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                self._buf = self._d.decompress(tail)
+                continue
+            chunk = self._f.read(1 << 16)
+            if not chunk:
+                return 0
+            self._buf = self._d.decompress(chunk)
+        n = min(len(b), len(self._buf))
+        b[:n] = self._buf[:n]
+        self._buf = self._buf[n:]
+        return n
+
+    def close(self) -> None:
+        self._f.close()
+        super().close()
+
+def _open_stream(path: str, offset: int):
+    if not path.endswith('.gz'):
+        f = open(path, 'rb')
+        f.seek(offset)
+        return f
+    f = io.BufferedReader(_GzipStream(path), 1 << 16)
+    while offset > 0:                  # несжатое смещение — только дочитыванием
+        skipped = len(f.read(min(offset, 1 << 20)))
+        if not skipped:
+            break
+        offset -= skipped
+    return f
+
+
+class OffsetCheckpoint:
+    """{file path: byte offset} persisted as JSON, replaced atomically on save."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets: Dict[str, int] = {}
+        self.exists = os.path.exists(path)
+        if self.exists:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.offsets = {k: int(v) for k, v in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                logger.warning(f"Checkpoint {path} не прочитан ({e}) — начинаем с нуля")
+                self.offsets = {}
+
+    def get(self, file_path: str) -> int:
+        return self.offsets.get(file_path, 0)
+
+    def set(self, file_path: str, offset: int) -> None:
+        self.offsets[file_path] = offset
+
+    def save(self) -> None:
+        # только существующие файлы — checkpoint не растёт вместе с архивом выгрузок
+        self.offsets = {p: off for p, off in self.offsets.items() if os.path.exists(p)}
+        tmp = self.path + '.tmp'
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.offsets, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def _read_lines(f, offset: int, max_lines: int,
+                stats: Dict[str, int]) -> Tuple[List[Dict[str, Any]], int, bool]:
+    """-> (records, offset after the last complete line, True if no complete line is left)."""
+    records: List[Dict[str, Any]] = []
+    while len(records) < max_lines:
+        try:
+            line = f.readline(MAX_LINE_BYTES)
+        except zlib.error:
+            return records, offset, True      # повреждённый .gz — читаем, сколько удалось
+        if not line:
+            return records, offset, True
+        if not line.endswith(b'\n'):
+            if len(line) < MAX_LINE_BYTES:
+                # парсер ещё дописывает строку: хвост не съедаем — позиция снова на её начале
+                if f.seekable():
+                    f.seek(offset)
+                return records, offset, True
+            offset += len(line)
+            stats['bad'] = stats.get('bad', 0) + 1
+            continue
+        offset += len(line)
+        stats['lines'] = stats.get('lines', 0) + 1
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            stats['bad'] = stats.get('bad', 0) + 1
+    return records, offset, False
+
+def read_jsonl_batch(path: str, offset: int, max_lines: int,
+                     stats: Dict[str, int]) -> Tuple[List[Dict[str, Any]], int]:
+    """Up to max_lines complete lines of path from offset -> (records, new offset).
+       stats['lines'] / stats['bad'] are incremented in place."""
+    with _open_stream(path, offset) as f:
+        records, offset, _ = _read_lines(f, offset, max_lines, stats)
+        return records, offset
+
+def iter_jsonl_batches(path: str, offset: int, max_lines: int,
+                       stats: Dict[str, int]) -> Iterator[Tuple[List[Dict[str, Any]], int]]:
+    """read_jsonl_batch over one open handle until no complete line is left
+       (for .gz: без повторной распаковки с начала на каждый кусок)."""
+    with _open_stream(path, offset) as f:
+        while True:
+            records, new_offset, at_end = _read_lines(f, offset, max_lines, stats)
+            if new_offset != offset:
+                yield records, new_offset
+            if at_end:
+                return             # дописанное после этого — со следующего прохода, с new_offset
+            offset = new_offset
@@ -61,6 +61,7 @@ def init_database():
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_unloading_city ON freights(unloading_city)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_body_type ON freights(body_type)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_loading_dt ON freights(loading_dt)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_loading_date ON freights(loading_date)')
         # Market analytics
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS market_stats (
@@ -101,10 +102,20 @@ def init_database():
         if conn:
             conn.close()
 
-def insert_freights_batch(freights: List[Any]):
+def _existing_ids(cursor, ids: List[str]) -> set:
+    found = set()
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        cursor.execute(f"SELECT id FROM freights WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+        found.update(r[0] for r in cursor.fetchall())
+    return found
+
+def insert_freights_batch(freights: List[Any]) -> int:
+    """INSERT OR REPLACE по id одной транзакцией. Возвращает число записанных строк (0 при ошибке)."""
     if not freights:
         logger.warning("Попытка вставки пустого списка грузов")
-        return
+        return 0
+    conn = None
     try:
         conn = sqlite3.connect(DATABASE_PATH)
         cursor = conn.cursor()
@@ -134,19 +145,33 @@ def insert_freights_batch(freights: List[Any]):
                 freight.loading_region,
                 freight.unloading_region
             ))
+        existing = _existing_ids(cursor, [row[0] for row in data])
         cursor.executemany('''
         INSERT OR REPLACE INTO freights 
         (id, loading_city, unloading_city, distance, cargo, weight, volume, body_type, loading_date, loading_dt, 
          revenue_rub, profit_per_km, loading_lat, loading_lon, unloading_lat, unloading_lon, loading_region, unloading_region)
         VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
         ''', data)
+        # инкрементальные скетчи рынка — только по новым id (повторная вставка не удваивает выборку,
+        # изменённый груз остаётся в скетче старым до ночного сброса, см. market_sketches);
+        # id, повторённый внутри пачки, считается один раз — по последней строке, как INSERT OR REPLACE
+        new_rows = {r[0]: r for r in data if r[0] not in existing}
+        try:
+            from market_sketches import update_market_sketches
+            update_market_sketches(conn, [(r[1], r[2], r[7], r[8], r[3], r[10]) for r in new_rows.values()])
+        except ImportError:
+            pass
+        except Exception as e:
+            logger.warning(f"Скетчи market_stats не обновлены: {e}")
         conn.commit()
         logger.info(f"Вставлено {len(freights)} грузов в базу данных")
+        return len(data)
     except sqlite3.Error as e:
         logger.error(f"Ошибка базы данных: {str(e)}")
         if freights:
             logger.debug(f"Пример данных: {freights[0].dict() if hasattr(freights[0],'dict') else str(freights[0])}")
         logger.debug(traceback.format_exc())
+        return 0
     finally:
         if conn:
             conn.close()
@@ -227,6 +252,25 @@ def insert_rate_surge_event(ts: str, orig: str, dest: str, body_type: str, freig
     finally:
         if conn: conn.close()
 
+def insert_rate_surge_events(rows: List[Tuple]):
+    """rows: (ts, orig, dest, body_type, freight_id, rub_per_km, baseline, uplift) — одной транзакцией"""
+    if not rows:
+        return
+    conn = None
+    try:
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO rate_surge_events (ts, orig_city, dest_city, body_type, freight_id, rub_per_km, baseline_rub_per_km, uplift)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(ts, orig, dest, (bt or "n/a").lower(), fid, rpk, base, up) for (ts, orig, dest, bt, fid, rpk, base, up) in rows])
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Ошибка записи всплесков ставок: {e}")
+        logger.debug(traceback.format_exc())
+    finally:
+        if conn: conn.close()
+
 def fetch_recent_surge_events(limit: int = 20) -> List[Dict[str, Any]]:
     conn = None
     try:
@@ -8,7 +8,7 @@ import traceback
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from src.core.config import EXACT_DISTANCE_CACHE_PATH, HOURLY_DRIVING_SPEED, SERVICE_TIME_HOURS
-from src.core.models import Freight, Route, RouteSegment
+from src.core.models import FreightRecord, RouteRecord, RouteSegmentRecord
 from src.core.geo_utils import approx_road_km
 # Для подхвата координат гаража/финиша при их отсутствии в данных:
 try:
@@ -164,7 +164,7 @@ class TimeAwareRouteBuilder:
     # ---------- core ----------
 
     def build_routes(self, garage_city: str, end_city: str, start_time: datetime,
-                     max_depth: int = 7, max_routes: int = 10) -> List[Route]:
+                     max_depth: int = 7, max_routes: int = 10) -> List[RouteRecord]:
         """
         Старт из гаража (garage_city) и оценка кандидатов как ПОЛНЫХ рейсов "гараж -> ... -> гараж".
         Внутри поиска на каждом шаге формируем кандидат-маршрут: текущий путь + порожняк до end_city (гаража),
@@ -274,11 +274,12 @@ class TimeAwareRouteBuilder:
         routes.sort(key=lambda r: (r.revenue_per_hour, r.revenue_per_km), reverse=True)
         return routes[:3]
 
-    def _create_route(self, path: List[Dict[str, Any]], start_city: str, end_city: str) -> Optional[Route]:
-        """Формирует маршрут с учётом порожняка от последней точки до end_city (гаража)."""
+    def _create_route(self, path: List[Dict[str, Any]], start_city: str, end_city: str) -> Optional[RouteRecord]:
+        """Формирует маршрут с учётом порожняка от последней точки до end_city (гаража).
+        Вызывается на каждый кандидат поиска — поэтому slotted-записи, а не pydantic."""
         if not path:
             return None
-        segments: List[RouteSegment] = []
+        segments: List[RouteSegmentRecord] = []
         total_distance = 0.0
         total_revenue = 0.0
         total_time = 0.0
@@ -301,7 +302,7 @@ class TimeAwareRouteBuilder:
                 total_time += segment_time
                 current_location = freight_data['unloading_city']
 
-                freight = Freight(
+                freight = FreightRecord(
                     id=freight_data.get('id', ''),
                     loading_points=[freight_data.get('loading_city', '')],
                     unloading_points=[freight_data.get('unloading_city', '')],
@@ -315,7 +316,7 @@ class TimeAwareRouteBuilder:
                     revenue_rub=freight_data.get('revenue', 0.0)
                 )
 
-                segments.append(RouteSegment(
+                segments.append(RouteSegmentRecord(
                     freight=freight,
                     empty_run_before=empty_run,
                     segment_time=segment_time,
@@ -334,7 +335,7 @@ class TimeAwareRouteBuilder:
             total_time_days = total_time / 24.0
             revenue_per_hour = total_revenue / total_time if total_time > 0 else 0.0
 
-            return Route(
+            return RouteRecord(
                 segments=segments,
                 total_distance=total_distance,
                 total_revenue=total_revenue,
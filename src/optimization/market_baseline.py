@@ -0,0 +1,109 @@
+from typing import Dict, Optional, Tuple
+from datetime import datetime
+import sqlite3
+import threading
+import time
+from config import DATABASE_PATH
+from rate_cube import RateCube
+
+# Снимок market_stats в памяти для проверки всплесков ставок.
+# Как database.get_guaranteed_rate (точный DOW -> DOW=7), но без SQL на каждый груз,
+# а вместо "лучшего по samples из того же города" — иерархический куб rate_cube
+# (город→город ... страна), который отвечает почти всегда.
+
+VERSION_CHECK_INTERVAL_SEC = 30.0
+
+
+class MarketBaseline:
+    def __init__(self, db_path: str = DATABASE_PATH):
+        self.db_path = db_path
+        self.version: Optional[Tuple] = None
+        self.p20: Dict[Tuple[str, str, str, int], float] = {}
+        self.cube = RateCube(db_path)
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self._dow_cache: Dict[str, int] = {}
+
+    def _read_version(self, conn: sqlite3.Connection) -> Optional[Tuple]:
+        try:
+            return tuple(conn.execute('SELECT COUNT(*), MAX(updated_at) FROM market_stats').fetchone())
+        except sqlite3.Error:
+            return None
+
+    def load(self) -> 'MarketBaseline':
+        conn = sqlite3.connect(self.db_path)
+        try:
+            version = self._read_version(conn)
+            p20: Dict[Tuple[str, str, str, int], float] = {}
+            if version is not None:
+                for orig, dest, bt, dow, val in conn.execute(
+                        'SELECT orig_city, dest_city, body_type, day_of_week, p20_rubkm FROM market_stats'):
+                    if val is None:
+                        continue
+                    p20[(orig, dest, bt, dow)] = float(val)
+        finally:
+            conn.close()
+        cube = RateCube(self.db_path).load()
+        with self._lock:
+            self.p20 = p20
+            self.cube = cube
+            self.version = version
+            self._checked_at = time.monotonic()
+        return self
+
+    def refresh_if_changed(self, force: bool = False) -> bool:
+        """Reload when market_stats changed (row count / max updated_at); checks are throttled."""
+        now = time.monotonic()
+        if not force and now - self._checked_at < VERSION_CHECK_INTERVAL_SEC:
+            return False
+        conn = sqlite3.connect(self.db_path)
+        try:
+            version = self._read_version(conn)
+        finally:
+            conn.close()
+        self._checked_at = now
+        if force or version != self.version:
+            self.load()
+            return True
+        return False
+
+    def day_of_week(self, loading_date: Optional[str]) -> int:
+        """0=Mon..6=Sun from 'YYYY-MM-DD...', 7 when unknown; memoised per date string."""
+        if not loading_date or len(loading_date) < 10:
+            return 7
+        dow = self._dow_cache.get(loading_date)
+        if dow is None:
+            try:
+                dow = datetime(int(loading_date[:4]), int(loading_date[5:7]), int(loading_date[8:10])).weekday()
+            except ValueError:
+                dow = 7
+            if len(self._dow_cache) > 10_000:
+                self._dow_cache.clear()
+            self._dow_cache[loading_date] = dow
+        return dow
+
+    def guaranteed_rate(self, orig: str, dest: str, body_type: Optional[str], day_of_week: int,
+                        orig_region: Optional[str] = None, dest_region: Optional[str] = None) -> Optional[float]:
+        bt = (body_type or "n/a").lower()
+        p20 = self.p20
+        val = p20.get((orig, dest, bt, day_of_week))
+        if val is None:
+            val = p20.get((orig, dest, bt, 7))
+        if val is None:
+            val = self.cube.p20(orig, dest, bt, orig_region, dest_region)
+        return val
+
+
+_baseline: Optional[MarketBaseline] = None
+_baseline_lock = threading.Lock()
+
+def get_market_baseline() -> MarketBaseline:
+    """Process-wide snapshot, loaded on first use and reloaded when market_stats changes."""
+    global _baseline
+    if _baseline is None:
+        with _baseline_lock:
+            if _baseline is None:
+                _baseline = MarketBaseline().load()
+                return _baseline
+    _baseline.refresh_if_changed()
+    return _baseline
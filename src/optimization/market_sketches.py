@@ -0,0 +1,162 @@
+from typing import List, Dict, Any, Tuple, Iterable, Optional
+from datetime import datetime, timedelta
+import sqlite3
+from collections import defaultdict
+from config import DATABASE_PATH, MARKET_LOOKBACK_DAYS, MARKET_MIN_SAMPLES
+from quantile_sketch import KLLSketch
+
+# Инкрементальный market_stats: по одному KLL-скетчу rub/km на (orig, dest, body_type, day).
+# Скетчи обновляются при вставке грузов, окно lookback = слияние дневных скетчей,
+# старые дни просто удаляются. Грузы без даты попадают в день загрузки в БД с dow=7.
+# Дрейф: в скетч попадают только новые id — у перезаписанного груза (изменились ставка или
+# маршрут) в скетче остаётся старое значение, удалить элемент из KLL нельзя. Поэтому
+# инкрементальный market_stats — приближение между полными пересборками: ночная задача
+# market.stats.rebuild (rebuild_market_stats + backfill_market_sketches) пересчитывает
+# market_stats и куб ставок по freights и сбрасывает скетчи. Куб ставок (rate_cube)
+# обновляется только там — refresh_market_stats_incremental его не трогает.
+
+UNDATED_PREFIX = '~'   # day = '~YYYY-MM-DD' (ingest day) для грузов без loading_date
+
+def migrate_market_sketches(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_sketch_daily (
+            orig_city TEXT NOT NULL,
+            dest_city TEXT NOT NULL,
+            body_type TEXT NOT NULL,
+            day TEXT NOT NULL,
+            rows_total INTEGER NOT NULL,      -- все строки (для avg_distance, loads_per_day)
+            dist_sum REAL NOT NULL,
+            sketch BLOB NOT NULL,             -- KLLSketch rub/km > 0
+            PRIMARY KEY (orig_city, dest_city, body_type, day)
+        )
+    ''')
+
+def _day_of(loading_date: Optional[str], ingest_day: str) -> Optional[str]:
+    if not loading_date or len(loading_date) < 10:
+        return UNDATED_PREFIX + ingest_day
+    try:
+        return datetime(int(loading_date[:4]), int(loading_date[5:7]), int(loading_date[8:10])).date().isoformat()
+    except ValueError:
+        return None
+
+def _dow_of(day: str) -> int:
+    if day.startswith(UNDATED_PREFIX):
+        return 7
+    return datetime.fromisoformat(day).weekday()
+
+class _DayBag:
+    __slots__ = ('rows', 'dist_sum', 'sketch')
+
+    def __init__(self, sketch: Optional[KLLSketch] = None, rows: int = 0, dist_sum: float = 0.0):
+        self.rows = rows
+        self.dist_sum = dist_sum
+        self.sketch = sketch or KLLSketch()
+
+def update_market_sketches(conn: sqlite3.Connection,
+                           rows: Iterable[Tuple[str, str, Optional[str], Optional[str], float, float]]) -> int:
+    """rows: (orig, dest, body_type, loading_date, distance, revenue_rub) of NEW freights only.
+    Merges them into the stored daily sketches on the caller's connection (caller commits)."""
+    migrate_market_sketches(conn)
+    ingest_day = datetime.utcnow().date().isoformat()
+    bags: Dict[Tuple[str, str, str, str], _DayBag] = {}
+    for orig, dest, bt, loading_date, distance, revenue in rows:
+        if revenue is None or not distance or distance <= 0:
+            continue
+        day = _day_of(loading_date, ingest_day)
+        if day is None:
+            continue
+        key = (orig, dest, (bt or 'n/a').lower(), day)
+        bag = bags.get(key)
+        if bag is None:
+            bag = bags[key] = _DayBag()
+        bag.rows += 1
+        bag.dist_sum += float(distance)
+        rubkm = float(revenue) / float(distance)
+        if rubkm > 0:
+            bag.sketch.update(rubkm)
+    if not bags:
+        return 0
+
+    cur = conn.cursor()
+    out = []
+    for key, bag in bags.items():
+        row = cur.execute('''
+            SELECT rows_total, dist_sum, sketch FROM market_sketch_daily
+             WHERE orig_city=? AND dest_city=? AND body_type=? AND day=?
+        ''', key).fetchone()
+        if row:
+            bag.rows += row[0]
+            bag.dist_sum += row[1]
+            bag.sketch = KLLSketch.from_bytes(row[2]).merge(bag.sketch)
+        out.append((*key, bag.rows, bag.dist_sum, bag.sketch.to_bytes()))
+    cur.executemany('''
+        INSERT OR REPLACE INTO market_sketch_daily
+            (orig_city, dest_city, body_type, day, rows_total, dist_sum, sketch)
+        VALUES (?,?,?,?,?,?,?)
+    ''', out)
+    return len(out)
+
+def backfill_market_sketches(lookback_days: int = MARKET_LOOKBACK_DAYS, batch_size: int = 50_000) -> int:
+    """Rebuild the daily sketches of the lookback window from freights (bootstrap, and the
+    nightly reset that drops drift from re-ingested freights)."""
+    cutoff = (datetime.utcnow() - timedelta(days=lookback_days)).date().isoformat()
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        migrate_market_sketches(conn)
+        conn.execute('DELETE FROM market_sketch_daily')
+        read = conn.cursor()
+        read.execute('''
+            SELECT loading_city, unloading_city, body_type, loading_date, distance, revenue_rub
+              FROM freights
+             WHERE revenue_rub IS NOT NULL AND distance > 0
+               AND (loading_date >= ? OR loading_date IS NULL OR length(loading_date) < 10)
+        ''', (cutoff,))
+        total = 0
+        while True:
+            batch = read.fetchmany(batch_size)
+            if not batch:
+                break
+            update_market_sketches(conn, batch)
+            total += len(batch)
+        conn.commit()
+        return total
+    finally:
+        conn.close()
+
+def refresh_market_stats_incremental(lookback_days: int = MARKET_LOOKBACK_DAYS) -> int:
+    """market_stats from the merged daily sketches of the window; days outside it are dropped.
+    The rate cube is not touched (full rebuild only). Returns number of rows written."""
+    cutoff = (datetime.utcnow() - timedelta(days=lookback_days)).date()
+    first_day = (cutoff + timedelta(days=1)).isoformat()
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        migrate_market_sketches(conn)
+        conn.execute('DELETE FROM market_sketch_daily WHERE day < ? OR day BETWEEN ? AND ?',
+                     (first_day, UNDATED_PREFIX, UNDATED_PREFIX + cutoff.isoformat()))
+        conn.commit()
+        groups: Dict[Tuple[str, str, str, int], Dict[str, Any]] = defaultdict(
+            lambda: {'rows': 0, 'dist_sum': 0.0, 'days': 0, 'sketch': KLLSketch()})
+        for orig, dest, bt, day, rows_total, dist_sum, blob in conn.execute(
+                'SELECT orig_city, dest_city, body_type, day, rows_total, dist_sum, sketch FROM market_sketch_daily'):
+            g = groups[(orig, dest, bt, _dow_of(day))]
+            g['rows'] += rows_total
+            g['dist_sum'] += dist_sum
+            g['days'] += 1
+            g['sketch'].merge(KLLSketch.from_bytes(blob))
+    finally:
+        conn.close()
+
+    from database import upsert_market_stats
+    min_samples = max(5, MARKET_MIN_SAMPLES // 2)
+    ts = datetime.utcnow().isoformat()
+    out_rows = []
+    for (orig, dest, bt, dow), g in groups.items():
+        sk: KLLSketch = g['sketch']
+        if sk.n < min_samples:
+            continue
+        p20, p50, p80 = sk.quantiles((0.20, 0.50, 0.80))
+        avg_dist = g['dist_sum'] / g['rows'] if g['rows'] else 0.0
+        loads_per_day = g['rows'] / g['days'] if dow < 7 and g['days'] else 0.0
+        out_rows.append((orig, dest, bt, dow, sk.n, p20, p50, p80, loads_per_day, avg_dist, ts))
+    upsert_market_stats(out_rows)
+    return len(out_rows)
@@ -2,7 +2,6 @@
 from typing import List, Dict, Any, Tuple
 from datetime import datetime, timedelta
 import sqlite3
-from collections import defaultdict
 from config import DATABASE_PATH, MARKET_LOOKBACK_DAYS, MARKET_MIN_SAMPLES
 
 def _percentile(sorted_vals: List[float], p: float) -> float:
@@ -17,71 +16,167 @@ def _percentile(sorted_vals: List[float], p: float) -> float:
     d1 = sorted_vals[c] * (k-f)
     return d0 + d1
 
-def rebuild_market_stats(lookback_days: int = MARKET_LOOKBACK_DAYS) -> int:
-    """Aggregate freights -> market_stats for last N days.
-       Returns number of rows written."""
+def _pct_sql(p: float) -> str:
+    """Same interpolation as _percentile, over rn (0-based rank) / n inside one group."""
+    k = f"((n - 1) * {p!r})"
+    f = f"CAST({k} AS INTEGER)"
+    c = f"MIN({f} + 1, n - 1)"
+    return (f"SUM(CASE WHEN {f} = {c} THEN (CASE WHEN rn = {f} THEN rubkm END) "
+            f"ELSE (CASE WHEN rn = {f} THEN rubkm * ({c} - {k}) WHEN rn = {c} THEN rubkm * ({k} - {f}) END) END)")
+
+# Всё тяжёлое — в SQLite: фильтр по окну, группировка, ранги и перцентили.
+# В Python приходит по одной строке на (orig, dest, body_type, dow).
+# Окно — строковое сравнение с ISO-днём cutoff; короткие не-ISO даты ('1 окт') под него
+# не подходят и, как в прежней Python-версии, остаются в выборке с dow=7.
+_MARKET_STATS_SQL = f"""
+    WITH base AS (
+        SELECT loading_city AS orig, unloading_city AS dest, ms_body_type(body_type) AS bt,
+               CASE WHEN length(loading_date) >= 10
+                    THEN (CAST(strftime('%w', substr(loading_date, 1, 10)) AS INTEGER) + 6) % 7
+                    ELSE 7 END AS dow,                      -- 0=Mon..6=Sun, 7=any (no date)
+               loading_date AS ld,
+               CAST(distance AS REAL) AS dist,
+               CAST(revenue_rub AS REAL) / CAST(distance AS REAL) AS rubkm
+          FROM freights
+         WHERE revenue_rub IS NOT NULL AND distance > 0
+           AND (loading_date >= :cutoff OR loading_date IS NULL OR length(loading_date) < 10)
+    ),
+    ranked AS (
+        SELECT orig, dest, bt, dow, rubkm,
+               ROW_NUMBER() OVER w - 1 AS rn,
+               COUNT(*) OVER w AS n
+          FROM base
+         WHERE dow IS NOT NULL AND rubkm > 0
+        WINDOW w AS (PARTITION BY orig, dest, bt, dow ORDER BY rubkm
+                     ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+    ),
+    pct AS (
+        SELECT orig, dest, bt, dow, MAX(n) AS samples,
+               {_pct_sql(0.20)} AS p20, {_pct_sql(0.50)} AS p50, {_pct_sql(0.80)} AS p80
+          FROM ranked
+         WHERE n >= :min_samples
+         GROUP BY orig, dest, bt, dow
+    ),
+    agg AS (
+        SELECT orig, dest, bt, dow, AVG(dist) AS avg_dist,
+               CASE WHEN dow < 7 THEN COUNT(*) * 1.0 / COUNT(DISTINCT ld) ELSE 0.0 END AS loads_per_day
+          FROM base
+         WHERE dow IS NOT NULL
+         GROUP BY orig, dest, bt, dow
+    )
+    SELECT p.orig, p.dest, p.bt, p.dow, p.samples, p.p20, p.p50, p.p80, a.loads_per_day, a.avg_dist
+      FROM pct p
+      JOIN agg a ON a.orig = p.orig AND a.dest = p.dest AND a.bt = p.bt AND a.dow = p.dow
+"""
+
+def _cutoff_day(lookback_days: int) -> str:
+    """First YYYY-MM-DD whose midnight is not older than utcnow - lookback_days."""
     cutoff = datetime.utcnow() - timedelta(days=lookback_days)
+    day = cutoff.date()
+    if cutoff != datetime(day.year, day.month, day.day):
+        day += timedelta(days=1)
+    return day.isoformat()
+
+def _market_stats_conn() -> sqlite3.Connection:
     conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    # Load raw rows
-    cur.execute("""
-        SELECT loading_city, unloading_city, body_type, distance, revenue_rub, loading_date
-        FROM freights
-        WHERE revenue_rub IS NOT NULL AND distance > 0
-    """)
-    rows = cur.fetchall()
-    conn.close()
-
-    # Filter by date if possible (loading_date is TEXT YYYY-MM-DD)
-    prepared = []
-    for r in rows:
-        try:
-            if r['loading_date'] and len(r['loading_date']) >= 10:
-                dt = datetime(int(r['loading_date'][:4]), int(r['loading_date'][5:7]), int(r['loading_date'][8:10]))
-                if dt < cutoff:
-                    continue
-        except Exception:
-            pass
-        prepared.append(r)
-
-    # Group and compute
-    groups: Dict[Tuple[str, str, str, int], Dict[str, Any]] = defaultdict(lambda: {
-        'rubkm': [], 'dists': [], 'count_by_day': defaultdict(int)
-    })
-    for r in prepared:
-        orig = r['loading_city']; dest = r['unloading_city']; bt = (r['body_type'] or 'n/a').lower()
-        try:
-            if r['loading_date'] and len(r['loading_date']) >= 10:
-                dt = datetime(int(r['loading_date'][:4]), int(r['loading_date'][5:7]), int(r['loading_date'][8:10]))
-                dow = dt.weekday()
-                key = (orig, dest, bt, dow)
-            else:
-                key = (orig, dest, bt, 7)  # 7 = any
-            rubkm = float(r['revenue_rub']) / float(r['distance']) if r['distance'] else 0.0
-            groups[key]['rubkm'].append(rubkm)
-            groups[key]['dists'].append(float(r['distance']))
-            if r['loading_date'] and len(r['loading_date']) >= 10:
-                groups[key]['count_by_day'][r['loading_date']] += 1
-        except Exception:
-            continue
-
-    # Prepare upserts
+    # SQLite lower() is ASCII-only; body types are Cyrillic
+    conn.create_function("ms_body_type", 1, lambda v: (v or 'n/a').lower(), deterministic=True)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_loading_date ON freights(loading_date)')
+    return conn
+
+# Вариант для NumPy: SQLite только фильтрует окно, группировка и перцентили — векторно.
+_MARKET_WINDOW_SQL = """
+    SELECT loading_city, unloading_city, ms_body_type(body_type),
+           CASE WHEN length(loading_date) >= 10
+                THEN julianday(substr(loading_date, 1, 10)) ELSE -1 END,   -- NULL = bad date, -1 = undated
+           loading_date,
+           CAST(distance AS REAL), CAST(revenue_rub AS REAL)
+      FROM freights
+     WHERE revenue_rub IS NOT NULL AND distance > 0
+       AND (loading_date >= :cutoff OR loading_date IS NULL OR length(loading_date) < 10)
+"""
+
+def _market_stats_rows_numpy(conn: sqlite3.Connection, cutoff: str, min_samples: int) -> List[Tuple]:
+    import numpy as np
+
+    rows = conn.execute(_MARKET_WINDOW_SQL, {'cutoff': cutoff}).fetchall()
+    rows = [r for r in rows if r[3] is not None]
+    if not rows:
+        return []
+    orig, dest, bt, jd, ld, dist, rev = zip(*rows)
+    jd = np.asarray(jd, dtype=np.float64)
+    dist = np.asarray(dist, dtype=np.float64)
+    rubkm = np.asarray(rev, dtype=np.float64) / dist
+    # JDN % 7: 0 = Monday, как datetime.weekday(); 7 = без даты
+    dow = np.where(jd < 0, 7, np.mod(np.floor(jd + 0.5), 7)).astype(np.int64)
+
+    orig_u, orig_c = np.unique(np.asarray(orig, dtype=object), return_inverse=True)
+    dest_u, dest_c = np.unique(np.asarray(dest, dtype=object), return_inverse=True)
+    bt_u, bt_c = np.unique(np.asarray(bt, dtype=object), return_inverse=True)
+    _, ld_c = np.unique(np.asarray([x or '' for x in ld], dtype=object), return_inverse=True)
+
+    order = np.lexsort((rubkm, dow, bt_c, dest_c, orig_c))
+    orig_c, dest_c, bt_c, dow = orig_c[order], dest_c[order], bt_c[order], dow[order]
+    rubkm, dist, ld_c = rubkm[order], dist[order], ld_c[order]
+
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = ((orig_c[1:] != orig_c[:-1]) | (dest_c[1:] != dest_c[:-1]) |
+                     (bt_c[1:] != bt_c[:-1]) | (dow[1:] != dow[:-1]))
+    starts = np.flatnonzero(new_group)
+    gid = np.cumsum(new_group) - 1
+    n_groups = len(starts)
+    counts = np.diff(np.append(starts, len(order)))
+
+    avg_dist = np.add.reduceat(dist, starts) / counts
+    distinct_days = np.bincount(np.unique(gid * (ld_c.max() + 1) + ld_c) // (ld_c.max() + 1), minlength=n_groups)
+    g_dow = dow[starts]
+    loads_per_day = np.where(g_dow < 7, counts / np.maximum(distinct_days, 1), 0.0)
+
+    # rub/km > 0 — отсортированный хвост каждой группы
+    pos = rubkm > 0
+    n = np.bincount(gid, weights=pos, minlength=n_groups).astype(np.int64)
+    tail = starts + counts - n
+    keep = np.flatnonzero(n >= min_samples)
+    if len(keep) == 0:
+        return []
+    nk, tk = n[keep], tail[keep]
+    pcts = []
+    for p in (0.20, 0.50, 0.80):
+        # та же арифметика, что _percentile (и SQL-путь), без цикла по группам
+        k = (nk - 1) * p
+        f = k.astype(np.int64)
+        c = np.minimum(f + 1, nk - 1)
+        vf, vc = rubkm[tk + f], rubkm[tk + c]
+        pcts.append(np.where(f == c, vf, vf * (c - k) + vc * (k - f)))
+
+    out = []
+    for j, g in enumerate(keep):
+        out.append((orig_u[orig_c[starts[g]]], dest_u[dest_c[starts[g]]], bt_u[bt_c[starts[g]]], int(g_dow[g]),
+                    int(nk[j]), float(pcts[0][j]), float(pcts[1][j]), float(pcts[2][j]),
+                    float(loads_per_day[g]), float(avg_dist[g])))
+    return out
+
+def rebuild_market_stats(lookback_days: int = MARKET_LOOKBACK_DAYS, engine: str = "sql") -> int:
+    """Aggregate freights -> market_stats for last N days.
+       engine: "sql" (aggregation inside SQLite) or "numpy" (window rows, vectorized group-by).
+       Also rebuilds the hierarchical rate cube (rate_cube.market_rate_cube).
+       Returns number of rows written."""
+    cutoff = _cutoff_day(lookback_days)
+    min_samples = max(5, MARKET_MIN_SAMPLES // 2)
+    conn = _market_stats_conn()
+    try:
+        if engine == "numpy":
+            rows = _market_stats_rows_numpy(conn, cutoff, min_samples)
+        else:
+            rows = conn.execute(_MARKET_STATS_SQL, {'cutoff': cutoff, 'min_samples': min_samples}).fetchall()
+        ts = datetime.utcnow().isoformat()
+        # куб город/регион/страна — до upsert, чтобы MarketBaseline перечитал оба сразу
+        from rate_cube import build_rate_cube
+        build_rate_cube(conn, cutoff, min_samples, ts)
+    finally:
+        conn.close()
+
     from database import upsert_market_stats
-    out_rows = []
-    ts = datetime.utcnow().isoformat()
-    for key, bag in groups.items():
-        orig, dest, bt, dow = key
-        vals = sorted(v for v in bag['rubkm'] if v > 0)
-        if len(vals) < max(5, MARKET_MIN_SAMPLES//2):
-            continue
-        p20 = _percentile(vals, 0.20)
-        p50 = _percentile(vals, 0.50)
-        p80 = _percentile(vals, 0.80)
-        avg_dist = sum(bag['dists'])/len(bag['dists']) if bag['dists'] else 0.0
-        loads_per_day = 0.0
-        if bag['count_by_day']:
-            loads_per_day = sum(bag['count_by_day'].values()) / max(1, len(bag['count_by_day']))
-        out_rows.append((orig, dest, bt, dow, len(vals), p20, p50, p80, loads_per_day, avg_dist, ts))
+    out_rows = [(*row, ts) for row in rows]
     upsert_market_stats(out_rows)
     return len(out_rows)
@@ -0,0 +1,133 @@
+import struct
+from array import array
+from typing import Iterable, List, Optional
+
+# KLL quantile sketch (Karnin–Lang–Liberty), детерминированный вариант.
+# Сливаемый (merge), сериализуемый в bytes для хранения в SQLite/Postgres.
+# Пока ни один уровень не сжимался, sketch хранит все значения и quantile()
+# совпадает с точным перцентилем (та же интерполяция, что market_stats._percentile).
+
+_C = 2.0 / 3.0
+_HEADER = struct.Struct('<4sHIH')  # magic, k, n, levels
+_MAGIC = b'KLL1'
+
+
+def _exact_percentile(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * p
+    f = int(k)
+    c = min(f + 1, len(sorted_vals) - 1)
+    if f == c:
+        return sorted_vals[int(k)]
+    return sorted_vals[f] * (c - k) + sorted_vals[c] * (k - f)
+
+
+class KLLSketch:
+    __slots__ = ('k', 'n', 'levels', '_flip')
+
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.n = 0
+        self.levels: List[List[float]] = [[]]
+        self._flip: List[int] = [0]   # alternating compaction offset per level
+
+    # ---------- build ----------
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return max(2, int(self.k * (_C ** depth)) + 1)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _size(self) -> int:
+        return sum(len(lv) for lv in self.levels)
+
+    def _compress(self) -> None:
+        while self._size() >= self._max_size():
+            for h in range(len(self.levels)):
+                if len(self.levels[h]) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                        self._flip.append(0)
+                    lv = sorted(self.levels[h])
+                    # odd item stays on its level, the rest is halved into the next one
+                    keep = [lv.pop()] if len(lv) % 2 else []
+                    off = self._flip[h]
+                    self._flip[h] ^= 1
+                    self.levels[h + 1].extend(lv[off::2])
+                    self.levels[h] = keep
+                    break
+
+    def update(self, x: float) -> None:
+        self.levels[0].append(float(x))
+        self.n += 1
+        if len(self.levels[0]) >= self._capacity(0):
+            self._compress()
+
+    def extend(self, xs: Iterable[float]) -> 'KLLSketch':
+        for x in xs:
+            self.update(x)
+        return self
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+            self._flip.append(0)
+        for h, lv in enumerate(other.levels):
+            self.levels[h].extend(lv)
+        self.n += other.n
+        self._compress()
+        return self
+
+    # ---------- query ----------
+
+    def is_exact(self) -> bool:
+        return all(not lv for lv in self.levels[1:])
+
+    def quantile(self, p: float) -> Optional[float]:
+        if self.n == 0:
+            return None
+        if self.is_exact():
+            return _exact_percentile(sorted(self.levels[0]), p)
+        weighted = sorted((x, 1 << h) for h, lv in enumerate(self.levels) for x in lv)
+        total = sum(w for _, w in weighted)
+        target = p * total
+        cum = 0
+        for x, w in weighted:
+            cum += w
+            if cum >= target:
+                return x
+        return weighted[-1][0]
+
+    def quantiles(self, ps: Iterable[float]) -> List[Optional[float]]:
+        return [self.quantile(p) for p in ps]
+
+    # ---------- storage ----------
+
+    def to_bytes(self) -> bytes:
+        out = [_HEADER.pack(_MAGIC, self.k, self.n, len(self.levels))]
+        for h, lv in enumerate(self.levels):
+            out.append(struct.pack('<IB', len(lv), self._flip[h]))
+            out.append(array('d', lv).tobytes())
+        return b''.join(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'KLLSketch':
+        magic, k, n, nlev = _HEADER.unpack_from(data, 0)
+        if magic != _MAGIC:
+            raise ValueError('not a KLL sketch')
+        sk = cls(k)
+        sk.n = n
+        sk.levels, sk._flip = [], []
+        pos = _HEADER.size
+        for _ in range(nlev):
+            cnt, flip = struct.unpack_from('<IB', data, pos)
+            pos += 5
+            lv = array('d')
+            lv.frombytes(data[pos:pos + 8 * cnt])
+            pos += 8 * cnt
+            sk.levels.append(lv.tolist())
+            sk._flip.append(flip)
+        return sk
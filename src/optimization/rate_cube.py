@@ -0,0 +1,162 @@
+from typing import Dict, Optional, Tuple
+import sqlite3
+from config import DATABASE_PATH, MARKET_MIN_SAMPLES
+from market_stats import _pct_sql
+
+# Иерархический куб ставок rub/km (p20/p50/p80) по body_type, без DOW:
+#   0 город→город, 1 город→регион, 2 регион→регион, 3 регион→*, 4 страна (*→*),
+#   5 страна по всем типам кузова. Строится одним SQL-проходом при rebuild_market_stats,
+#   хранится в market_rate_cube; в памяти — dict на уровень, поиск = до 6 обращений к dict.
+
+ANY = '*'
+LEVEL_CITY_CITY, LEVEL_CITY_REGION, LEVEL_REGION_REGION, LEVEL_REGION_ANY, LEVEL_COUNTRY, LEVEL_COUNTRY_ANY_BODY = range(6)
+
+def migrate_rate_cube(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_rate_cube (
+            level INTEGER NOT NULL,
+            orig_key TEXT NOT NULL,
+            dest_key TEXT NOT NULL,
+            body_type TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            p20_rubkm REAL NOT NULL,
+            p50_rubkm REAL NOT NULL,
+            p80_rubkm REAL NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (level, orig_key, dest_key, body_type)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS market_city_region (
+            city TEXT PRIMARY KEY,
+            region TEXT NOT NULL
+        )
+    ''')
+
+# Тот же фильтр окна, что _MARKET_STATS_SQL; каждая строка раскладывается по уровням
+# (UNION ALL), дальше — те же ранги/перцентили, партиция по (level, orig_key, dest_key, bt).
+_RATE_CUBE_SQL = f"""
+    WITH base AS (
+        SELECT loading_city AS oc, unloading_city AS dc,
+               NULLIF(TRIM(loading_region), '') AS orr, NULLIF(TRIM(unloading_region), '') AS dr,
+               ms_body_type(body_type) AS bt,
+               CAST(revenue_rub AS REAL) / CAST(distance AS REAL) AS rubkm
+          FROM freights
+         WHERE revenue_rub IS NOT NULL AND distance > 0
+           AND (loading_date >= :cutoff OR loading_date IS NULL OR length(loading_date) < 10)
+           AND (loading_date IS NULL OR length(loading_date) < 10
+                OR strftime('%w', substr(loading_date, 1, 10)) IS NOT NULL)   -- как dow IS NOT NULL
+    ),
+    cells AS (
+        SELECT 0 AS level, oc AS ok, dc AS dk, bt, rubkm FROM base
+        UNION ALL SELECT 1, oc, dr, bt, rubkm FROM base WHERE dr IS NOT NULL
+        UNION ALL SELECT 2, orr, dr, bt, rubkm FROM base WHERE orr IS NOT NULL AND dr IS NOT NULL
+        UNION ALL SELECT 3, orr, '{ANY}', bt, rubkm FROM base WHERE orr IS NOT NULL
+        UNION ALL SELECT 4, '{ANY}', '{ANY}', bt, rubkm FROM base
+        UNION ALL SELECT 5, '{ANY}', '{ANY}', '{ANY}', rubkm FROM base
+    ),
+    ranked AS (
+        SELECT level, ok, dk, bt, rubkm,
+               ROW_NUMBER() OVER w - 1 AS rn,
+               COUNT(*) OVER w AS n
+          FROM cells
+         WHERE rubkm > 0 AND ok IS NOT NULL AND dk IS NOT NULL
+        WINDOW w AS (PARTITION BY level, ok, dk, bt ORDER BY rubkm
+                     ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)
+    )
+    SELECT level, ok, dk, bt, MAX(n) AS samples,
+           {_pct_sql(0.20)} AS p20, {_pct_sql(0.50)} AS p50, {_pct_sql(0.80)} AS p80
+      FROM ranked
+     WHERE n >= :min_samples OR level = {LEVEL_COUNTRY_ANY_BODY}   -- глобальный запасной уровень — всегда
+     GROUP BY level, ok, dk, bt
+"""
+
+# самый частый регион города (для поиска, когда регион у груза не указан)
+_CITY_REGION_SQL = """
+    SELECT city, region FROM (
+        SELECT city, region, ROW_NUMBER() OVER (PARTITION BY city ORDER BY COUNT(*) DESC, region) AS r
+          FROM (SELECT loading_city AS city, TRIM(loading_region) AS region FROM freights
+                UNION ALL
+                SELECT unloading_city, TRIM(unloading_region) FROM freights)
+         WHERE city IS NOT NULL AND city != '' AND region IS NOT NULL AND region != ''
+         GROUP BY city, region
+    ) WHERE r = 1
+"""
+
+def build_rate_cube(conn: sqlite3.Connection, cutoff: str, min_samples: int, ts: str) -> int:
+    """Recompute market_rate_cube / market_city_region on conn (needs ms_body_type, see
+    market_stats._market_stats_conn) in one transaction. Returns number of cube cells."""
+    migrate_rate_cube(conn)
+    cells = conn.execute(_RATE_CUBE_SQL, {'cutoff': cutoff, 'min_samples': min_samples}).fetchall()
+    regions = conn.execute(_CITY_REGION_SQL).fetchall()
+    with conn:
+        conn.execute('DELETE FROM market_rate_cube')
+        conn.executemany('''
+            INSERT INTO market_rate_cube
+                (level, orig_key, dest_key, body_type, samples, p20_rubkm, p50_rubkm, p80_rubkm, updated_at)
+            VALUES (?,?,?,?,?,?,?,?,?)
+        ''', [(*c, ts) for c in cells])
+        conn.execute('DELETE FROM market_city_region')
+        conn.executemany('INSERT INTO market_city_region (city, region) VALUES (?,?)', regions)
+    return len(cells)
+
+
+class RateCube:
+    """In-memory market_rate_cube. lookup() walks the levels finest-first and always answers
+    while the window has any priced freight (level 5 ignores min_samples)."""
+
+    def __init__(self, db_path: str = DATABASE_PATH):
+        self.db_path = db_path
+        self.cells: Dict[Tuple[int, str, str, str], Tuple[int, float, float, float]] = {}
+        self.region_of: Dict[str, str] = {}
+
+    def load(self) -> 'RateCube':
+        conn = sqlite3.connect(self.db_path)
+        try:
+            migrate_rate_cube(conn)
+            cells = {}
+            for level, ok, dk, bt, samples, p20, p50, p80 in conn.execute(
+                    'SELECT level, orig_key, dest_key, body_type, samples, p20_rubkm, p50_rubkm, p80_rubkm '
+                    'FROM market_rate_cube'):
+                cells[(level, ok, dk, bt)] = (samples, p20, p50, p80)
+            region_of = dict(conn.execute('SELECT city, region FROM market_city_region'))
+        finally:
+            conn.close()
+        self.cells, self.region_of = cells, region_of
+        return self
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def lookup(self, orig: str, dest: str, body_type: Optional[str],
+               orig_region: Optional[str] = None, dest_region: Optional[str] = None,
+               min_samples: int = MARKET_MIN_SAMPLES) -> Optional[Tuple[int, int, float, float, float]]:
+        """(level, samples, p20, p50, p80) of the finest level with >= min_samples, else the
+        coarsest existing cell; None only when the cube is empty."""
+        bt = (body_type or "n/a").lower()
+        oreg = (orig_region or '').strip() or self.region_of.get(orig)
+        dreg = (dest_region or '').strip() or self.region_of.get(dest)
+        cells = self.cells
+        fallback = None
+        for key in (
+            (LEVEL_CITY_CITY, orig, dest, bt),
+            (LEVEL_CITY_REGION, orig, dreg, bt) if dreg else None,
+            (LEVEL_REGION_REGION, oreg, dreg, bt) if oreg and dreg else None,
+            (LEVEL_REGION_ANY, oreg, ANY, bt) if oreg else None,
+            (LEVEL_COUNTRY, ANY, ANY, bt),
+            (LEVEL_COUNTRY_ANY_BODY, ANY, ANY, ANY),
+        ):
+            if key is None:
+                continue
+            cell = cells.get(key)
+            if cell is None:
+                continue
+            if cell[0] >= min_samples:
+                return (key[0], *cell)
+            fallback = (key[0], *cell)
+        return fallback
+
+    def p20(self, orig: str, dest: str, body_type: Optional[str],
+            orig_region: Optional[str] = None, dest_region: Optional[str] = None) -> Optional[float]:
+        hit = self.lookup(orig, dest, body_type, orig_region, dest_region)
+        return hit[2] if hit else None
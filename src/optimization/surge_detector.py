@@ -1,16 +1,15 @@
 
-from typing import List
+from typing import List, Optional, Tuple, Union
 from datetime import datetime
-from models import Freight
-from database import get_guaranteed_rate, insert_rate_surge_event
+from models import Freight, FreightRecord
+from database import insert_rate_surge_events
 from config import SURGE_THRESHOLD_MULTIPLIER
+from market_baseline import MarketBaseline, get_market_baseline
 
-def check_and_log_surges(freights: List[Freight]) -> int:
-    """Checks each freight vs guaranteed p20 and logs surge events when >= +30%.
-       Returns number of surge events logged."""
-    if not freights:
-        return 0
-    cnt = 0
+def find_surges(freights: List[Union[Freight, FreightRecord]], baseline: MarketBaseline) -> List[Tuple]:
+    """Surge rows (ts, orig, dest, body_type, freight_id, rub_per_km, baseline, uplift) — no I/O."""
+    rows: List[Tuple] = []
+    ts = datetime.utcnow().isoformat()
     for f in freights:
         try:
             loading_city = f.loading_points[0] if f.loading_points else None
@@ -18,28 +17,24 @@ def check_and_log_surges(freights: List[Freight]) -> int:
             if not loading_city or not unloading_city or not f.revenue_rub or not f.distance:
                 continue
             rubkm = f.revenue_rub / f.distance if f.distance else 0.0
-            # crude DOW: try from loading_date
-            dow = 7
-            if f.loading_date and len(f.loading_date) >= 10:
-                y, m, d = int(f.loading_date[:4]), int(f.loading_date[5:7]), int(f.loading_date[8:10])
-                import datetime as _dt
-                dow = _dt.date(y, m, d).weekday()
-            baseline = get_guaranteed_rate(loading_city, unloading_city, f.body_type or "n/a", dow)
-            if not baseline or baseline <= 0:
+            dow = baseline.day_of_week(f.loading_date)
+            base = baseline.guaranteed_rate(loading_city, unloading_city, f.body_type or "n/a", dow,
+                                            f.loading_region, f.unloading_region)
+            if not base or base <= 0:
                 continue
-            if rubkm >= SURGE_THRESHOLD_MULTIPLIER * baseline:
-                uplift = rubkm / baseline
-                insert_rate_surge_event(
-                    ts=datetime.utcnow().isoformat(),
-                    orig=loading_city,
-                    dest=unloading_city,
-                    body_type=f.body_type or "n/a",
-                    freight_id=f.id,
-                    rub_per_km=rubkm,
-                    baseline=baseline,
-                    uplift=uplift
-                )
-                cnt += 1
+            if rubkm >= SURGE_THRESHOLD_MULTIPLIER * base:
+                rows.append((ts, loading_city, unloading_city, f.body_type or "n/a", f.id,
+                             rubkm, base, rubkm / base))
         except Exception:
             continue
-    return cnt
+    return rows
+
+def check_and_log_surges(freights: List[Union[Freight, FreightRecord]], baseline: Optional[MarketBaseline] = None) -> int:
+    """Checks each freight vs guaranteed p20 and logs surge events when >= +30%.
+       Baseline comes from an in-memory market_stats snapshot; events are written in one batch.
+       Returns number of surge events logged."""
+    if not freights:
+        return 0
+    rows = find_surges(freights, baseline or get_market_baseline())
+    insert_rate_surge_events(rows)
+    return len(rows)
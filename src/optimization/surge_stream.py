@@ -0,0 +1,146 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from data_processor import process_freights, parser_record_to_raw
+from database import insert_rate_surge_events
+from market_baseline import MarketBaseline, get_market_baseline
+from surge_detector import find_surges
+from jsonl_tail import OffsetCheckpoint, iter_jsonl_batches, list_jsonl_files, logical_size
+
+# Потоковая проверка всплесков ставок по живому выводу парсера.
+# Хвостим regions_data/<регион>/*.jsonl (append_freights_to_jsonl) или читаем очередь,
+# которую наполняет парсер; каждые batch_size строк -> process_freights -> find_surges
+# против MarketBaseline в памяти -> insert_rate_surge_events. Смещения по файлам
+# сохраняются в checkpoint после записи событий (at-least-once, повтор гасится LRU).
+
+DEFAULT_REGIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   'parsers', 'regions_data')
+DEFAULT_CHECKPOINT_PATH = os.path.join(DEFAULT_REGIONS_DIR, 'surge_stream_offsets.json')
+DEFAULT_BATCH_SIZE = 500
+SEEN_SURGES_MAX = 50_000
+
+logger = logging.getLogger('SurgeStream')
+
+
+class SurgeStream:
+    def __init__(self, regions_dir: str = DEFAULT_REGIONS_DIR,
+                 checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+                 baseline: Optional[MarketBaseline] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 from_beginning: bool = False):
+        self.regions_dir = regions_dir
+        self.checkpoint_path = checkpoint_path
+        self.batch_size = batch_size
+        self._baseline = baseline
+        self._seen: 'OrderedDict[Tuple[str, float], None]' = OrderedDict()
+        self.checkpoint = OffsetCheckpoint(checkpoint_path)
+        self.stats = {'lines': 0, 'freights': 0, 'bad': 0, 'surges': 0}
+        if not self.checkpoint.exists and not from_beginning:
+            # первый запуск: старые выгрузки не пересматриваем, начинаем с текущего конца
+            for path in list_jsonl_files(regions_dir):
+                self.checkpoint.set(path, logical_size(path))
+            self.checkpoint.save()
+
+    # ---------- detection ----------
+
+    @property
+    def baseline(self) -> MarketBaseline:
+        if self._baseline is not None:
+            self._baseline.refresh_if_changed()
+            return self._baseline
+        return get_market_baseline()
+
+    def detect(self, records: Iterable[Dict[str, Any]]) -> List[Tuple]:
+        """Normalize records and log their surges; returns the newly logged rows."""
+        records = list(records)
+        freights = list(process_freights(parser_record_to_raw(rec) for rec in records))
+        self.stats['bad'] += len(records) - len(freights)
+        self.stats['freights'] += len(freights)
+        if not freights:
+            return []
+        rows = []
+        for row in find_surges(freights, self.baseline):
+            key = (row[4], round(row[5], 2))   # freight_id, rub/km: повтор того же груза не логируем
+            if key in self._seen:
+                continue
+            self._seen[key] = None
+            if len(self._seen) > SEEN_SURGES_MAX:
+                self._seen.popitem(last=False)
+            rows.append(row)
+        insert_rate_surge_events(rows)
+        self.stats['surges'] += len(rows)
+        for ts, orig, dest, bt, fid, rpk, base, up in rows:
+            logger.info(f"⚡ {orig} → {dest} [{bt}] {rpk:.1f} ₽/км (база {base:.1f}, x{up:.2f}) груз {fid}")
+        return rows
+
+    # ---------- file tail ----------
+
+    def poll_once(self) -> int:
+        """One pass over all region files; returns number of surge events logged."""
+        logged = 0
+        for path in list_jsonl_files(self.regions_dir):
+            offset = self.checkpoint.get(path)
+            try:
+                size = logical_size(path)
+            except OSError:
+                continue
+            if size < offset:
+                offset = 0             # файл пересоздан/обрезан
+            if offset >= size:
+                continue
+            for records, new_offset in iter_jsonl_batches(path, offset, self.batch_size, self.stats):
+                logged += len(self.detect(records))
+                offset = new_offset
+                self.checkpoint.set(path, offset)
+                self.checkpoint.save()
+        return logged
+
+    def run(self, poll_interval: float = 2.0, stop_event: Optional[threading.Event] = None) -> None:
+        logger.info(f"Surge stream: {self.regions_dir}, checkpoint {self.checkpoint_path}")
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error(f"Ошибка surge stream: {e}")
+            stop_event.wait(poll_interval)
+
+    # ---------- queue ----------
+
+    def consume_queue(self, q: 'queue.Queue', flush_sec: float = 1.0,
+                      stop_event: Optional[threading.Event] = None) -> None:
+        """Consume parser records from a queue (None = stop); batches flush on size or flush_sec."""
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + flush_sec
+        while True:
+            try:
+                item = q.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = ...
+            if item is None or (stop_event is not None and stop_event.is_set()):
+                break
+            if item is not ...:
+                batch.extend(item if isinstance(item, list) else [item])
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    self.detect(batch)
+                batch = []
+                deadline = time.monotonic() + flush_sec
+        if batch:
+            self.detect(batch)
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ap = argparse.ArgumentParser(description="Streaming surge detection over parser JSONL output")
+    ap.add_argument('--dir', default=DEFAULT_REGIONS_DIR)
+    ap.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT_PATH)
+    ap.add_argument('--interval', type=float, default=2.0)
+    ap.add_argument('--from-beginning', action='store_true')
+    args = ap.parse_args()
+    SurgeStream(args.dir, args.checkpoint, from_beginning=args.from_beginning).run(args.interval)
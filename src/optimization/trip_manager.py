@@ -1,11 +1,12 @@
 
 from __future__ import annotations
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Dict
 from datetime import datetime, timedelta
+import logging
 
-from src.core.trip_models import Trip, TripMetrics, Segment
-from src.data_layer.trip_repo import (migrate, get_trip, replace_plan, list_locked_segments, log_replan)
-from src.data_layer.gps_feed import get_current_city
+from src.core.trip_models import Trip, TripMetrics, Segment, PlanCommit
+from src.data_layer.trip_repo import (migrate, get_trip, list_locked_segments, commit_plan, commit_plans)
+from src.data_layer.gps_feed import get_current_city, get_current_cities
 try:
     from src.core.config import FREEZE_MINUTES, REPLAN_BENEFIT_THRESHOLD_PCT
 except Exception:
@@ -30,14 +31,9 @@ def _select_best(routes: List[Any]) -> Optional[Any]:
         return (m.revenue_per_day, getattr(r, 'revenue_per_hour', 0.0), m.km)
     return sorted(routes, key=key, reverse=True)[0]
 
-def replan_trip(trip_id: int, now: Optional[str] = None) -> Optional[TripMetrics]:
-    migrate()
-    trip = get_trip(trip_id)
-    if not trip:
-        raise ValueError(f"Trip {trip_id} not found")
-
-    # current city from GPS (fallback на гараж)
-    current_city = get_current_city(trip.vehicle_id) or trip.garage_city
+def _plan_trip(trip: Trip, current_city: str, now: Optional[str] = None) -> PlanCommit:
+    """Build routes from current_city and decide; nothing is written here."""
+    trip_id = trip.id
     start_time_iso = now or datetime.utcnow().isoformat(timespec="seconds")
 
     # import builder lazily
@@ -70,8 +66,7 @@ def replan_trip(trip_id: int, now: Optional[str] = None) -> Optional[TripMetrics
 
     best = _select_best(routes)
     if not best:
-        log_replan(trip_id, accepted=False, delta_revenue_per_day=0.0, reason="no_routes")
-        return None
+        return PlanCommit(trip_id=trip_id, accepted=False, delta_revenue_per_day=0.0, reason="no_routes")
 
     new_plan = _normalize_route_obj(best)
 
@@ -97,12 +92,45 @@ def replan_trip(trip_id: int, now: Optional[str] = None) -> Optional[TripMetrics
                     revenue=float(getattr(seg, 'revenue', 0.0) or 0.0),
                     status='planned',
                     locked=0,
-                    note='auto-plan'
+                    note='auto-plan',
+                    unloading_region=getattr(seg, 'unloading_region', None)
+                                     or getattr(getattr(seg, 'freight', None), 'unloading_region', None)
                 ))
             except Exception:
                 continue
 
-    if accept:
-        replace_plan(trip_id, segs, new_plan)
-    log_replan(trip_id, accepted=accept, delta_revenue_per_day=delta_rpd, reason="auto")
-    return new_plan if accept else None
+    return PlanCommit(trip_id=trip_id, accepted=accept, delta_revenue_per_day=delta_rpd, reason="auto",
+                      segments=segs, plan_metrics=new_plan)
+
+def replan_trip(trip_id: int, now: Optional[str] = None) -> Optional[TripMetrics]:
+    migrate()
+    trip = get_trip(trip_id)
+    if not trip:
+        raise ValueError(f"Trip {trip_id} not found")
+
+    # current city from GPS (fallback на гараж)
+    current_city = get_current_city(trip.vehicle_id) or trip.garage_city
+    result = _plan_trip(trip, current_city, now)
+    # план, метрики и replan_log — одной транзакцией
+    commit_plan(result)
+    return result.plan_metrics if result.accepted else None
+
+def replan_trips(trip_ids: List[int], now: Optional[str] = None) -> Dict[int, Optional[TripMetrics]]:
+    """Batch replan: one GPS read for the whole fleet and one commit for all plans.
+    Unknown trip ids map to None; a trip whose planning fails is skipped (not logged)."""
+    migrate()
+    trips = [t for t in (get_trip(tid) for tid in trip_ids) if t]
+    cities = get_current_cities(t.vehicle_id for t in trips)
+    results: Dict[int, Optional[TripMetrics]] = {tid: None for tid in trip_ids}
+    commits: List[PlanCommit] = []
+    for trip in trips:
+        try:
+            res = _plan_trip(trip, cities.get(trip.vehicle_id) or trip.garage_city, now)
+        except Exception as e:
+            logging.getLogger(__name__).warning("replan of trip %s failed: %s", trip.id, e)
+            continue
+        commits.append(res)
+        if res.accepted:
+            results[trip.id] = res.plan_metrics
+    commit_plans(commits)
+    return results
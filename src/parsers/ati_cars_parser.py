@@ -25,6 +25,12 @@ from datetime import datetime, timezone
 from urllib.parse import urlencode
 
 import ati_auth  # is_logged_in, load_session, save_cookies, COOKIES_FILE
+import page_pipeline
+from jsonl_sink import JsonlSink
+import html_extract
+import xhr_capture
+import delta_crawl
+import region_scheduler
 
 # =======================
 # НАСТРОЙКИ (как у грузов)
@@ -35,6 +41,16 @@ PAGE_WAIT: float = 0.05
 WAIT_LONG_SEC: int = 10
 CRITICAL_RECOVERY_TIMEOUT: int = 15
 MEMORY_LIMIT_MB: int = 12000
+# карточки из JSON-ответа поиска (CDP performance log) вместо DOM, с откатом на DOM
+CAPTURE_XHR: bool = False
+# инкрементальный обход регионов (delta_crawl, как у грузов): стоп на отметке прошлого
+# обхода (только при сортировке "сначала новые") или после N страниц без новых машин
+DELTA_CRAWL: bool = False
+DELTA_STOP_AFTER_PAGES: int = delta_crawl.DELTA_STOP_AFTER_PAGES
+DELTA_SORTED_NEWEST: bool = False
+DELTA_SORT_QUERY: Dict[str, str] = {}
+# порядок/частота автопарса регионов по наблюдаемой выработке (region_scheduler)
+ADAPTIVE_SCHEDULING: bool = False
 
 # «после 5 — мягкая очистка, после 10 — рестарт»
 SOFT_CLEAN_EVERY: int = 5
@@ -130,6 +146,24 @@ class _DedupFacade:
         self.mem.add(key)
         return False
 
+    def mark_seen_many(self, keys: List[str], ttl: int = 14 * 24 * 3600) -> List[bool]:
+        """Флаги "дубликат" для пачки ключей: Redis — одним pipeline, иначе память процесса."""
+        flags = [False] * len(keys)
+        idx = [i for i, k in enumerate(keys) if k]
+        if not idx:
+            return flags
+        batch = [keys[i] for i in idx]
+        try:
+            if self.rm and hasattr(self.rm, "mark_seen_many"):
+                for i, dup in zip(idx, self.rm.mark_seen_many(batch, ttl)):
+                    flags[i] = bool(dup)
+                return flags
+        except Exception:
+            pass
+        for i, k in zip(idx, batch):
+            flags[i] = self.is_duplicate(k, ttl)
+        return flags
+
 DEDUP = _DedupFacade()
 
 # =======================
@@ -170,6 +204,8 @@ def init_driver(headless: bool = False) -> webdriver.Chrome:
     opts.add_argument("--lang=ru-RU")
     if headless:
         opts.add_argument("--headless=new")
+    if CAPTURE_XHR:
+        xhr_capture.enable_performance_log(opts)
     opts.add_argument(f"--user-data-dir={str(CHROME_PROFILE)}")
     opts.add_argument("--profile-directory=Default")
     opts.add_argument("--window-size=1440,900")
@@ -180,6 +216,8 @@ def init_driver(headless: bool = False) -> webdriver.Chrome:
     drv.set_page_load_timeout(CRITICAL_RECOVERY_TIMEOUT)
     drv.set_script_timeout(CRITICAL_RECOVERY_TIMEOUT)
     drv.implicitly_wait(2)
+    if CAPTURE_XHR:
+        xhr_capture.start(drv)
     return drv
 
 def ensure_logged_in(driver, interactive: bool = False) -> bool:
@@ -444,8 +482,17 @@ def check_white_screen(driver) -> bool:
 # Парсинг карточек (JS-проход)
 # =======================
 def parse_cards_on_page(driver) -> List[Dict[str, Any]]:
+    return build_truck_rows(extract_cards_on_page(driver))
+
+def extract_cards_on_page(driver) -> List[Dict[str, Any]]:
+    """Сырые карточки страницы одним execute_script (браузерная часть parse_cards_on_page)."""
+    if CAPTURE_XHR:
+        cards = xhr_capture.truck_cards(driver)
+        if cards:
+            return cards
+        logger.debug("JSON-ответ поиска не пойман — разбор DOM")
     try:
-        data: List[Dict[str, Any]] = driver.execute_script("""
+        return driver.execute_script("""
             const out = [];
             for (const card of document.querySelectorAll('div[data-qa^="truck-card-"]')) {
               const g = sel => { const el = card.querySelector(sel); return el ? el.textContent.trim() : ''; };
@@ -462,11 +509,12 @@ def parse_cards_on_page(driver) -> List[Dict[str, Any]]:
               });
             }
             return out;
-        """)
+        """) or []
     except Exception as exc:
         logger.error(f"Ошибка выполнения JS для парсинга: {exc}")
         return []
 
+def build_truck_rows(data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     rows: List[Dict[str, Any]] = []
     for item in data:
         rid            = (item.get("rid") or "").strip()
@@ -582,17 +630,23 @@ def _parse_price_block(block_text: str) -> Dict[str, Any]:
 # =======================
 # JSONL сохранение
 # =======================
-def append_jsonl(path: Path, rows: List[Dict[str, Any]]) -> Tuple[int,int]:
-    saved, dups = 0, 0
+# один буферизованный файл на регион/фильтр, ротация, опционально gzip (см. jsonl_sink)
+JSONL_COMPRESSION: Optional[str] = None
+JSONL_SINK = JsonlSink(str(REGIONS_DATA_DIR), compression=JSONL_COMPRESSION)
+
+# снимки HTML страниц для офлайн-перепарсинга: python html_extract.py page_snapshots_trucks --kind trucks
+SAVE_PAGE_SNAPSHOTS: bool = False
+SNAPSHOTS_DIR = PARSERS_DIR / "page_snapshots_trucks"
+HIGH_WATER_DIR = PARSERS_DIR / "region_high_water_trucks"
+REGION_STATS_DIR = PARSERS_DIR / "region_stats_trucks"
+
+def append_jsonl(stream: str, rows: List[Dict[str, Any]]) -> Tuple[int,int]:
     if not rows: return (0,0)
-    with path.open("a", encoding="utf-8") as f:
-        for r in rows:
-            key = str(r.get("_dedup_key") or r.get("id_rid") or r.get("href") or "")
-            if key and DEDUP.is_duplicate(key, ttl=14*24*3600):
-                dups += 1; continue
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-            saved += 1
-    return (saved, dups)
+    keys = [str(r.get("_dedup_key") or r.get("id_rid") or r.get("href") or "") for r in rows]
+    dup_flags = DEDUP.mark_seen_many(keys, ttl=14*24*3600)   # один round trip на страницу
+    fresh = [r for r, is_dup in zip(rows, dup_flags) if not is_dup]
+    saved = JSONL_SINK.write(stream, fresh)
+    return (saved, len(rows) - len(fresh))
 
 # =======================
 # Сценарии / CLI
@@ -652,30 +706,79 @@ def _loop_pages(driver, name_or_region: str, url: str, is_region: bool, start_pa
     page = max(1, min(start_page, total_pages))
     if is_region:
         logger.info(f"Восстановление прогресса: {name_or_region}, страница {page}/{total_pages}")
-    out_dir = (REGIONS_DATA_DIR / (name_or_region if is_region else f"filter_{name_or_region}"))
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_file = out_dir / f"{name_or_region}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.jsonl"
+    stream = name_or_region if is_region else f"filter_{name_or_region}"
+    delta: Optional[delta_crawl.DeltaTracker] = None
+    if DELTA_CRAWL and is_region:
+        delta = delta_crawl.DeltaTracker(name_or_region, delta_crawl.load_mark(str(HIGH_WATER_DIR), name_or_region),
+                                         DELTA_SORTED_NEWEST or bool(DELTA_SORT_QUERY), DELTA_STOP_AFTER_PAGES)
+    crawl = {"pages": 0, "found": 0, "new": 0}
+    crawl_started = time.monotonic()
+
+    # разбор/дедуп/запись/прогресс — в фоне; прогресс пишется после записи страницы
+    def _write_page(item: Tuple[int, int, List[Dict[str, Any]], Optional[str]]) -> None:
+        w_page, w_total, raw, html = item
+        if html:
+            try:
+                html_extract.save_snapshot(str(SNAPSHOTS_DIR), stream, w_page, html)
+            except OSError as exc:
+                logger.warning(f"Не удалось сохранить снимок страницы {w_page}: {exc}")
+        rows = build_truck_rows(raw)
+        saved, dups = append_jsonl(stream, rows)
+        logger.info(f"Страница {w_page}/{w_total}: найдено {len(rows)}, сохранено {saved}, дубликатов {dups}")
+        crawl["pages"] += 1
+        crawl["found"] += len(rows)
+        crawl["new"] += saved
+        if delta is not None:
+            delta.record_page(w_page, len(rows), saved)
+        JSONL_SINK.checkpoint(stream)            # fsync до записи прогресса
+        if is_region:
+            save_region_progress(name_or_region, w_page, w_total, 0)
+        else:
+            set_next_page_for_filter(name_or_region, w_page + 1)
 
+    writer = page_pipeline.PageWriter(_write_page)
+    done = False
+    try:
+        done = _paginate(driver, url, page, total_pages, writer, delta)
+    finally:
+        writer.close()
+        JSONL_SINK.close(stream)
+    if delta is not None and done:
+        new_mark = delta.new_mark()
+        if new_mark:
+            try:
+                delta_crawl.save_mark(str(HIGH_WATER_DIR), name_or_region, new_mark)
+            except OSError as exc:
+                logger.warning(f"Не удалось сохранить отметку региона {name_or_region}: {exc}")
+        logger.info(f"Регион {name_or_region}: страниц {delta.pages} из {total_pages}, новых машин {delta.new_loads}")
+    if is_region and done:
+        try:
+            region_scheduler.record_crawl(str(REGION_STATS_DIR), name_or_region, crawl["pages"], crawl["found"],
+                                          crawl["new"], time.monotonic() - crawl_started)
+        except OSError as exc:
+            logger.warning(f"Не удалось сохранить статистику региона {name_or_region}: {exc}")
+
+def _paginate(driver, url: str, page: int, total_pages: int, writer: page_pipeline.PageWriter,
+              delta: Optional[delta_crawl.DeltaTracker] = None) -> bool:
+    """True — регион пройден (последняя страница или стоп инкрементального обхода)."""
     while page <= total_pages:
         logger.info(f"Перед парсингом страницы {page}. Использование памяти: {memory_usage_mb():.2f} MB")
         if not navigate_to_page(driver, page):
             logger.error(f"Не удалось перейти на страницу {page}")
-            break
+            return False
         if check_white_screen(driver):
             logger.warning("Белый экран — рестарт и восстановление…")
             new_drv = restart_driver(driver, restore_url=url, restore_page=page)
-            if not new_drv: break
+            if not new_drv: return False
             driver = new_drv
 
-        rows = parse_cards_on_page(driver)
-        saved, dups = append_jsonl(out_file, rows)
-        logger.info(f"Страница {page}/{total_pages}: найдено {len(rows)}, сохранено {saved}, дубликатов {dups}")
-
-        # прогресс
-        if is_region:
-            save_region_progress(name_or_region, page, total_pages, 0)
-        else:
-            set_next_page_for_filter(name_or_region, page + 1)
+        raw = extract_cards_on_page(driver)
+        html = None
+        if SAVE_PAGE_SNAPSHOTS:
+            with suppress(Exception): html = driver.execute_script(html_extract.SNAPSHOT_JS)
+        writer.submit((page, total_pages, raw, html))
+        if delta is not None:
+            delta.observe_ids(page, [r.get("rid") for r in raw])
 
         # мягкая очистка после каждой 5-й страницы
         if page % SOFT_CLEAN_EVERY == 0:
@@ -685,11 +788,16 @@ def _loop_pages(driver, name_or_region: str, url: str, is_region: bool, start_pa
         if page % HARD_RESTART_EVERY == 0:
             logger.info(f"Жёсткая перезагрузка после страницы {page}")
             new_drv = restart_driver(driver, restore_url=url, restore_page=page+1)
-            if not new_drv: break
+            if not new_drv: return False
             driver = new_drv
             total_pages = max(total_pages, wait_total_pages(driver, baseline=total_pages, attempts=3, delay=0.12))
 
-        if check_stopfile(): break
+        if check_stopfile(): return False
+
+        stop_reason = delta.stop_reason() if delta is not None else None
+        if stop_reason:
+            logger.info(f"Инкрементальный обход завершён на странице {page}/{total_pages}: {stop_reason}")
+            return True
 
         nxt = click_next_button(driver)
         if nxt is True:
@@ -699,10 +807,11 @@ def _loop_pages(driver, name_or_region: str, url: str, is_region: bool, start_pa
                 page += 1
             else:
                 logger.info("Кнопка 'Далее' неактивна — последняя страница")
-                break
+                return True
         else:
             logger.warning("Кнопка 'Далее' не сработала — завершаем цикл.")
-            break
+            return False
+    return True
 
 def scenario_parse_saved_filter() -> None:
     files = sorted(FILTERS_DIR.glob("*.json"))
@@ -763,10 +872,22 @@ def scenario_autoparse_regions() -> None:
         progress = load_region_progress()
         start_idx = int(progress.get("region_idx", 0)) if progress else 0
 
+        if ADAPTIVE_SCHEDULING:
+            # план заново на каждый запуск (пройденные ещё не "созрели"), прерванный регион — первым
+            by_region = {read_json(rf, {}).get("region", rf.stem): rf for rf in region_files}
+            plan, _ = region_scheduler.plan(list(by_region), str(REGION_STATS_DIR))
+            interrupted = progress.get("region") if progress and int(progress.get("page", 1)) > 1 else None
+            if interrupted in by_region:
+                plan = [interrupted] + [r for r in plan if r != interrupted]
+            logger.info(f"Адаптивный план: {len(plan)} из {len(by_region)} регионов")
+            region_files, start_idx = [by_region[r] for r in plan], 0
+
         for i, rf in enumerate(region_files[start_idx:], start=start_idx):
             cfg = read_json(rf, {})
             region = cfg.get("region", rf.stem)
             url    = cfg.get("url", f"{TRUCKS_SEARCH_URL}?FromGeo={region}")
+            if DELTA_CRAWL:
+                url = delta_crawl.with_query(url, DELTA_SORT_QUERY)
             logger.info(f"Обрабатываем регион: {region} ({i+1}/{len(region_files)})")
             driver.get(url)
             ensure_100_rows(driver)
@@ -802,7 +923,10 @@ def scenario_make_stop() -> None:
 def _signal_handler(_sig, _frame) -> None:
     logger.info("Получен сигнал остановки. Завершение…")
     try:
-        pass
+        page_pipeline.close_all(timeout=30)   # дописать уже снятые страницы
+        JSONL_SINK.close()
+    except Exception as exc:
+        logger.warning(f"Ошибка при сбросе фоновой записи: {exc}")
     finally:
         os._exit(0)
 
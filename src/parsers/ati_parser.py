@@ -27,7 +27,7 @@ import traceback
 import re
 import hashlib
 from datetime import datetime
-from typing import Optional, List, Dict, Any, Tuple, Set
+from typing import Optional, List, Dict, Any, Tuple, Set, Callable
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -43,6 +43,14 @@ from selenium.common.exceptions import (
     WebDriverException
 )
 
+from seen_filter import SeenFilter
+import page_pipeline
+from jsonl_sink import JsonlSink
+import html_extract
+import xhr_capture
+import delta_crawl
+import region_scheduler
+
 # ---------------------------
 # ЛОГИРОВАНИЕ
 # ---------------------------
@@ -96,8 +104,9 @@ if not REDIS_AVAILABLE or redis_manager_instance is None:
 stop_parsing = False
 current_driver: Optional[webdriver.Chrome] = None
 
-# Сеансовый набор увиденных хэшей — защита от повторов при сбоях Redis
-SESSION_SEEN_HASHES: Set[str] = set()
+# Хук координатора (region_crawler): вызывается перед переходом на каждую следующую
+# страницу, ждёт общий бюджет запросов; False — остановить разбор.
+PAGE_RATE_LIMITER: Optional[Callable[[], bool]] = None
 
 MAX_DRIVER_RECOVERY_ATTEMPTS = 3
 MAX_CONSECUTIVE_ERRORS = 5
@@ -122,6 +131,41 @@ JS_HEAP_LIMIT = 49152
 REGIONS_DATA_DIR = os.path.join(SCRIPT_DIR, "regions_data")
 REGION_PROGRESS_FILE = os.path.join(SCRIPT_DIR, "region_progress.json")
 
+# Вывод по регионам: один буферизованный файл на регион, ротация по размеру/времени,
+# JSONL_COMPRESSION = "gzip" — сжатые *.jsonl.gz (None — обычный JSONL, читается на лету)
+JSONL_COMPRESSION: Optional[str] = None
+JSONL_SINK = JsonlSink(REGIONS_DATA_DIR, compression=JSONL_COMPRESSION)
+
+# Увиденные хэши (Bloom с поколениями, сохраняется между запусками): проверяется до Redis,
+# без Redis — единственный дедуп. Каждый FILTER_VERIFY_EVERY-й повтор перепроверяется в
+# Redis — так меряется реальная доля ложных срабатываний.
+SEEN_FILTER_FILE = os.path.join(SCRIPT_DIR, "seen_hashes.bloom")
+SESSION_SEEN_HASHES = SeenFilter(SEEN_FILTER_FILE)
+FILTER_VERIFY_EVERY = 100
+
+# Снимки HTML страниц (*.html.gz) для офлайн-перепарсинга: python html_extract.py page_snapshots
+SAVE_PAGE_SNAPSHOTS = False
+SNAPSHOTS_DIR = os.path.join(SCRIPT_DIR, "page_snapshots")
+
+# Карточки из JSON-ответа поиска (performance log / CDP Network) вместо DOM; если ответ
+# не пойман или не разобран — страница читается из DOM как обычно
+CAPTURE_XHR = False
+
+# Инкрементальный обход (delta_crawl): регион заканчивается на отметке прошлого обхода или
+# после DELTA_STOP_AFTER_PAGES страниц без новых грузов. Отметка работает только при
+# сортировке "сначала новые": сохраните её в фильтре региона (DELTA_SORTED_NEWEST = True)
+# или задайте параметр сортировки в URL через DELTA_SORT_QUERY.
+DELTA_CRAWL = False
+DELTA_STOP_AFTER_PAGES = delta_crawl.DELTA_STOP_AFTER_PAGES
+DELTA_SORTED_NEWEST = False
+DELTA_SORT_QUERY: Dict[str, str] = {}
+HIGH_WATER_DIR = os.path.join(SCRIPT_DIR, "region_high_water")
+
+# Статистика обходов регионов пишется всегда; ADAPTIVE_SCHEDULING — порядок и частота обхода
+# по ожидаемым новым грузам на минуту браузера (region_scheduler) вместо полного списка по порядку
+ADAPTIVE_SCHEDULING = False
+REGION_STATS_DIR = os.path.join(SCRIPT_DIR, "region_stats")
+
 CRITICAL_RECOVERY_TIMEOUT = 10
 UNKNOWN_ERROR_TIMEOUT = 20
 
@@ -209,6 +253,15 @@ def signal_handler(_sig: int, _frame: Any) -> None:
     global stop_parsing, current_driver
     logger.info("Получен сигнал остановки. Сохранение данных...")
     stop_parsing = True
+    try:
+        page_pipeline.close_all(timeout=30)       # дописать уже снятые страницы
+        JSONL_SINK.close()
+    except Exception as e:
+        logger.warning(f"Ошибка при сбросе фоновой записи: {e}")
+    try:
+        SESSION_SEEN_HASHES.save()
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить фильтр дубликатов: {e}")
     try:
         if current_driver is not None:
             try:
@@ -552,6 +605,46 @@ def is_duplicate_with_fallback(freight_hash: str, ttl_seconds: int = 7*24*3600)
     SESSION_SEEN_HASHES.add(freight_hash)
     return False
 
+def mark_seen_many_with_fallback(freight_hashes: List[str], ttl_seconds: int = 7*24*3600) -> List[bool]:
+    """Дедуп страницы одним запросом (RedisManager.mark_seen_many); флаги "дубликат" по порядку."""
+    flags = [True] * len(freight_hashes)
+    fresh: List[int] = []
+    sampled: Set[int] = set()
+    batch_seen: Set[str] = set()
+    can_verify = hasattr(redis_manager_instance, "mark_seen_many")
+    for i, h in enumerate(freight_hashes):
+        if h in batch_seen:
+            continue
+        batch_seen.add(h)
+        if h in SESSION_SEEN_HASHES:
+            if not can_verify or SESSION_SEEN_HASHES.metrics["hits"] % FILTER_VERIFY_EVERY:
+                continue
+            sampled.add(i)
+        fresh.append(i)
+    if not fresh:
+        return flags
+
+    batch = [freight_hashes[i] for i in fresh]
+    results: Optional[List[bool]] = None
+    if hasattr(redis_manager_instance, "mark_seen_many"):
+        try:
+            results = list(redis_manager_instance.mark_seen_many(batch, ttl_seconds))
+            if len(results) != len(batch):
+                results = None
+        except Exception:
+            results = None
+    if results is None:
+        # старый менеджер без пакетного API — по одному
+        results = [is_duplicate_with_fallback(h, ttl_seconds) for h in batch]
+
+    for i, h, dup in zip(fresh, batch, results):
+        flags[i] = bool(dup)
+        if i in sampled:
+            SESSION_SEEN_HASHES.record_verification(was_new=not dup)
+        SESSION_SEEN_HASHES.add(h)
+    SESSION_SEEN_HASHES.maybe_save()
+    return flags
+
 # ---------------------------
 # ДРАЙВЕР
 # ---------------------------
@@ -593,6 +686,8 @@ def init_driver(headless: bool = False, profile_path: Optional[str] = None) -> w
 
     if headless:
         chrome_options.add_argument("--headless=new")
+    if CAPTURE_XHR:
+        xhr_capture.enable_performance_log(chrome_options)
 
     if profile_path is None:
         profile_path = PROFILE_PATH
@@ -606,6 +701,8 @@ def init_driver(headless: bool = False, profile_path: Optional[str] = None) -> w
     driver.set_page_load_timeout(CRITICAL_RECOVERY_TIMEOUT)
     driver.set_script_timeout(CRITICAL_RECOVERY_TIMEOUT)
     driver.implicitly_wait(2)
+    if CAPTURE_XHR:
+        xhr_capture.start(driver)
     current_driver = driver
     return driver
 
@@ -843,7 +940,10 @@ def apply_region_filter(driver: webdriver.Chrome, region_name: str) -> bool:
     try:
         with open(filter_file, 'rb') as f:
             filter_state = pickle.load(f)
-        driver.get(filter_state['url'])
+        url = filter_state['url']
+        if DELTA_CRAWL:
+            url = delta_crawl.with_query(url, DELTA_SORT_QUERY)
+        driver.get(url)
         logger.info(f"Применен фильтр для региона: {region_name}")
         try:
             WebDriverWait(driver, 20).until(
@@ -1096,8 +1196,6 @@ def handle_pagination(driver: webdriver.Chrome, region_name: str = "filter") ->
     consecutive_errors = 0
     max_consecutive_errors = 2
 
-    jsonl_filename = get_region_jsonl_filename(region_name)
-
     progress = load_region_progress()
     if progress and progress.get("region") == region_name:
         page_num = progress.get("page", 1)
@@ -1115,6 +1213,44 @@ def handle_pagination(driver: webdriver.Chrome, region_name: str = "filter") ->
 
     logger.info(f"ОБЩЕЕ КОЛИЧЕСТВО СТРАНИЦ: {total_pages}")
 
+    delta: Optional[delta_crawl.DeltaTracker] = None
+    if DELTA_CRAWL and region_name != "filter":
+        mark = delta_crawl.load_mark(HIGH_WATER_DIR, region_name)
+        delta = delta_crawl.DeltaTracker(region_name, mark, DELTA_SORTED_NEWEST or bool(DELTA_SORT_QUERY),
+                                         DELTA_STOP_AFTER_PAGES)
+        if mark:
+            logger.info(f"Инкрементальный обход: отметка {mark.get('last_id')} от "
+                        f"{datetime.fromtimestamp(mark.get('crawled_at', 0)).isoformat()}")
+    region_done = False
+    crawl = {"pages": 0, "found": 0, "new": 0}     # пишет только фоновый поток, читаем после close()
+    crawl_started = time.monotonic()
+
+    # нормализация/дедуп/запись/прогресс — в фоне, браузер сразу идёт дальше
+    def _write_page(item: Tuple[int, int, str, List[Optional[Dict[str, Any]]], Optional[str]]) -> None:
+        w_page, w_total, w_url, cards, html = item
+        if html:
+            try:
+                html_extract.save_snapshot(SNAPSHOTS_DIR, region_name, w_page, html)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить снимок страницы {w_page}: {e}")
+        freights, stats = normalize_page_cards(cards)
+        logger.info(f"Страница {w_page}/{w_total}: найдено {stats['found']}, обработано {stats['processed']}, сохранено {stats['saved']}, дубликатов {stats['duplicates']}")
+        if stats.get("errors", 0) > 0:
+            logger.warning(f"На странице {w_page} пропущено карточек из-за ошибок: {stats['errors']}")
+        crawl["pages"] += 1
+        crawl["found"] += stats['found']
+        crawl["new"] += stats['saved']
+        if delta is not None:
+            delta.record_page(w_page, stats['found'], stats['saved'])
+        if freights:
+            append_freights_to_jsonl(freights, region_name)
+        else:
+            logger.warning(f"Нет новых данных на странице {w_page}")
+        # прогресс — только после записи страницы, чтобы возобновление было точным
+        save_region_progress(region_name, w_page, w_total, w_url)
+
+    page_writer = page_pipeline.PageWriter(_write_page)
+
     try:
         while not stop_parsing and not check_stop_file():
             if check_white_screen(driver) or not is_browser_responsive(driver):
@@ -1153,14 +1289,8 @@ def handle_pagination(driver: webdriver.Chrome, region_name: str = "filter") ->
 
             log_memory_usage(f"Перед парсингом страницы {page_num}.")
             try:
-                freights, stats = parse_current_page(driver, page_num)
-                logger.info(f"Страница {page_num}/{total_pages}: найдено {stats['found']}, обработано {stats['processed']}, сохранено {stats['saved']}, дубликатов {stats['duplicates']}")
-                if stats.get("errors", 0) > 0:
-                    logger.warning(f"На странице {page_num} пропущено карточек из-за ошибок: {stats['errors']}")
-                if freights:
-                    append_freights_to_jsonl(freights, jsonl_filename)
-                else:
-                    logger.warning(f"Нет новых данных на странице {page_num}")
+                cards = extract_page_cards(driver)
+                html = capture_page_snapshot(driver) if SAVE_PAGE_SNAPSHOTS else None
                 consecutive_errors = 0
             except (TimeoutException, WebDriverException, Exception) as e:
                 consecutive_errors += 1
@@ -1178,11 +1308,25 @@ def handle_pagination(driver: webdriver.Chrome, region_name: str = "filter") ->
                 page_num = get_current_page_number(driver)
                 continue
 
-            save_region_progress(region_name, page_num, total_pages, safe_current_url(driver))
+            page_writer.submit((page_num, total_pages, safe_current_url(driver), cards, html))
+            if delta is not None:
+                delta.observe_ids(page_num, [c.get('id') for c in cards if c])
+
+            if PAGE_RATE_LIMITER is not None and not PAGE_RATE_LIMITER():
+                logger.info("Остановка по сигналу координатора")
+                stop_parsing = True
+                break
+
+            stop_reason = delta.stop_reason() if delta is not None else None
+            if stop_reason:
+                logger.info(f"Инкрементальный обход {region_name} завершён на странице {page_num}/{total_pages}: {stop_reason}")
+                region_done = True
+                break
 
             next_result = click_next_button(driver)
             if next_result is None:
                 logger.info("Кнопка 'Далее' неактивна — последняя страница")
+                region_done = True
                 break
             elif next_result:
                 page_num += 1
@@ -1202,197 +1346,250 @@ def handle_pagination(driver: webdriver.Chrome, region_name: str = "filter") ->
         logger.error(f"Ошибка пагинации: {str(e)}")
     except Exception as e:
         logger.error(f"Неизвестная ошибка в пагинации: {str(e)}")
+    finally:
+        page_writer.close()
+        JSONL_SINK.close(region_name)
+
+    if delta is not None and region_done:
+        # остановка на отметке = регион пройден (region_crawler смотрит page >= total_pages)
+        save_region_progress(region_name, total_pages, total_pages, safe_current_url(driver))
+        new_mark = delta.new_mark()
+        if new_mark:
+            try:
+                delta_crawl.save_mark(HIGH_WATER_DIR, region_name, new_mark)
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить отметку региона {region_name}: {e}")
+        logger.info(f"Регион {region_name}: страниц {delta.pages} из {total_pages}, новых грузов {delta.new_loads}")
 
+    if region_done and region_name != "filter":
+        try:
+            region_scheduler.record_crawl(REGION_STATS_DIR, region_name, crawl["pages"], crawl["found"],
+                                          crawl["new"], time.monotonic() - crawl_started)
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить статистику региона {region_name}: {e}")
+
+    SESSION_SEEN_HASHES.maybe_save(every_sec=0)
     return driver
 
 # ---------------------------
 # ПАРСИНГ СТРАНИЦЫ
 # ---------------------------
-def parse_current_page(driver: webdriver.Chrome, page_num: int) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
-    if stop_parsing:
-        return [], {"found": 0, "processed": 0, "saved": 0, "duplicates": 0, "errors": 0}
+# Одна JS-функция на всю страницу: все карточки за один execute_script
+# (раньше — по вызову на карточку: ~100 round trip и StaleElementReference).
+_PAGE_EXTRACT_JS = """
+    const extract = (item) => {
+        const data = {
+            id: item.getAttribute('data-load-id') || 'N/A',
+            loading_points: [],
+            unloading_points: [],
+            distance: 'N/A',
+            cargo: 'Н/Д',
+            weight: 'Н/Д',
+            volume: 'Н/Д',
+            prices: {},
+            loading_date: 'Н/Д',
+            body_type: 'Н/Д',
+            loading_method: 'Н/Д',
+            loading_unloading_raw: '',
+            possible_reload: 'нет'
+        };
+        const compositeRoute = item.querySelector("div.PExKw");
+        const directRoute = item.querySelector("div.NcNn7") && item.querySelector("div.OtkNo");
+        try {
+            if (compositeRoute) {
+                const loadingPoint = compositeRoute.querySelector("div.Ha2A8 .yLMmR");
+                if (loadingPoint) {
+                    const city = loadingPoint.textContent.replace('погрузка', '').replace('выгрузка', '').trim();
+                    if (city) data.loading_points.push(city);
+                }
+                const unloadingPoints = compositeRoute.querySelectorAll("div.QnFJD .yLMmR");
+                unloadingPoints.forEach(point => {
+                    const city = point.textContent.replace('погрузка', '').replace('выгрузка', '').trim();
+                    if (city) data.unloading_points.push(city);
+                });
+            } else if (directRoute) {
+                const loadingBlock = item.querySelector("div.NcNn7");
+                if (loadingBlock) {
+                    const cityElement = loadingBlock.querySelector(".BUBXM.h56vj, .BUBXM");
+                    const regionElement = loadingBlock.querySelector(".VX7nr");
+                    const city = cityElement ? cityElement.textContent.trim() : 'Н/Д';
+                    const region = regionElement ? regionElement.textContent.trim() : 'Н/Д';
+                    data.loading_points.push(`${city}, ${region}`);
+                }
+                const unloadingBlock = item.querySelector("div.OtkNo");
+                if (unloadingBlock) {
+                    const cityElement = unloadingBlock.querySelector(".BUBXM.h56vj, .BUBXM");
+                    const regionElement = unloadingBlock.querySelector(".VX7nr");
+                    const city = cityElement ? cityElement.textContent.trim() : 'Н/Д';
+                    const region = regionElement ? regionElement.textContent.trim() : 'Н/Д';
+                    data.unloading_points.push(`${city}, ${region}`);
+                }
+            }
+        } catch (e) {}
+
+        try {
+            const dateElement = item.querySelector("span.qaQg4 .BUBXM");
+            if (dateElement) data.loading_date = dateElement.textContent.trim();
+        } catch (e) {}
+
+        try {
+            let distanceElement = item.querySelector("a.Laof2") || item.querySelector("a.G_fQk");
+            if (distanceElement) data.distance = distanceElement.textContent.replace('км', '').trim();
+        } catch (e) {}
+
+        try {
+            const cargoElement = item.querySelector("div.WZJ4F");
+            if (cargoElement) data.cargo = cargoElement.textContent.trim();
+        } catch (e) {}
+
+        try {
+            const bodyTypeElement = item.querySelector("div.Y_WwK span.wVNyD");
+            if (bodyTypeElement) data.body_type = bodyTypeElement.textContent.trim();
+        } catch (e) {}
+
+        try {
+            const loadingMethodContainer = item.querySelector("div.y7YtP");
+            if (loadingMethodContainer) {
+                const t = loadingMethodContainer.textContent || "";
+                data.loading_unloading_raw = t.replace(/\\s+/g, " ").trim();
+                data.loading_method = data.loading_unloading_raw.replace(/(загр\\/выгр|загр|выгр)\\s*:\\s*/gi, "").trim();
+            }
+        } catch (e) {}
+
+        try {
+            const weightVolumeElement = item.querySelector("div.h49FM");
+            if (weightVolumeElement) {
+                const text = weightVolumeElement.textContent.trim();
+                if (text.includes('/')) {
+                    const parts = text.split('/');
+                    data.weight = parts[0].trim();
+                    data.volume = parts[1].trim();
+                } else {
+                    data.weight = text || 'Н/Д';
+                    data.volume = 'Н/Д';
+                }
+            }
+        } catch (e) {}
+
+        try {
+            const priceBlocks = item.querySelectorAll("div.eSeMX");
+            priceBlocks.forEach(block => {
+                const priceTypeElement = block.querySelector(".f3LPw");
+                const amountElement = block.querySelector(".BUBXM");
+                if (priceTypeElement && amountElement) {
+                    const priceType = priceTypeElement.textContent.trim();
+                    const amount = amountElement.textContent.trim();
+                    if (priceType.includes('с НДС')) data.prices['с_НДС'] = amount;
+                    else if (priceType.includes('без НДС')) data.prices['без_НДС'] = amount;
+                    else if (priceType.includes('нал')) data.prices['наличные'] = amount;
+                }
+            });
+        } catch (e) {}
+
+        try {
+            const reloadElement = item.querySelector("div.ctSCk");
+            if (reloadElement) {
+                const text = reloadElement.textContent.toLowerCase();
+                if (text.includes('догруз') || text.includes('догр') || text.includes('возм.догруз')) {
+                    data.possible_reload = 'да';
+                }
+            }
+        } catch (e) {}
+
+        return data;
+    };
+    const out = [];
+    for (const item of document.querySelectorAll("section[data-app='pretty-load']")) {
+        try { out.push(extract(item)); } catch (e) { out.push(null); }
+    }
+    return out;
+"""
 
+def extract_page_cards(driver: webdriver.Chrome) -> List[Optional[Dict[str, Any]]]:
+    """Сырые карточки текущей страницы (всё, что требует браузера)."""
+    if CAPTURE_XHR:
+        cards = xhr_capture.freight_cards(driver)
+        if cards:
+            return cards
+        logger.debug("JSON-ответ поиска не пойман — разбор DOM")
     WebDriverWait(driver, CRITICAL_RECOVERY_TIMEOUT).until(
         EC.presence_of_element_located((By.CSS_SELECTOR, "section[data-app='pretty-load']"))
     )
+    return driver.execute_script(_PAGE_EXTRACT_JS) or []
 
-    items = driver.find_elements(By.CSS_SELECTOR, "section[data-app='pretty-load']")
-    total_found = len(items)
-    saved = 0
-    duplicates = 0
-    errors = 0
-    freights: List[Dict[str, Any]] = []
+def parse_current_page(driver: webdriver.Chrome, page_num: int) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    if stop_parsing:
+        return [], {"found": 0, "processed": 0, "saved": 0, "duplicates": 0, "errors": 0}
+    return normalize_page_cards(extract_page_cards(driver))
 
-    for item in items:
-        if stop_parsing:
-            break
-        try:
-            freight_data = driver.execute_script("""
-                const item = arguments[0];
-                const data = {
-                    id: item.getAttribute('data-load-id') || 'N/A',
-                    loading_points: [],
-                    unloading_points: [],
-                    distance: 'N/A',
-                    cargo: 'Н/Д',
-                    weight: 'Н/Д',
-                    volume: 'Н/Д',
-                    prices: {},
-                    loading_date: 'Н/Д',
-                    body_type: 'Н/Д',
-                    loading_method: 'Н/Д',
-                    loading_unloading_raw: '',
-                    possible_reload: 'нет'
-                };
-                const compositeRoute = item.querySelector("div.PExKw");
-                const directRoute = item.querySelector("div.NcNn7") && item.querySelector("div.OtkNo");
-                try {
-                    if (compositeRoute) {
-                        const loadingPoint = compositeRoute.querySelector("div.Ha2A8 .yLMmR");
-                        if (loadingPoint) {
-                            const city = loadingPoint.textContent.replace('погрузка', '').replace('выгрузка', '').trim();
-                            if (city) data.loading_points.push(city);
-                        }
-                        const unloadingPoints = compositeRoute.querySelectorAll("div.QnFJD .yLMmR");
-                        unloadingPoints.forEach(point => {
-                            const city = point.textContent.replace('погрузка', '').replace('выгрузка', '').trim();
-                            if (city) data.unloading_points.push(city);
-                        });
-                    } else if (directRoute) {
-                        const loadingBlock = item.querySelector("div.NcNn7");
-                        if (loadingBlock) {
-                            const cityElement = loadingBlock.querySelector(".BUBXM.h56vj, .BUBXM");
-                            const regionElement = loadingBlock.querySelector(".VX7nr");
-                            const city = cityElement ? cityElement.textContent.trim() : 'Н/Д';
-                            const region = regionElement ? regionElement.textContent.trim() : 'Н/Д';
-                            data.loading_points.push(`${city}, ${region}`);
-                        }
-                        const unloadingBlock = item.querySelector("div.OtkNo");
-                        if (unloadingBlock) {
-                            const cityElement = unloadingBlock.querySelector(".BUBXM.h56vj, .BUBXM");
-                            const regionElement = unloadingBlock.querySelector(".VX7nr");
-                            const city = cityElement ? cityElement.textContent.trim() : 'Н/Д';
-                            const region = regionElement ? regionElement.textContent.trim() : 'Н/Д';
-                            data.unloading_points.push(`${city}, ${region}`);
-                        }
-                    }
-                } catch (e) {}
-
-                try {
-                    const dateElement = item.querySelector("span.qaQg4 .BUBXM");
-                    if (dateElement) data.loading_date = dateElement.textContent.trim();
-                } catch (e) {}
-
-                try {
-                    let distanceElement = item.querySelector("a.Laof2") || item.querySelector("a.G_fQk");
-                    if (distanceElement) data.distance = distanceElement.textContent.replace('км', '').trim();
-                } catch (e) {}
-
-                try {
-                    const cargoElement = item.querySelector("div.WZJ4F");
-                    if (cargoElement) data.cargo = cargoElement.textContent.trim();
-                } catch (e) {}
-
-                try {
-                    const bodyTypeElement = item.querySelector("div.Y_WwK span.wVNyD");
-                    if (bodyTypeElement) data.body_type = bodyTypeElement.textContent.trim();
-                } catch (e) {}
-
-                try {
-                    const loadingMethodContainer = item.querySelector("div.y7YtP");
-                    if (loadingMethodContainer) {
-                        const t = loadingMethodContainer.textContent || "";
-                        data.loading_unloading_raw = t.replace(/\\s+/g, " ").trim();
-                        data.loading_method = data.loading_unloading_raw.replace(/(загр\\/выгр|загр|выгр)\\s*:\\s*/gi, "").trim();
-                    }
-                } catch (e) {}
-
-                try {
-                    const weightVolumeElement = item.querySelector("div.h49FM");
-                    if (weightVolumeElement) {
-                        const text = weightVolumeElement.textContent.trim();
-                        if (text.includes('/')) {
-                            const parts = text.split('/');
-                            data.weight = parts[0].trim();
-                            data.volume = parts[1].trim();
-                        } else {
-                            data.weight = text || 'Н/Д';
-                            data.volume = 'Н/Д';
-                        }
-                    }
-                } catch (e) {}
-
-                try {
-                    const priceBlocks = item.querySelectorAll("div.eSeMX");
-                    priceBlocks.forEach(block => {
-                        const priceTypeElement = block.querySelector(".f3LPw");
-                        const amountElement = block.querySelector(".BUBXM");
-                        if (priceTypeElement && amountElement) {
-                            const priceType = priceTypeElement.textContent.trim();
-                            const amount = amountElement.textContent.trim();
-                            if (priceType.includes('с НДС')) data.prices['с_НДС'] = amount;
-                            else if (priceType.includes('без НДС')) data.prices['без_НДС'] = amount;
-                            else if (priceType.includes('нал')) data.prices['наличные'] = amount;
-                        }
-                    });
-                } catch (e) {}
-
-                try {
-                    const reloadElement = item.querySelector("div.ctSCk");
-                    if (reloadElement) {
-                        const text = reloadElement.textContent.toLowerCase();
-                        if (text.includes('догруз') || text.includes('догр') || text.includes('возм.догруз')) {
-                            data.possible_reload = 'да';
-                        }
-                    }
-                } catch (e) {}
-
-                return data;
-            """, item)
-
-            # Минимальная нормализация (как в стабильной версии)
-            normalized = _normalize_freight_minimal(freight_data)
-
-            # Добавляем новый блок нормализации "загр/выгр/растентовка" (НЕ ломая старые поля)
-            extra_loading = _parse_loading_unloading(freight_data.get("loading_unloading_raw") or freight_data.get("loading_method") or "")
-            normalized.update(extra_loading)
-
-            # Сохраняем сырьевые поля, которые полезны для CRM/аналитики
-            normalized["raw"] = {
-                "id": freight_data.get("id"),
-                "loading_points": freight_data.get("loading_points", []),
-                "unloading_points": freight_data.get("unloading_points", []),
-                "distance": freight_data.get("distance"),
-                "cargo": freight_data.get("cargo"),
-                "weight_text": freight_data.get("weight"),
-                "volume_text": freight_data.get("volume"),
-                "prices": freight_data.get("prices", {}),
-                "loading_date_text": freight_data.get("loading_date"),
-                "body_type_text": freight_data.get("body_type"),
-                "loading_method_text": freight_data.get("loading_method"),
-                "possible_reload": freight_data.get("possible_reload", "нет"),
-            }
+def capture_page_snapshot(driver: webdriver.Chrome) -> Optional[str]:
+    """HTML текущей страницы для html_extract; None, если снять не удалось (страницу это не ломает)."""
+    try:
+        return driver.execute_script(html_extract.SNAPSHOT_JS)
+    except Exception as e:
+        logger.warning(f"Снимок страницы не снят: {e}")
+        return None
 
-            # Хеш дубликата
-            freight_hash = _generate_freight_hash(freight_data)
-            normalized['hash'] = freight_hash
+def normalize_card(freight_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Сырая карточка (_PAGE_EXTRACT_JS / html_extract) -> запись JSONL с hash, без дедупа."""
+    # Минимальная нормализация (как в стабильной версии)
+    normalized = _normalize_freight_minimal(freight_data)
+
+    # Добавляем новый блок нормализации "загр/выгр/растентовка" (НЕ ломая старые поля)
+    extra_loading = _parse_loading_unloading(freight_data.get("loading_unloading_raw") or freight_data.get("loading_method") or "")
+    normalized.update(extra_loading)
+
+    # Сохраняем сырьевые поля, которые полезны для CRM/аналитики
+    normalized["raw"] = {
+        "id": freight_data.get("id"),
+        "loading_points": freight_data.get("loading_points", []),
+        "unloading_points": freight_data.get("unloading_points", []),
+        "distance": freight_data.get("distance"),
+        "cargo": freight_data.get("cargo"),
+        "weight_text": freight_data.get("weight"),
+        "volume_text": freight_data.get("volume"),
+        "prices": freight_data.get("prices", {}),
+        "loading_date_text": freight_data.get("loading_date"),
+        "body_type_text": freight_data.get("body_type"),
+        "loading_method_text": freight_data.get("loading_method"),
+        "possible_reload": freight_data.get("possible_reload", "нет"),
+    }
 
-            if is_duplicate_with_fallback(freight_hash, 7 * 24 * 3600):
-                duplicates += 1
-                continue
+    # Хеш дубликата
+    normalized['hash'] = _generate_freight_hash(freight_data)
+    return normalized
 
-            freights.append(normalized)
-            saved += 1
+def normalize_page_cards(cards: List[Optional[Dict[str, Any]]]) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Нормализация/хеш/дедуп карточек страницы (None — карточка, на которой упал JS)."""
+    total_found = len(cards)
+    saved = 0
+    duplicates = 0
+    errors = 0
+    freights: List[Dict[str, Any]] = []
+    candidates: List[Dict[str, Any]] = []
 
-        except StaleElementReferenceException:
+    # без проверки stop_parsing: при остановке фоновая запись дописывает уже снятые страницы
+    for freight_data in cards:
+        if not freight_data:
             errors += 1
             continue
+        try:
+            candidates.append(normalize_card(freight_data))
         except Exception as e:
             errors += 1
             if errors <= 3:
                 logger.debug(f"Ошибка при обработке карточки: {e}")
             continue
 
+    # дедуп всей страницы одним round trip
+    duplicate_flags = mark_seen_many_with_fallback([c['hash'] for c in candidates], 7 * 24 * 3600)
+    for normalized, is_dup in zip(candidates, duplicate_flags):
+        if is_dup:
+            duplicates += 1
+            continue
+        freights.append(normalized)
+        saved += 1
+
     stats = {
         "found": total_found,
         "processed": saved + duplicates,
@@ -1405,19 +1602,11 @@ def parse_current_page(driver: webdriver.Chrome, page_num: int) -> Tuple[List[Di
 # ---------------------------
 # ПРОГРЕСС
 # ---------------------------
-def get_region_jsonl_filename(region_name: str) -> str:
-    safe_region_name = "".join(c if c.isalnum() or c in " _-" else "_" for c in region_name)
-    region_dir = os.path.join(REGIONS_DATA_DIR, safe_region_name)
-    os.makedirs(region_dir, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    return os.path.join(region_dir, f"{safe_region_name}_{timestamp}.jsonl")
-
-def append_freights_to_jsonl(freights: List[Dict[str, Any]], filename: str) -> None:
+def append_freights_to_jsonl(freights: List[Dict[str, Any]], region_name: str) -> None:
+    """Страница грузов в файл региона (regions_data/<регион>/<регион>_<время>.jsonl[.gz])."""
     try:
-        with open(filename, 'a', encoding='utf-8') as f:
-            for freight in freights:
-                freight_record = {**freight, 'parsed_at': datetime.now().isoformat()}
-                f.write(json.dumps(freight_record, ensure_ascii=False) + '\n')
+        parsed_at = datetime.now().isoformat()
+        JSONL_SINK.write(region_name, ({**freight, 'parsed_at': parsed_at} for freight in freights))
     except Exception as e:
         logger.error(f"Ошибка сохранения результатов: {str(e)}")
 
@@ -1432,6 +1621,8 @@ def save_region_progress(region_name: str, page_num: int, total_pages: int, url:
         }
         if region_idx is not None:
             progress["region_idx"] = region_idx
+        # данные страницы — на диск раньше прогресса, иначе возобновление пропустит их
+        JSONL_SINK.checkpoint(region_name)
         with open(REGION_PROGRESS_FILE, 'w', encoding='utf-8') as f:
             json.dump(progress, f, ensure_ascii=False, indent=2)
     except Exception as e:
@@ -1470,13 +1661,23 @@ def parse_all_regions(driver: webdriver.Chrome) -> webdriver.Chrome:
     last_successful_url = None
 
     all_regions = RUSSIAN_REGIONS + MOSCOW_OBLAST_COMBINATIONS
-    total_regions_count = len(all_regions)
+    skipped_by_schedule = 0
 
     progress = load_region_progress()
     start_index = 0
-    if progress and "region_idx" in progress:
+    if ADAPTIVE_SCHEDULING:
+        # план пересчитывается при каждом запуске: пройденные регионы уже не "созрели",
+        # прерванный регион — первым, чтобы продолжить его с сохранённой страницы
+        plan, _ = region_scheduler.plan(all_regions, REGION_STATS_DIR)
+        skipped_by_schedule = len(all_regions) - len(plan)
+        interrupted = progress.get("region") if progress and int(progress.get("page", 1)) > 1 else None
+        if interrupted in all_regions:
+            plan = [interrupted] + [r for r in plan if r != interrupted]
+        all_regions = plan
+    elif progress and "region_idx" in progress:
         start_index = progress["region_idx"]
         logger.info(f"Восстановление с региона {progress.get('region')} (индекс {start_index})")
+    total_regions_count = len(all_regions)
 
     for region_idx, region in enumerate(all_regions[start_index:], start=start_index):
         if stop_parsing or check_stop_file():
@@ -1549,6 +1750,8 @@ def parse_all_regions(driver: webdriver.Chrome) -> webdriver.Chrome:
         "skipped_regions": skipped_regions,
         "total_regions": total_regions_count,
         "success_rate": f"{(processed_regions / total_regions_count) * 100:.1f}%" if total_regions_count else "0%",
+        "skipped_by_schedule": skipped_by_schedule,
+        "seen_filter": SESSION_SEEN_HASHES.stats(),
         "timestamp": datetime.now().isoformat(),
     }
     report_file = os.path.join(
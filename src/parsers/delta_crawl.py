@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from jsonl_sink import safe_stream_name
+
+# Инкрементальный обход региона. Отметка (high-water mark) региона — id самых новых грузов
+# первой страницы прошлого обхода и время обхода; хранится файлом на регион (воркеры
+# region_crawler пишут разные регионы без гонок). Обход останавливается, когда:
+#   - на странице встретился id из отметки — дальше только уже виденное (только если список
+#     отсортирован "сначала новые": иначе старый груз может стоять выше новых);
+#   - DELTA_STOP_AFTER_PAGES страниц подряд целиком из дубликатов.
+# Новая отметка сохраняется только после завершённого обхода, начатого с первой страницы.
+
+DELTA_STOP_AFTER_PAGES = 3
+MARK_IDS = 20            # id верха списка: один груз могут снять/поднять, по нескольким надёжнее
+
+logger = logging.getLogger("DeltaCrawl")
+
+
+def with_query(url: str, params: Dict[str, str]) -> str:
+    """url с добавленными/заменёнными параметрами запроса (например, сортировка)."""
+    if not params:
+        return url
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    query.update(params)
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def _mark_path(base_dir: str, region: str) -> str:
+    return os.path.join(base_dir, f"{safe_stream_name(region)}.json")
+
+def load_mark(base_dir: str, region: str) -> Optional[Dict[str, Any]]:
+    path = _mark_path(base_dir, region)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Отметка региона {region} не прочитана ({e}) — полный обход")
+        return None
+
+def save_mark(base_dir: str, region: str, mark: Dict[str, Any]) -> None:
+    os.makedirs(base_dir, exist_ok=True)
+    path = _mark_path(base_dir, region)
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(mark, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+class DeltaTracker:
+    """Per-region stop rule for one handle_pagination run.
+
+    observe_ids() runs in the browser thread (raw card ids, no lag); record_page() runs
+    in the page writer after dedup, so the duplicate streak can trail by the writer queue.
+    """
+
+    def __init__(self, region: str, mark: Optional[Dict[str, Any]], sorted_newest: bool,
+                 stop_after: int = DELTA_STOP_AFTER_PAGES):
+        self.region = region
+        self.mark_ids = set(mark.get("ids", [])) if mark and sorted_newest else set()
+        self.stop_after = max(1, stop_after)
+        self.top_ids: List[str] = []
+        self.reached_mark_on: Optional[int] = None
+        self.dup_streak = 0
+        self.pages = 0
+        self.new_loads = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def observe_ids(self, page: int, ids: Iterable[Optional[str]]) -> None:
+        ids = [i for i in ids if i and i != "N/A"]
+        if page == 1 and not self.top_ids:
+            self.top_ids = ids[:MARK_IDS]
+        if self.reached_mark_on is None and self.mark_ids.intersection(ids):
+            self.reached_mark_on = page
+
+    def record_page(self, page: int, found: int, new: int) -> None:
+        with self._lock:
+            self.pages += 1
+            self.new_loads += new
+            self.dup_streak = self.dup_streak + 1 if new == 0 else 0
+
+    def stop_reason(self) -> Optional[str]:
+        if self.reached_mark_on is not None:
+            return f"достигнута отметка прошлого обхода (стр. {self.reached_mark_on})"
+        with self._lock:
+            if self.dup_streak >= self.stop_after:
+                return f"{self.dup_streak} стр. подряд без новых грузов"
+        return None
+
+    def new_mark(self) -> Optional[Dict[str, Any]]:
+        if not self.top_ids:
+            return None           # обход возобновлён не с первой страницы — верх списка не видели
+        return {
+            "region": self.region,
+            "last_id": self.top_ids[0],
+            "ids": self.top_ids,
+            "crawled_at": int(self.started_at),
+            "pages": self.pages,
+            "new_loads": self.new_loads,
+        }
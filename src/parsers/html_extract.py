@@ -0,0 +1,284 @@
+import os
+import re
+import gzip
+import glob
+import json
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    from lxml import etree
+    from lxml import html as lxml_html
+except ImportError:  # снимки можно сохранять и без lxml, разбирать — нет
+    etree = lxml_html = None
+
+from jsonl_sink import safe_stream_name
+
+# Офлайн-режим парсеров: во время обхода сохраняем HTML страницы (SNAPSHOT_JS, gzip),
+# а здесь — разбор сохранённого HTML на lxml теми же селекторами, что _PAGE_EXTRACT_JS
+# (ati_parser) и JS в ati_cars_parser.extract_cards_on_page, с той же семантикой
+# textContent/trim/replace — результат совпадает с тем, что вернул бы браузер.
+# Повторный разбор архива, регрессионные прогоны и замеры — без Chrome.
+# При правке JS-селекторов в парсерах правится и зеркало здесь.
+
+SNAPSHOT_JS = "return document.documentElement.outerHTML;"
+
+# пробельные символы JS (String.prototype.trim, \s) — у str.strip() набор другой
+_JS_WS = ("\t\n\v\f\r \u00a0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u2006"
+          "\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000\ufeff")
+_JS_SPACES_RE = re.compile(f"[{_JS_WS}]+")
+_LOADING_PREFIX_RE = re.compile(f"(загр/выгр|загр|выгр)[{_JS_WS}]*:[{_JS_WS}]*", re.IGNORECASE)
+
+logger = logging.getLogger("HtmlExtract")
+
+
+def _trim(s: str) -> str:
+    return s.strip(_JS_WS)
+
+def _text(el) -> str:
+    return el.text_content()
+
+def _cls(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+def _under(tag_cls: str, target: str) -> str:
+    """CSS "A B" из element.querySelector: B внутри элемента, A — любой предок (хоть выше элемента)."""
+    return f".//{target}[ancestor::{tag_cls}]"
+
+def _xp(expr: str):
+    return etree.XPath(expr) if etree is not None else None
+
+# ---------- грузы: зеркало _PAGE_EXTRACT_JS ----------
+_X_FREIGHT_CARDS = _xp("//section[@data-app='pretty-load']")
+_X_COMPOSITE = _xp(f".//div[{_cls('PExKw')}]")
+_X_NCNN7 = _xp(f".//div[{_cls('NcNn7')}]")
+_X_OTKNO = _xp(f".//div[{_cls('OtkNo')}]")
+_X_COMPOSITE_LOADING = _xp(_under(f"div[{_cls('Ha2A8')}]", f"*[{_cls('yLMmR')}]"))
+_X_COMPOSITE_UNLOADING = _xp(_under(f"div[{_cls('QnFJD')}]", f"*[{_cls('yLMmR')}]"))
+_X_BUBXM = _xp(f".//*[{_cls('BUBXM')}]")       # ".BUBXM.h56vj, .BUBXM" == первый .BUBXM
+_X_VX7NR = _xp(f".//*[{_cls('VX7nr')}]")
+_X_DATE = _xp(_under(f"span[{_cls('qaQg4')}]", f"*[{_cls('BUBXM')}]"))
+_X_DIST_LAOF2 = _xp(f".//a[{_cls('Laof2')}]")
+_X_DIST_GFQK = _xp(f".//a[{_cls('G_fQk')}]")
+_X_CARGO = _xp(f".//div[{_cls('WZJ4F')}]")
+_X_BODY = _xp(_under(f"div[{_cls('Y_WwK')}]", f"span[{_cls('wVNyD')}]"))
+_X_LOADING_METHOD = _xp(f".//div[{_cls('y7YtP')}]")
+_X_WEIGHT_VOLUME = _xp(f".//div[{_cls('h49FM')}]")
+_X_PRICE_BLOCKS = _xp(f".//div[{_cls('eSeMX')}]")
+_X_PRICE_TYPE = _xp(f".//*[{_cls('f3LPw')}]")
+_X_RELOAD = _xp(f".//div[{_cls('ctSCk')}]")
+
+
+def _first(xpath, el):
+    found = xpath(el)
+    return found[0] if found else None
+
+def _route_point(block) -> str:
+    city_el = _first(_X_BUBXM, block)
+    region_el = _first(_X_VX7NR, block)
+    city = _trim(_text(city_el)) if city_el is not None else 'Н/Д'
+    region = _trim(_text(region_el)) if region_el is not None else 'Н/Д'
+    return f"{city}, {region}"
+
+def _extract_freight(item) -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        'id': item.get('data-load-id') or 'N/A',
+        'loading_points': [],
+        'unloading_points': [],
+        'distance': 'N/A',
+        'cargo': 'Н/Д',
+        'weight': 'Н/Д',
+        'volume': 'Н/Д',
+        'prices': {},
+        'loading_date': 'Н/Д',
+        'body_type': 'Н/Д',
+        'loading_method': 'Н/Д',
+        'loading_unloading_raw': '',
+        'possible_reload': 'нет',
+    }
+    composite = _first(_X_COMPOSITE, item)
+    loading_block = _first(_X_NCNN7, item)
+    unloading_block = _first(_X_OTKNO, item)
+    if composite is not None:
+        point = _first(_X_COMPOSITE_LOADING, composite)
+        if point is not None:
+            city = _trim(_text(point).replace('погрузка', '', 1).replace('выгрузка', '', 1))
+            if city:
+                data['loading_points'].append(city)
+        for point in _X_COMPOSITE_UNLOADING(composite):
+            city = _trim(_text(point).replace('погрузка', '', 1).replace('выгрузка', '', 1))
+            if city:
+                data['unloading_points'].append(city)
+    elif loading_block is not None and unloading_block is not None:
+        data['loading_points'].append(_route_point(loading_block))
+        data['unloading_points'].append(_route_point(unloading_block))
+
+    el = _first(_X_DATE, item)
+    if el is not None:
+        data['loading_date'] = _trim(_text(el))
+
+    el = _first(_X_DIST_LAOF2, item)
+    if el is None:
+        el = _first(_X_DIST_GFQK, item)
+    if el is not None:
+        data['distance'] = _trim(_text(el).replace('км', '', 1))
+
+    el = _first(_X_CARGO, item)
+    if el is not None:
+        data['cargo'] = _trim(_text(el))
+
+    el = _first(_X_BODY, item)
+    if el is not None:
+        data['body_type'] = _trim(_text(el))
+
+    el = _first(_X_LOADING_METHOD, item)
+    if el is not None:
+        data['loading_unloading_raw'] = _trim(_JS_SPACES_RE.sub(' ', _text(el) or ''))
+        data['loading_method'] = _trim(_LOADING_PREFIX_RE.sub('', data['loading_unloading_raw']))
+
+    el = _first(_X_WEIGHT_VOLUME, item)
+    if el is not None:
+        text = _trim(_text(el))
+        if '/' in text:
+            parts = text.split('/')
+            data['weight'] = _trim(parts[0])
+            data['volume'] = _trim(parts[1])
+        else:
+            data['weight'] = text or 'Н/Д'
+            data['volume'] = 'Н/Д'
+
+    for block in _X_PRICE_BLOCKS(item):
+        type_el = _first(_X_PRICE_TYPE, block)
+        amount_el = _first(_X_BUBXM, block)
+        if type_el is not None and amount_el is not None:
+            price_type = _trim(_text(type_el))
+            amount = _trim(_text(amount_el))
+            if 'с НДС' in price_type:
+                data['prices']['с_НДС'] = amount
+            elif 'без НДС' in price_type:
+                data['prices']['без_НДС'] = amount
+            elif 'нал' in price_type:
+                data['prices']['наличные'] = amount
+
+    el = _first(_X_RELOAD, item)
+    if el is not None:
+        text = _text(el).lower()
+        if 'догруз' in text or 'догр' in text or 'возм.догруз' in text:
+            data['possible_reload'] = 'да'
+    return data
+
+def _parse(html: str):
+    if lxml_html is None:
+        raise RuntimeError("lxml не установлен (requirements.txt) — офлайн-разбор недоступен")
+    return lxml_html.document_fromstring(html)
+
+def extract_freight_cards(html: str) -> List[Optional[Dict[str, Any]]]:
+    """Cards of a loads.ati.su page, same shape as execute_script(_PAGE_EXTRACT_JS)."""
+    out: List[Optional[Dict[str, Any]]] = []
+    for item in _X_FREIGHT_CARDS(_parse(html)):
+        try:
+            out.append(_extract_freight(item))
+        except Exception:
+            out.append(None)
+    return out
+
+# ---------- транспорт: зеркало JS ati_cars_parser.extract_cards_on_page ----------
+_X_TRUCK_CARDS = _xp("//div[starts-with(@data-qa, 'truck-card-')]")
+_TRUCK_FIELDS = (
+    ('truck_info', 'truck-info'),
+    ('load_params', 'truck-loading-params'),
+    ('truck_dims', 'truck-dimensions'),
+    ('loading_city', 'loading-city'),
+    ('periodicity', 'loading-periodicity'),
+    ('main_unload', 'main-unloading-point-name'),
+    ('rate_block', 'rate'),
+)
+_X_TRUCK_FIELD = {qa: _xp(f".//*[@data-qa='{qa}']") for _, qa in _TRUCK_FIELDS + (('', 'firm-info'), ('', 'truck-card-company'))}
+
+def _g(card, qa: str) -> str:
+    el = _first(_X_TRUCK_FIELD[qa], card)
+    return _trim(_text(el)) if el is not None else ''
+
+def extract_truck_cards(html: str) -> List[Dict[str, Any]]:
+    """Cards of a trucks.ati.su page, same shape as the JS in extract_cards_on_page."""
+    out: List[Dict[str, Any]] = []
+    for card in _X_TRUCK_CARDS(_parse(html)):
+        row: Dict[str, Any] = {'rid': (card.get('data-qa') or '').replace('truck-card-', '', 1)}
+        for key, qa in _TRUCK_FIELDS:
+            row[key] = _g(card, qa)
+        row['company_block'] = _g(card, 'firm-info') or _g(card, 'truck-card-company')
+        out.append(row)
+    return out
+
+EXTRACTORS = {'freights': extract_freight_cards, 'trucks': extract_truck_cards}
+
+# ---------- снимки ----------
+
+def save_snapshot(base_dir: str, stream: str, page_num: int, html: str) -> str:
+    """<base_dir>/<stream>/<stream>_p<page>_<time>.html.gz"""
+    stream_dir = os.path.join(base_dir, safe_stream_name(stream))
+    os.makedirs(stream_dir, exist_ok=True)
+    name = f"{safe_stream_name(stream)}_p{int(page_num):04d}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.html.gz"
+    path = os.path.join(stream_dir, name)
+    with gzip.open(path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        f.write(html)
+    return path
+
+def list_snapshots(root: str) -> List[str]:
+    if os.path.isfile(root):
+        return [root]
+    return sorted(glob.glob(os.path.join(root, '**', '*.html.gz'), recursive=True)
+                  + glob.glob(os.path.join(root, '**', '*.html'), recursive=True))
+
+def load_snapshot(path: str) -> str:
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return f.read()
+
+def replay(root: str, kind: str = 'freights') -> Iterator[Dict[str, Any]]:
+    """Raw cards of every snapshot under root, tagged with the snapshot path."""
+    extract = EXTRACTORS[kind]
+    for path in list_snapshots(root):
+        for card in extract(load_snapshot(path)):
+            if card is not None:
+                yield {**card, '_snapshot': os.path.basename(path)}
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ap = argparse.ArgumentParser(description="Offline re-parse of saved ATI page snapshots")
+    ap.add_argument('snapshots')
+    ap.add_argument('--kind', choices=sorted(EXTRACTORS), default='freights')
+    ap.add_argument('--out', help="JSONL с результатом (по умолчанию — только счётчики)")
+    ap.add_argument('--normalize', action='store_true',
+                    help="прогнать через нормализацию парсера (ati_parser.normalize_card / ati_cars_parser.build_truck_rows)")
+    args = ap.parse_args()
+
+    started = time.perf_counter()
+    pages = cards = 0
+    out = open(args.out, 'w', encoding='utf-8') if args.out else None
+    try:
+        if args.normalize:
+            if args.kind == 'freights':
+                from ati_parser import normalize_card
+                normalize = lambda raw: [normalize_card(c) for c in raw if c]
+            else:
+                from ati_cars_parser import build_truck_rows as normalize
+        else:
+            normalize = lambda raw: [c for c in raw if c]
+        for path in list_snapshots(args.snapshots):
+            rows = normalize(EXTRACTORS[args.kind](load_snapshot(path)))
+            pages += 1
+            cards += len(rows)
+            if out:
+                for r in rows:
+                    out.write(json.dumps(r, ensure_ascii=False) + '\n')
+    finally:
+        if out:
+            out.close()
+    elapsed = time.perf_counter() - started
+    logger.info(f"Снимков {pages}, карточек {cards}, {elapsed:.2f} c"
+                + (f" ({pages / elapsed:.1f} стр/с, {cards / elapsed:.0f} карточек/с)" if elapsed else ""))
@@ -0,0 +1,180 @@
+import os
+import json
+import gzip
+import zlib
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+# Выходные JSONL парсеров: один буферизованный дескриптор на поток записи (регион/фильтр)
+# вместо open() на каждую страницу, ротация по размеру/времени, опционально gzip.
+# checkpoint() = flush + fsync (для gzip — Z_SYNC_FLUSH): вызывается перед
+# save_region_progress, поэтому всё, что прогресс считает записанным, уже на диске.
+# Сжатый файл пишется как *.jsonl.gz.part и переименовывается в *.jsonl.gz при ротации/закрытии —
+# jsonl_tail (surge_stream, freight_ingest) читает только завершённые .gz; незакрытые
+# .part прошлого запуска (обрыв) завершаются при следующем открытии того же потока:
+# читаемое до последнего checkpoint пережимается в целый .gz с трейлером (иначе ISIZE,
+# по которому jsonl_tail считает размер, не прочитать).
+
+JSONL_ROTATE_BYTES = 64 * 1024 * 1024     # несжатых байт на файл
+JSONL_ROTATE_SEC = 3600.0
+JSONL_BUFFER_BYTES = 1024 * 1024
+GZIP_LEVEL = 6
+
+logger = logging.getLogger("JsonlSink")
+
+
+def safe_stream_name(name: str) -> str:
+    return "".join(c if c.isalnum() or c in " _-" else "_" for c in name)
+
+
+class _OpenFile:
+    __slots__ = ("path", "final_path", "raw", "out", "opened_at", "written")
+
+    def __init__(self, path: str, final_path: str, raw, out):
+        self.path = path
+        self.final_path = final_path
+        self.raw = raw
+        self.out = out
+        self.opened_at = time.monotonic()
+        self.written = 0
+
+
+class JsonlSink:
+    def __init__(self, base_dir: str, compression: Optional[str] = None,
+                 max_bytes: int = JSONL_ROTATE_BYTES, max_age_sec: float = JSONL_ROTATE_SEC,
+                 buffer_bytes: int = JSONL_BUFFER_BYTES):
+        if compression not in (None, "gzip"):
+            raise ValueError(f"Неподдерживаемое сжатие: {compression} (None или 'gzip')")
+        self.base_dir = base_dir
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_age_sec = max_age_sec
+        self.buffer_bytes = buffer_bytes
+        self._files: Dict[str, _OpenFile] = {}
+        self._recovered: set = set()
+        self._lock = threading.Lock()
+
+    # ---------- files ----------
+
+    def _stream_dir(self, stream: str) -> str:
+        d = os.path.join(self.base_dir, safe_stream_name(stream))
+        os.makedirs(d, exist_ok=True)
+        return d
+
+    @staticmethod
+    def _finish_gzip_part(src: str, dst: str) -> int:
+        """Re-compress the decodable, newline-complete prefix of an unfinished gzip into dst."""
+        tmp = dst + ".tmp"
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = b""
+        lines = 0
+        with open(src, "rb") as raw, gzip.open(tmp, "wb", compresslevel=GZIP_LEVEL) as out:
+            while True:
+                chunk = raw.read(1 << 16)
+                if not chunk:
+                    break
+                try:
+                    data = d.decompress(chunk)
+                except zlib.error:
+                    break                   # битый хвост после последнего sync flush
+                pending += data
+                cut = pending.rfind(b"\n") + 1
+                if cut:
+                    out.write(pending[:cut])
+                    lines += pending.count(b"\n", 0, cut)
+                    pending = pending[cut:]
+                if d.eof:
+                    break
+        os.replace(tmp, dst)
+        os.remove(src)
+        return lines
+
+    def _recover_parts(self, stream_dir: str) -> None:
+        """Незакрытые .part после обрыва — данные до последнего checkpoint читаемы, отдаём их читателям."""
+        for fn in os.listdir(stream_dir):
+            if fn.endswith(".part"):
+                src = os.path.join(stream_dir, fn)
+                try:
+                    lines = self._finish_gzip_part(src, src[:-len(".part")])
+                    logger.info(f"Восстановлен незакрытый файл {fn}: строк {lines}")
+                except OSError as e:
+                    logger.warning(f"Не удалось восстановить {src}: {e}")
+
+    def _open(self, stream: str) -> _OpenFile:
+        stream_dir = self._stream_dir(stream)
+        if stream_dir not in self._recovered:
+            self._recovered.add(stream_dir)
+            self._recover_parts(stream_dir)
+        stem = os.path.join(stream_dir, f"{safe_stream_name(stream)}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+        ext = ".jsonl.gz" if self.compression == "gzip" else ".jsonl"
+        final_path, n = stem + ext, 1
+        while os.path.exists(final_path) or os.path.exists(final_path + ".part"):
+            n += 1
+            final_path = f"{stem}_{n}{ext}"
+        if self.compression == "gzip":
+            path = final_path + ".part"
+            raw = open(path, "wb", buffering=self.buffer_bytes)
+            out = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+        else:
+            path = final_path
+            raw = out = open(path, "ab", buffering=self.buffer_bytes)
+        return _OpenFile(path, final_path, raw, out)
+
+    def _sync(self, f: _OpenFile) -> None:
+        if f.out is not f.raw:
+            f.out.flush(zlib.Z_SYNC_FLUSH)
+        f.raw.flush()
+        os.fsync(f.raw.fileno())
+
+    def _close(self, f: _OpenFile) -> None:
+        try:
+            if f.out is not f.raw:
+                f.out.close()           # пишет хвост gzip; raw не закрывает
+            f.raw.flush()
+            os.fsync(f.raw.fileno())
+        finally:
+            f.raw.close()
+        if f.path != f.final_path:
+            os.replace(f.path, f.final_path)
+
+    # ---------- API ----------
+
+    def write(self, stream: str, records: Iterable[Dict[str, Any]]) -> int:
+        """Append records as JSON lines to the stream's current file; returns lines written."""
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        if not data:
+            return 0
+        with self._lock:
+            f = self._files.get(stream)
+            if f is not None and (f.written >= self.max_bytes
+                                  or time.monotonic() - f.opened_at >= self.max_age_sec):
+                self._close(f)
+                f = None
+            if f is None:
+                f = self._files[stream] = self._open(stream)
+            f.out.write(data)
+            f.written += len(data)
+        return data.count(b"\n")
+
+    def current_path(self, stream: str) -> Optional[str]:
+        f = self._files.get(stream)
+        return f.final_path if f else None
+
+    def checkpoint(self, stream: Optional[str] = None) -> None:
+        """flush + fsync of one stream (or all): call before persisting crawl progress."""
+        with self._lock:
+            for name, f in list(self._files.items()):
+                if stream is None or name == stream:
+                    self._sync(f)
+
+    def close(self, stream: Optional[str] = None) -> None:
+        with self._lock:
+            for name in [n for n in self._files if stream is None or n == stream]:
+                f = self._files.pop(name)
+                try:
+                    self._close(f)
+                except OSError as e:
+                    logger.error(f"Ошибка закрытия {f.path}: {e}")
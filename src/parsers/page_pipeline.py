@@ -0,0 +1,77 @@
+import queue
+import logging
+import threading
+from typing import Any, Callable, List, Optional
+
+# Конвейер "браузер -> обработка": поток с драйвером только снимает сырые карточки
+# страницы и кладёт их в ограниченную очередь, фоновый поток нормализует, дедупит,
+# пишет JSONL и сохраняет прогресс. Очередь на PAGE_QUEUE_SIZE страниц — при отставании
+# записи submit() ждёт (память ограничена), close() дописывает всё поставленное.
+
+PAGE_QUEUE_SIZE = 3
+CLOSE_TIMEOUT_SEC = 60.0
+
+logger = logging.getLogger("PagePipeline")
+
+_STOP = object()
+_active: List["PageWriter"] = []
+_active_lock = threading.Lock()
+
+
+class PageWriter:
+    def __init__(self, handler: Callable[[Any], None], maxsize: int = PAGE_QUEUE_SIZE,
+                 name: str = "page-writer"):
+        self.handler = handler
+        self.errors = 0
+        self.pages = 0
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, maxsize))
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        with _active_lock:
+            _active.append(self)
+
+    def _run(self) -> None:
+        while True:
+            item = self._q.get()
+            try:
+                if item is _STOP:
+                    return
+                self.handler(item)
+                self.pages += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка обработки страницы в фоне: {e}")
+            finally:
+                self._q.task_done()
+
+    def submit(self, item: Any) -> None:
+        """Queue one page; blocks while the queue is full (back-pressure)."""
+        if self._closed:
+            raise RuntimeError("PageWriter закрыт")
+        self._q.put(item)
+
+    def close(self, timeout: Optional[float] = CLOSE_TIMEOUT_SEC) -> bool:
+        """Process everything queued, stop the thread. False if it did not finish in time."""
+        if not self._closed:
+            self._closed = True
+            try:
+                self._q.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+        self._thread.join(timeout)
+        with _active_lock:
+            if self in _active:
+                _active.remove(self)
+        done = not self._thread.is_alive()
+        if not done:
+            logger.warning(f"Фоновая запись не завершилась за {timeout} c, в очереди ~{self._q.qsize()} стр.")
+        return done
+
+
+def close_all(timeout: Optional[float] = CLOSE_TIMEOUT_SEC) -> None:
+    """Flush every open writer (SIGINT path, before os._exit)."""
+    with _active_lock:
+        writers = list(_active)
+    for w in writers:
+        w.close(timeout)
@@ -0,0 +1,402 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+import multiprocessing as mp
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import ati_parser
+import region_scheduler
+from seen_filter import SeenFilter
+
+# Параллельный обход регионов: N процессов-воркеров, у каждого свой Chrome, копия профиля
+# и cookies. Регионы берутся из общей очереди в SQLite (region_queue.db, переживает
+# перезапуск), прогресс пагинации — отдельный файл на регион (region_progress/<регион>.json),
+# темп запросов — общий бюджет страниц в минуту на всех воркеров, дедуп — общий Redis,
+# а без него — таблица seen_hashes в той же базе.
+
+SCRIPT_DIR = ati_parser.SCRIPT_DIR
+QUEUE_DB = os.path.join(SCRIPT_DIR, "region_queue.db")
+WORKER_PROFILES_DIR = os.path.join(SCRIPT_DIR, "crawler_profiles")
+REGION_PROGRESS_DIR = os.path.join(SCRIPT_DIR, "region_progress")
+
+DEFAULT_WORKERS = 3
+DEFAULT_PAGES_PER_MINUTE = 40      # на всех воркеров вместе (переходы по страницам + фильтры)
+WORKER_START_STAGGER_SEC = 20      # не открываем все браузеры разом
+REGION_PAUSE_SEC = 3
+MAX_REGION_ATTEMPTS = ati_parser.MAX_DRIVER_RECOVERY_ATTEMPTS
+
+logger = logging.getLogger("RegionCrawler")
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class RegionQueue:
+    """Persistent region work queue + crawl-wide state, shared by worker processes."""
+
+    def __init__(self, db_path: str = QUEUE_DB):
+        self.db_path = db_path
+        self.conn = _connect(db_path)
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS region_queue (
+                region TEXT PRIMARY KEY,
+                idx INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',   -- pending/running/done/failed
+                worker INTEGER,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS crawl_state (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS seen_hashes (
+                hash TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL
+            );
+        ''')
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def seed(self, regions: List[str], fresh: bool = False) -> int:
+        """Fill the queue for a new crawl (fresh, empty or fully finished queue); otherwise
+        continue the previous one, returning regions left 'running' by a killed run to
+        'pending'. Returns number of pending regions."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            left = self.conn.execute(
+                "SELECT COUNT(*) FROM region_queue WHERE status IN ('pending', 'running')").fetchone()[0]
+            if fresh or not left:
+                self.conn.execute("DELETE FROM region_queue")
+                self.conn.executemany(
+                    "INSERT INTO region_queue (region, idx, status, updated_at) VALUES (?, ?, 'pending', ?)",
+                    [(r, i, now) for i, r in enumerate(regions)])
+            else:
+                self.conn.execute(
+                    "UPDATE region_queue SET status = 'pending', worker = NULL, updated_at = ? "
+                    "WHERE status = 'running'", (now,))
+            self.conn.execute("DELETE FROM crawl_state")
+            self.conn.execute("DELETE FROM seen_hashes WHERE expires_at < ?", (now,))
+        return self.count('pending')
+
+    def claim(self, worker_id: int) -> Optional[str]:
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT region FROM region_queue WHERE status = 'pending' ORDER BY idx LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE region_queue SET status = 'running', worker = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE region = ?", (worker_id, time.time(), row[0]))
+        return row[0]
+
+    def finish(self, region: str, status: str) -> None:
+        """status: 'done' / 'failed'; 'pending' = отдать обратно (останов, повтор)."""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE region_queue SET status = ?, worker = NULL, updated_at = ? WHERE region = ?",
+                (status, time.time(), region))
+
+    def attempts(self, region: str) -> int:
+        row = self.conn.execute("SELECT attempts FROM region_queue WHERE region = ?", (region,)).fetchone()
+        return row[0] if row else 0
+
+    def count(self, status: str) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM region_queue WHERE status = ?", (status,)).fetchone()[0]
+
+    def regions(self, status: str) -> List[str]:
+        return [r for (r,) in self.conn.execute(
+            "SELECT region FROM region_queue WHERE status = ? ORDER BY idx", (status,))]
+
+    # ---------- crawl-wide state ----------
+
+    def request_stop(self) -> None:
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO crawl_state (key, value) VALUES ('stop', 1)")
+
+    def stop_requested(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM crawl_state WHERE key = 'stop'").fetchone() is not None
+
+
+class RateBudget:
+    """Global page budget: each acquire() reserves the next free slot (60/pages_per_minute
+    apart across all workers) in crawl_state and sleeps until it. Returns False on stop."""
+
+    def __init__(self, queue: RegionQueue, pages_per_minute: float = DEFAULT_PAGES_PER_MINUTE):
+        self.queue = queue
+        self.interval = 60.0 / max(pages_per_minute, 0.1)
+
+    def acquire(self) -> bool:
+        conn = self.queue.conn
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM crawl_state WHERE key = 'next_page_at'").fetchone()
+            now = time.time()
+            slot = max(now, row[0] if row else now)
+            conn.execute("INSERT OR REPLACE INTO crawl_state (key, value) VALUES ('next_page_at', ?)",
+                         (slot + self.interval,))
+        if slot > now:
+            time.sleep(slot - now)
+        if ati_parser.check_stop_file():
+            self.queue.request_stop()
+        return not self.queue.stop_requested()
+
+
+class SharedSeenStore:
+    """Dedup shared between workers when Redis is down: is_duplicate()/mark_seen_many() like
+    RedisManager (SET NX EX), over seen_hashes of the queue db.
+
+    Дедуп страницы идёт в фоновом потоке PageWriter, а соединение sqlite3 привязано к
+    потоку, где открыто: у каждого потока своё соединение (открывается при первом вызове)."""
+
+    def __init__(self, db_path: str = QUEUE_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.db_path)
+        return conn
+
+    def is_duplicate(self, unique_hash: str, ttl_seconds: int = 7 * 24 * 3600) -> bool:
+        now = time.time()
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO seen_hashes (hash, expires_at) VALUES (?, ?) "
+                "ON CONFLICT(hash) DO UPDATE SET expires_at = excluded.expires_at "
+                "WHERE seen_hashes.expires_at < ?", (unique_hash, now + ttl_seconds, now))
+        return cur.rowcount == 0
+
+    def mark_seen_many(self, hashes: List[str], ttl_seconds: int = 7 * 24 * 3600) -> List[bool]:
+        now = time.time()
+        flags = []
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for unique_hash in hashes:
+                cur = self.conn.execute(
+                    "INSERT INTO seen_hashes (hash, expires_at) VALUES (?, ?) "
+                    "ON CONFLICT(hash) DO UPDATE SET expires_at = excluded.expires_at "
+                    "WHERE seen_hashes.expires_at < ?", (unique_hash, now + ttl_seconds, now))
+                flags.append(cur.rowcount == 0)
+        return flags
+
+    @staticmethod
+    def is_redis_available() -> bool:
+        return False
+
+
+# ---------------------------
+# ВОРКЕР
+# ---------------------------
+def _safe_name(region: str) -> str:
+    return "".join(c if c.isalnum() or c in " _-" else "_" for c in region)
+
+def region_progress_file(region: str) -> str:
+    return os.path.join(REGION_PROGRESS_DIR, f"{_safe_name(region)}.json")
+
+def prepare_worker_profile(worker_id: int, refresh: bool = False) -> str:
+    """Copy of the logged-in chrome_profile for one worker (Chrome locks a profile per process).
+    Имя не должно быть префиксом чужого: _kill_chrome_by_profile ищет путь подстрокой."""
+    dst = os.path.join(WORKER_PROFILES_DIR, f"worker_{worker_id}_profile")
+    if refresh and os.path.exists(dst):
+        shutil.rmtree(dst, ignore_errors=True)
+    if not os.path.exists(dst) and os.path.isdir(ati_parser.PROFILE_PATH):
+        shutil.copytree(ati_parser.PROFILE_PATH, dst,
+                        ignore=shutil.ignore_patterns('Singleton*', 'lockfile', '*Cache*', 'Crashpad'))
+    os.makedirs(dst, exist_ok=True)
+    return dst
+
+def _region_finished(region: str) -> bool:
+    """handle_pagination не сообщает, дошёл ли до конца: смотрим сохранённый прогресс."""
+    progress = ati_parser.load_region_progress()
+    if not progress or progress.get("region") != region:
+        return True
+    return int(progress.get("page", 1)) >= int(progress.get("total_pages", 1))
+
+def _start_session(worker_id: int, headless: bool):
+    try:
+        driver = ati_parser.init_driver(headless=headless, profile_path=ati_parser.PROFILE_PATH)
+    except Exception as e:
+        logger.error(f"[w{worker_id}] Ошибка инициализации драйвера: {e}")
+        return None
+    if not ati_parser.load_session(driver) or not ati_parser.is_logged_in(driver):
+        logger.error(f"[w{worker_id}] Не удалось восстановить сессию — выполните авторизацию (пункт 1 ati_parser)")
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        return None
+    return driver
+
+def worker_main(worker_id: int, db_path: str, pages_per_minute: float,
+                headless: bool = False, refresh_profile: bool = False, delta: bool = False) -> None:
+    queue = RegionQueue(db_path)
+    budget = RateBudget(queue, pages_per_minute)
+
+    # глобалы ati_parser в этом процессе — только этого воркера
+    ati_parser.PROFILE_PATH = prepare_worker_profile(worker_id, refresh_profile)
+    worker_cookies = os.path.join(WORKER_PROFILES_DIR, f"worker_{worker_id}_cookies.json")
+    if os.path.exists(ati_parser.COOKIES_FILE):
+        shutil.copyfile(ati_parser.COOKIES_FILE, worker_cookies)
+    ati_parser.COOKIES_FILE = worker_cookies
+    ati_parser.PAGE_RATE_LIMITER = budget.acquire
+    ati_parser.DELTA_CRAWL = delta
+    if not ati_parser.REDIS_AVAILABLE:
+        ati_parser.redis_manager_instance = SharedSeenStore(db_path)
+    # файл фильтра дубликатов — свой у воркера, иначе процессы перезаписывают друг друга
+    ati_parser.SESSION_SEEN_HASHES = SeenFilter(
+        os.path.join(WORKER_PROFILES_DIR, f"worker_{worker_id}_seen.bloom"))
+    os.makedirs(REGION_PROGRESS_DIR, exist_ok=True)
+    os.makedirs(ati_parser.REGIONS_DATA_DIR, exist_ok=True)
+
+    driver = _start_session(worker_id, headless)
+    if driver is None:
+        queue.close()
+        return
+
+    processed = 0
+    try:
+        while not queue.stop_requested() and not ati_parser.stop_parsing:
+            region = queue.claim(worker_id)
+            if region is None:
+                break
+            ati_parser.REGION_PROGRESS_FILE = region_progress_file(region)
+            logger.info(f"[w{worker_id}] Регион: {region} (попытка {queue.attempts(region)})")
+            status = 'pending'
+            try:
+                try:
+                    _ = driver.current_url
+                except Exception:
+                    driver = ati_parser.restart_driver(driver)
+                    if driver is None:
+                        queue.finish(region, 'pending')
+                        break
+                if not budget.acquire():
+                    queue.finish(region, 'pending')
+                    break
+                if ati_parser.apply_region_filter(driver, region):
+                    if not ati_parser.load_region_progress():
+                        ati_parser.save_region_progress(region, 1, 1, ati_parser.safe_current_url(driver))
+                    driver = ati_parser.handle_pagination(driver, region)
+                    if ati_parser.stop_parsing:
+                        queue.request_stop()       # stop.txt/сигнал в одном воркере — стоп всем
+                    elif _region_finished(region):
+                        status = 'done'
+                        ati_parser.clear_region_progress()
+            except Exception as e:
+                logger.error(f"[w{worker_id}] Ошибка региона {region}: {e}")
+            if status == 'pending' and not ati_parser.stop_parsing and queue.attempts(region) >= MAX_REGION_ATTEMPTS:
+                status = 'failed'
+            queue.finish(region, status)
+            if status == 'done':
+                processed += 1
+                logger.info(f"[w{worker_id}] Успешно обработан регион: {region}")
+            if ati_parser.stop_parsing:
+                break
+            time.sleep(REGION_PAUSE_SEC)
+            if processed and processed % ati_parser.DRIVER_REBOOT_INTERVAL == 0:
+                driver = ati_parser.restart_driver(driver)
+                if driver is None:
+                    break
+    finally:
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        ati_parser.kill_own_chrome_process()
+        queue.close()
+        logger.info(f"[w{worker_id}] Воркер завершён, регионов: {processed}")
+
+
+# ---------------------------
+# КООРДИНАТОР
+# ---------------------------
+def crawl_regions(workers: int = DEFAULT_WORKERS,
+                  pages_per_minute: float = DEFAULT_PAGES_PER_MINUTE,
+                  regions: Optional[List[str]] = None,
+                  fresh: bool = False,
+                  headless: bool = False,
+                  refresh_profiles: bool = False,
+                  delta: bool = False,
+                  schedule: bool = False,
+                  db_path: str = QUEUE_DB) -> Dict[str, Any]:
+    """Run the crawl with N browser workers; returns the report (also written next to
+    parse_all_regions reports in regions_data). schedule=True seeds a new queue with the
+    region_scheduler plan (due regions only, best expected yield first)."""
+    regions = regions or ati_parser.RUSSIAN_REGIONS + ati_parser.MOSCOW_OBLAST_COMBINATIONS
+    all_count = len(regions)
+    if schedule:
+        regions, _ = region_scheduler.plan(regions, ati_parser.REGION_STATS_DIR)
+        if not regions:
+            logger.info("По плану обходить нечего — все регионы свежие")
+    queue = RegionQueue(db_path)
+    pending = queue.seed(regions, fresh)
+    logger.info(f"Очередь регионов: {pending} в работе, воркеров {workers}, бюджет {pages_per_minute} стр/мин")
+    started = time.time()
+
+    procs = []
+    for worker_id in range(1, min(max(1, workers), pending) + 1):
+        p = mp.Process(target=worker_main, name=f"region-worker-{worker_id}",
+                       args=(worker_id, db_path, pages_per_minute, headless, refresh_profiles, delta))
+        p.start()
+        procs.append(p)
+        if worker_id < workers and not queue.stop_requested():
+            time.sleep(WORKER_START_STAGGER_SEC)
+    for p in procs:
+        p.join()
+
+    done, failed = queue.count('done'), queue.regions('failed')
+    report = {
+        "processed_regions": done,
+        "skipped_regions": failed,
+        "pending_regions": queue.count('pending') + queue.count('running'),
+        "total_regions": len(regions),
+        "skipped_by_schedule": all_count - len(regions),
+        "success_rate": f"{(done / len(regions)) * 100:.1f}%" if regions else "0%",
+        "workers": len(procs),
+        "pages_per_minute": pages_per_minute,
+        "delta": delta,
+        "elapsed_sec": round(time.time() - started, 1),
+        "timestamp": datetime.now().isoformat(),
+    }
+    queue.close()
+    os.makedirs(ati_parser.REGIONS_DATA_DIR, exist_ok=True)
+    report_file = os.path.join(ati_parser.REGIONS_DATA_DIR,
+                               f"parsing_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Обход завершён. Успешно: {done}, пропущено: {len(failed)}, осталось: {report['pending_regions']}")
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Parallel ATI region crawl with a shared persistent queue")
+    ap.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    ap.add_argument('--pages-per-minute', type=float, default=DEFAULT_PAGES_PER_MINUTE)
+    ap.add_argument('--fresh', action='store_true', help="начать обход заново, не продолжая очередь")
+    ap.add_argument('--headless', action='store_true')
+    ap.add_argument('--refresh-profiles', action='store_true', help="пересоздать копии профиля Chrome")
+    ap.add_argument('--schedule', action='store_true',
+                    help="только созревшие регионы в порядке ожидаемых новых грузов (region_scheduler); с --fresh")
+    ap.add_argument('--delta', action='store_true',
+                    help="инкрементальный обход: до отметки прошлого обхода / страниц без новых грузов (обычно вместе с --fresh)")
+    args = ap.parse_args()
+    crawl_regions(args.workers, args.pages_per_minute, fresh=args.fresh,
+                  headless=args.headless, refresh_profiles=args.refresh_profiles, delta=args.delta,
+                  schedule=args.schedule)
@@ -0,0 +1,119 @@
+import os
+import json
+import math
+import time
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from jsonl_sink import safe_stream_name
+
+# Адаптивный порядок обхода регионов. После каждого завершённого обхода региона пишется
+# его статистика (файл на регион, как отметки delta_crawl): страницы, найдено, новых,
+# время; по ним — сглаженные (EWMA) новых на страницу, доля дублей, страниц за обход,
+# секунд на страницу и темп появления новых грузов в час между обходами.
+# План прохода: регион "созрел", если ожидаемое число новых грузов с прошлого обхода
+# >= SCHEDULE_MIN_EXPECTED_NEW, или он не обходился дольше SCHEDULE_FRESHNESS_FLOOR_SEC
+# (нижняя граница свежести), или статистики ещё нет. Созревшие идут по убыванию
+# ожидаемых новых грузов на минуту браузера; остальные в этом проходе пропускаются.
+
+SCHEDULE_FRESHNESS_FLOOR_SEC = 24 * 3600
+SCHEDULE_MIN_EXPECTED_NEW = 50       # ~ полстраницы из 100 строк
+STATS_EWMA_ALPHA = 0.3
+MIN_CRAWL_MINUTES = 0.25
+
+logger = logging.getLogger("RegionScheduler")
+
+
+def _stats_path(base_dir: str, region: str) -> str:
+    return os.path.join(base_dir, f"{safe_stream_name(region)}.json")
+
+def load_stats(base_dir: str, region: str) -> Optional[Dict[str, Any]]:
+    path = _stats_path(base_dir, region)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Статистика региона {region} не прочитана: {e}")
+        return None
+
+def _ewma(prev: Optional[float], value: Optional[float]) -> Optional[float]:
+    if value is None:
+        return prev
+    if prev is None:
+        return value
+    return prev + STATS_EWMA_ALPHA * (value - prev)
+
+def record_crawl(base_dir: str, region: str, pages: int, found: int, new: int,
+                 duration_sec: float, finished_at: Optional[float] = None) -> Dict[str, Any]:
+    """Fold one finished region crawl into the region's stats file; returns the stats."""
+    finished_at = finished_at or time.time()
+    prev = load_stats(base_dir, region) or {}
+    new_per_hour = None
+    if prev.get("last_crawl_at"):
+        hours = (finished_at - prev["last_crawl_at"]) / 3600.0
+        if hours > 0:
+            new_per_hour = new / hours
+    pages = max(0, int(pages))
+    stats = {
+        "region": region,
+        "crawls": int(prev.get("crawls", 0)) + 1,
+        "last_crawl_at": finished_at,
+        "last": {"pages": pages, "found": int(found), "new": int(new), "duration_sec": round(duration_sec, 1)},
+        "new_per_page": _ewma(prev.get("new_per_page"), new / pages if pages else None),
+        "dup_ratio": _ewma(prev.get("dup_ratio"), (found - new) / found if found else None),
+        "pages": _ewma(prev.get("pages"), float(pages)),
+        "sec_per_page": _ewma(prev.get("sec_per_page"), duration_sec / pages if pages else None),
+        "new_per_hour": _ewma(prev.get("new_per_hour"), new_per_hour),
+    }
+    os.makedirs(base_dir, exist_ok=True)
+    path = _stats_path(base_dir, region)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+    return stats
+
+
+def expected_new(stats: Dict[str, Any], now: float) -> float:
+    """New loads expected to have accumulated since the last crawl (inf while unknown)."""
+    rate = stats.get("new_per_hour")
+    if rate is None:
+        return math.inf          # один обход — темп ещё не известен
+    return rate * max(0.0, now - stats.get("last_crawl_at", 0)) / 3600.0
+
+def expected_minutes(stats: Dict[str, Any]) -> float:
+    """Browser minutes a crawl of the region takes, from observed pages * sec/page."""
+    pages = stats.get("pages") or 1.0
+    sec_per_page = stats.get("sec_per_page") or 0.0
+    return max(MIN_CRAWL_MINUTES, pages * sec_per_page / 60.0)
+
+def plan(regions: Sequence[str], base_dir: str, now: Optional[float] = None,
+         floor_sec: float = SCHEDULE_FRESHNESS_FLOOR_SEC,
+         min_expected: float = SCHEDULE_MIN_EXPECTED_NEW) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """(regions to crawl this pass, best first; per-region rows with the numbers behind it)."""
+    now = now or time.time()
+    rows: List[Dict[str, Any]] = []
+    for idx, region in enumerate(regions):
+        stats = load_stats(base_dir, region)
+        if stats is None:
+            rows.append({"region": region, "idx": idx, "due": True, "reason": "нет статистики",
+                         "score": math.inf, "expected_new": None, "age_h": None})
+            continue
+        age = now - stats.get("last_crawl_at", 0)
+        exp_new = expected_new(stats, now)
+        score = exp_new / expected_minutes(stats)
+        if age >= floor_sec:
+            due, reason = True, "порог свежести"
+        elif exp_new >= min_expected:
+            due, reason = True, "ожидаются новые"
+        else:
+            due, reason = False, "рано"
+        rows.append({"region": region, "idx": idx, "due": due, "reason": reason, "score": score,
+                     "expected_new": None if math.isinf(exp_new) else round(exp_new, 1),
+                     "age_h": round(age / 3600.0, 2)})
+    # неизвестные — первыми и в исходном порядке, дальше по ожидаемой выработке
+    rows.sort(key=lambda r: (-r["score"], r["idx"]))
+    order = [r["region"] for r in rows if r["due"]]
+    logger.info(f"План обхода: {len(order)} из {len(rows)} регионов, пропущено {len(rows) - len(order)}")
+    return order, rows
@@ -0,0 +1,190 @@
+import os
+import json
+import math
+import time
+import struct
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+# Компактный фильтр "уже видели" для хешей грузов вместо неограниченного set().
+# Bloom с поколениями: ttl делится на generations окон, новые хеши пишутся в текущее
+# поколение, поколение старше ttl выбрасывается целиком — так у Bloom появляется
+# истечение (как EX у ключей Redis), с точностью до одного окна. Сохраняется на диск
+# между запусками. Ложноположительные срабатывания возможны (fp_rate), пропусков нет.
+
+SEEN_FILTER_CAPACITY = 2_000_000       # хешей за ttl (неделя обхода с запасом)
+SEEN_FILTER_FP_RATE = 0.001
+SEEN_FILTER_TTL_SEC = 7 * 24 * 3600
+SEEN_FILTER_GENERATIONS = 7
+SAVE_EVERY_SEC = 60.0
+
+_MAGIC = b"SEENBLM1"
+
+logger = logging.getLogger("SeenFilter")
+
+
+class _Generation:
+    __slots__ = ("started_at", "bits", "count")
+
+    def __init__(self, started_at: float, nbytes: int, bits: Optional[bytearray] = None, count: int = 0):
+        self.started_at = started_at
+        self.bits = bits if bits is not None else bytearray(nbytes)
+        self.count = count
+
+
+class SeenFilter:
+    """Rotating Bloom filter with `in` / add() like the set it replaces, plus save()/stats()."""
+
+    def __init__(self, path: Optional[str] = None,
+                 capacity: int = SEEN_FILTER_CAPACITY,
+                 fp_rate: float = SEEN_FILTER_FP_RATE,
+                 ttl_seconds: int = SEEN_FILTER_TTL_SEC,
+                 generations: int = SEEN_FILTER_GENERATIONS):
+        self.path = path
+        self.generations = max(1, generations)
+        self.span = ttl_seconds / self.generations
+        per_gen = max(1, capacity // self.generations)
+        p_gen = fp_rate / self.generations          # объединение поколений ~ fp_rate
+        m = math.ceil(-per_gen * math.log(p_gen) / (math.log(2) ** 2))
+        self.nbytes = (m + 7) // 8
+        self.m = self.nbytes * 8
+        self.k = max(1, round(self.m / per_gen * math.log(2)))
+        self.gens: List[_Generation] = []
+        self.metrics: Dict[str, int] = {"checks": 0, "hits": 0, "added": 0,
+                                        "verified": 0, "false_positives": 0}
+        self._saved_at = time.monotonic()
+        self._dirty = False
+        if path:
+            self.load()
+        self._rotate()
+
+    # ---------- bloom ----------
+
+    def _positions(self, item: str) -> List[int]:
+        d = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(d[:8], "little")
+        h2 = int.from_bytes(d[8:], "little") | 1
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def _rotate(self) -> None:
+        now = time.time()
+        if not self.gens or now - self.gens[-1].started_at >= self.span:
+            self.gens.append(_Generation(now, self.nbytes))
+            self._dirty = True
+        while self.gens and (len(self.gens) > self.generations
+                             or now - self.gens[0].started_at >= self.span * self.generations):
+            self.gens.pop(0)
+            self._dirty = True
+        if not self.gens:
+            self.gens.append(_Generation(now, self.nbytes))
+
+    def _contains(self, positions: List[int]) -> bool:
+        for gen in reversed(self.gens):
+            bits = gen.bits
+            if all(bits[p >> 3] & (1 << (p & 7)) for p in positions):
+                return True
+        return False
+
+    def __contains__(self, item: str) -> bool:
+        self._rotate()
+        self.metrics["checks"] += 1
+        hit = self._contains(self._positions(item))
+        if hit:
+            self.metrics["hits"] += 1
+        return hit
+
+    def add(self, item: str) -> None:
+        self._rotate()
+        positions = self._positions(item)
+        if self._contains(positions):
+            return                        # как SET NX: повтор срок не продлевает
+        gen = self.gens[-1]
+        bits = gen.bits
+        for p in positions:
+            bits[p >> 3] |= 1 << (p & 7)
+        gen.count += 1
+        self.metrics["added"] += 1
+        self._dirty = True
+
+    def record_verification(self, was_new: bool) -> None:
+        """Result of re-checking a filter hit against Redis: was_new=True is a false positive."""
+        self.metrics["verified"] += 1
+        if was_new:
+            self.metrics["false_positives"] += 1
+
+    def __len__(self) -> int:
+        return sum(g.count for g in self.gens)
+
+    # ---------- metrics ----------
+
+    def estimated_fp_rate(self) -> float:
+        """Теоретическая вероятность ложного срабатывания при текущем заполнении."""
+        miss = 1.0
+        for gen in self.gens:
+            miss *= 1.0 - (1.0 - math.exp(-self.k * gen.count / self.m)) ** self.k
+        return 1.0 - miss
+
+    def stats(self) -> Dict[str, Any]:
+        m = self.metrics
+        return {
+            "items": len(self),
+            "generations": len(self.gens),
+            "memory_bytes": self.nbytes * len(self.gens),
+            "estimated_fp_rate": round(self.estimated_fp_rate(), 6),
+            "observed_fp_rate": round(m["false_positives"] / m["verified"], 6) if m["verified"] else None,
+            **m,
+        }
+
+    # ---------- persistence ----------
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        header = json.dumps({"m": self.m, "k": self.k, "span": self.span,
+                             "gens": [[g.started_at, g.count] for g in self.gens]}).encode("utf-8")
+        tmp = self.path + ".tmp"
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            f.write(struct.pack("<I", len(header)))
+            f.write(header)
+            for gen in self.gens:
+                f.write(gen.bits)
+        os.replace(tmp, self.path)
+        self._saved_at = time.monotonic()
+        self._dirty = False
+
+    def maybe_save(self, every_sec: float = SAVE_EVERY_SEC) -> None:
+        if self._dirty and time.monotonic() - self._saved_at >= every_sec:
+            try:
+                self.save()
+                logger.info(f"Фильтр дубликатов сохранён: {self.stats()}")
+            except OSError as e:
+                logger.warning(f"Не удалось сохранить фильтр дубликатов {self.path}: {e}")
+
+    def load(self) -> bool:
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "rb") as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    raise ValueError("bad magic")
+                (hlen,) = struct.unpack("<I", f.read(4))
+                header = json.loads(f.read(hlen))
+                if header["m"] != self.m or header["k"] != self.k or header["span"] != self.span:
+                    logger.info("Параметры фильтра дубликатов изменились — начинаем с пустого")
+                    return False
+                gens = []
+                for started_at, count in header["gens"]:
+                    bits = bytearray(f.read(self.nbytes))
+                    if len(bits) != self.nbytes:
+                        raise ValueError("truncated")
+                    gens.append(_Generation(started_at, self.nbytes, bits, count))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Фильтр дубликатов {self.path} не прочитан ({e}) — начинаем с пустого")
+            return False
+        self.gens = gens
+        logger.info(f"Фильтр дубликатов загружен: {len(self)} хешей, {len(gens)} поколений")
+        return True
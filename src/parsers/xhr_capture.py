@@ -0,0 +1,223 @@
+import json
+import base64
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Захват JSON-ответов поиска ATI из performance log Chrome (события CDP Network) вместо
+# разбора отрисованного DOM по классам (div.PExKw, .BUBXM, ...). Список на странице
+# строится из ответа API: после перехода на страницу забираем тело этого ответа через
+# Network.getResponseBody и переводим записи в те же сырые карточки, что отдаёт JS
+# (_PAGE_EXTRACT_JS / extract_cards_on_page) — нормализация, хеш и дедуп не меняются.
+# Схема ответа API не документирована: поля ищутся по спискам путей-кандидатов ниже;
+# если в ответе не нашлось ни одной карточки, парсер откатывается на DOM.
+
+FREIGHT_URL_MARKERS: Tuple[str, ...] = ("/webapi/", "loads/search", "/loads/v")
+TRUCK_URL_MARKERS: Tuple[str, ...] = ("/webapi/", "trucks/search", "/trucks/v")
+NETWORK_BUFFER_BYTES = 64 * 1024 * 1024
+
+logger = logging.getLogger("XhrCapture")
+
+
+# ---------- драйвер ----------
+
+def enable_performance_log(options) -> None:
+    """Chrome options: performance log with Network events only (called before webdriver.Chrome)."""
+    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    options.add_experimental_option("perfLoggingPrefs", {"enableNetwork": True, "enablePage": False})
+
+def start(driver) -> bool:
+    """Enable CDP Network with buffers large enough to keep search bodies until they are read."""
+    try:
+        driver.execute_cdp_cmd("Network.enable", {"maxTotalBufferSize": NETWORK_BUFFER_BYTES,
+                                                  "maxResourceBufferSize": NETWORK_BUFFER_BYTES // 4})
+        return True
+    except Exception as e:
+        logger.warning(f"CDP Network недоступен, захват XHR выключен: {e}")
+        return False
+
+def _matches(url: str, markers: Iterable[str]) -> bool:
+    return any(m in url for m in markers)
+
+def drain_json_responses(driver, url_markers: Iterable[str]) -> List[Tuple[str, Any]]:
+    """(url, payload) of finished JSON responses since the previous drain, in arrival order."""
+    try:
+        entries = driver.get_log("performance")
+    except Exception as e:
+        logger.debug(f"performance log недоступен: {e}")
+        return []
+    pending: Dict[str, str] = {}
+    finished: List[str] = []
+    for entry in entries:
+        try:
+            msg = json.loads(entry["message"])["message"]
+        except (KeyError, TypeError, ValueError):
+            continue
+        method, params = msg.get("method"), msg.get("params") or {}
+        if method == "Network.responseReceived":
+            resp = params.get("response") or {}
+            url = resp.get("url") or ""
+            if "json" in (resp.get("mimeType") or "") and _matches(url, url_markers):
+                pending[params.get("requestId")] = url
+        elif method == "Network.loadingFinished" and params.get("requestId") in pending:
+            finished.append(params["requestId"])
+
+    out: List[Tuple[str, Any]] = []
+    for request_id in finished:
+        try:
+            body = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+            text = body.get("body") or ""
+            if body.get("base64Encoded"):
+                text = base64.b64decode(text).decode("utf-8", errors="replace")
+            out.append((pending[request_id], json.loads(text)))
+        except Exception as e:
+            # тело уже вытеснено из буфера / не JSON — страница уйдёт в DOM-фолбэк
+            logger.debug(f"Тело ответа {pending[request_id]} не получено: {e}")
+    return out
+
+
+# ---------- разбор ответа ----------
+
+_ID_KEYS = ("id", "loadId", "load_id", "truckId", "truck_id", "guid")
+
+def find_records(payload: Any) -> List[Dict[str, Any]]:
+    """The largest list of id-bearing objects anywhere in the payload (the result rows)."""
+    best: List[Dict[str, Any]] = []
+    stack = [payload]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            rows = [x for x in node if isinstance(x, dict)]
+            if len(rows) > len(best) and any(k in rows[0] for k in _ID_KEYS):
+                best = rows
+            stack.extend(rows)
+    return best
+
+def _get(rec: Any, path: str) -> Any:
+    for part in path.split("."):
+        if not isinstance(rec, dict):
+            return None
+        rec = rec.get(part)
+    return rec
+
+def _pick(rec: Dict[str, Any], *paths: str) -> Any:
+    for path in paths:
+        value = _get(rec, path)
+        if value not in (None, "", [], {}):
+            return value
+    return None
+
+def _text(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, dict):
+        value = _pick(value, "name", "title", "value", "text")
+    if isinstance(value, list):
+        return ", ".join(t for t in (_text(v) for v in value) if t)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def _place(value: Any) -> str:
+    if isinstance(value, dict):
+        city = _text(_pick(value, "location.city", "city.name", "city", "cityName", "name", "address"))
+        region = _text(_pick(value, "location.region", "region.name", "regionName"))
+        return f"{city}, {region}" if city and region and region not in city else city
+    return _text(value)
+
+def _places(value: Any) -> List[str]:
+    items = value if isinstance(value, list) else [value] if value else []
+    return [p for p in (_place(v) for v in items) if p]
+
+def _num(value: Any, unit: str) -> str:
+    if isinstance(value, dict):
+        value = _pick(value, "value", "amount")
+    text = _text(value)
+    return f"{text} {unit}" if text and unit not in text else (text or "Н/Д")
+
+def _money(value: Any) -> str:
+    if isinstance(value, (int, float)):
+        return f"{round(value):,}".replace(",", " ") + " ₽"
+    return _text(value)
+
+
+# ---------- грузы ----------
+
+def freight_card_from_json(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """One API load -> raw card of the same shape as ati_parser._PAGE_EXTRACT_JS."""
+    prices: Dict[str, str] = {}
+    for key, paths in (("с_НДС", ("rate.priceNds", "rate.withNds", "price.withNds", "priceNds")),
+                       ("без_НДС", ("rate.priceNoNds", "rate.withoutNds", "price.withoutNds", "priceNoNds")),
+                       ("наличные", ("rate.cash", "rate.priceCash", "price.cash", "priceCash"))):
+        value = _pick(rec, *paths)
+        if value:
+            prices[key] = _money(value)
+
+    loading_types = _text(_pick(rec, "truck.loadingTypes", "loadingTypes", "loading.types"))
+    unloading_types = _text(_pick(rec, "truck.unloadingTypes", "unloadingTypes", "unloading.types"))
+    loading_raw = " ".join(s for s in (f"загр: {loading_types}" if loading_types else "",
+                                       f"выгр: {unloading_types}" if unloading_types else "") if s)
+    distance = _pick(rec, "route.distance", "distance")
+    return {
+        "id": _text(_pick(rec, *_ID_KEYS)) or "N/A",
+        "loading_points": _places(_pick(rec, "loadings", "loading.points", "loading", "loadingPoints", "from")),
+        "unloading_points": _places(_pick(rec, "unloadings", "unloading.points", "unloading", "unloadingPoints", "to")),
+        "distance": _num(distance, "км") if distance else "N/A",
+        "cargo": _text(_pick(rec, "cargo.name", "cargo.cargoType", "cargoType", "cargoName", "cargo")) or "Н/Д",
+        "weight": _num(_pick(rec, "cargo.weight", "load.weight", "weight"), "т"),
+        "volume": _num(_pick(rec, "cargo.volume", "load.volume", "volume"), "м³"),
+        "prices": prices,
+        "loading_date": _text(_pick(rec, "loading.dateText", "loadingDate", "loading.date", "firstDate", "dateFrom")) or "Н/Д",
+        "body_type": _text(_pick(rec, "truck.carTypes", "truck.bodyTypes", "carTypes", "bodyType")) or "Н/Д",
+        "loading_method": " ".join(t for t in (loading_types, unloading_types) if t) or "Н/Д",
+        "loading_unloading_raw": loading_raw,
+        "possible_reload": "да" if _pick(rec, "truck.possibleReload", "possibleReload", "reload") else "нет",
+    }
+
+def freight_cards(driver) -> List[Optional[Dict[str, Any]]]:
+    """Cards of the last freight search response since the previous call; [] if none was captured."""
+    for url, payload in reversed(drain_json_responses(driver, FREIGHT_URL_MARKERS)):
+        records = find_records(payload)
+        if records:
+            return [_safe(freight_card_from_json, r) for r in records]
+    return []
+
+
+# ---------- транспорт ----------
+
+def truck_card_from_json(rec: Dict[str, Any]) -> Dict[str, Any]:
+    """One API truck -> raw card of the same shape as ati_cars_parser.extract_cards_on_page."""
+    weight = _pick(rec, "truck.weight", "weight", "capacity")
+    volume = _pick(rec, "truck.volume", "volume")
+    body = _text(_pick(rec, "truck.carTypes", "truck.bodyTypes", "carTypes", "bodyType"))
+    info = ", ".join(s for s in (f"{_text(weight)} т" if weight else "",
+                                 f"{_text(volume)} м3" if volume else "") if s)
+    rate = _pick(rec, "rate.pricePerKm", "rate.perKm", "rate.price", "rate.sum", "price")
+    per_km = _get(rec, "rate.pricePerKm") is not None or _get(rec, "rate.perKm") is not None
+    return {
+        "rid": _text(_pick(rec, *_ID_KEYS)),
+        "truck_info": f"{info} {body}".strip(),
+        "load_params": _text(_pick(rec, "truck.loadingTypes", "loadingTypes")),
+        "truck_dims": _text(_pick(rec, "truck.dimensions", "dimensions")),
+        "loading_city": _place(_pick(rec, "loading", "from", "loadingCity")),
+        "periodicity": _text(_pick(rec, "loading.periodicity", "periodicity")),
+        "main_unload": _place(_pick(rec, "unloading", "to", "mainUnloading")),
+        "rate_block": (f"{_text(rate)} руб/км" if per_km else _money(rate)) if rate else "",
+        "company_block": _text(_pick(rec, "firm.name", "company.name", "firmName", "contact.firmName")),
+    }
+
+def truck_cards(driver) -> List[Dict[str, Any]]:
+    for url, payload in reversed(drain_json_responses(driver, TRUCK_URL_MARKERS)):
+        records = find_records(payload)
+        if records:
+            return [card for card in (_safe(truck_card_from_json, r) for r in records) if card]
+    return []
+
+def _safe(fn, rec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # как try/catch на карточку в JS: битая запись -> None, страница не падает
+    try:
+        return fn(rec)
+    except Exception as e:
+        logger.debug(f"Запись ответа не разобрана: {e}")
+        return None
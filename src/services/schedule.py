@@ -23,4 +23,23 @@ BEAT_SCHEDULE = {
     "task": "planner.hourly.replan.all",
     "schedule": crontab(minute=5),  # на 05-й минуте каждого часа
   },
+
+  # Компакция GPS-истории в gps_daily — ночью (03:30)
+  "gps-compact-daily": {
+    "task": "gps.compact.daily",
+    "schedule": crontab(hour=3, minute=30),
+  },
+
+  # Полная пересборка market_stats + куба ставок и сброс скетчей — ночью (03:00)
+  "market-stats-rebuild-nightly": {
+    "task": "market.stats.rebuild",
+    "schedule": crontab(hour=3, minute=0),
+  },
+
+  # market_stats из дневных скетчей — каждые 5 минут (дёшево: слияние скетчей, без скана freights;
+  # куб ставок — только ночной пересборкой)
+  "market-stats-refresh-5m": {
+    "task": "market.stats.refresh",
+    "schedule": 60 * 5,
+  },
 }
@@ -199,6 +199,67 @@ def mv_refresh_vehicle_availability():
     """
     return _refresh_mv_safely("public.vehicle_availability_mv")
 
+# ---------------------------------------------------------------------
+# TASK: Ночная компакция GPS-истории (gps_positions -> gps_daily)
+# ---------------------------------------------------------------------
+@celery.task(name="gps.compact.daily")
+def gps_compact_daily():
+    """
+    Сворачивает сырые GPS-точки старше GPS_RETENTION_DAYS дней в суточные агрегаты gps_daily
+    и удаляет их пачками. GPS_ARCHIVE_DIR (опционально) — куда сложить сырые точки (jsonl.gz).
+    """
+    from src.data_layer.gps_feed import compact_gps_history
+
+    days = int(os.getenv("GPS_RETENTION_DAYS", "90"))
+    archive_dir = os.getenv("GPS_ARCHIVE_DIR") or None
+    stats = compact_gps_history(older_than_days=days, archive_dir=archive_dir)
+    return {"ok": True, "retention_days": days, **stats}
+
+# ---------------------------------------------------------------------
+# TASK: market_stats из дневных KLL-скетчей (каждые несколько минут)
+# ---------------------------------------------------------------------
+@celery.task(name="market.stats.refresh")
+def market_stats_refresh():
+    """
+    Пересобирает market_stats слиянием дневных скетчей окна (refresh_market_stats_incremental):
+    секунды вместо полного пересчёта по freights. Окно — MARKET_LOOKBACK_DAYS из legacy config.
+    Куб ставок здесь не обновляется — только ночным market.stats.rebuild.
+    """
+    import sys
+
+    # модули src/optimization импортируются плоско (config, database, quantile_sketch)
+    opt_dir = Path(__file__).resolve().parents[1] / "optimization"
+    for p in (str(opt_dir), str(opt_dir / "legacy")):
+        if p not in sys.path:
+            sys.path.insert(0, p)
+    from market_sketches import refresh_market_stats_incremental
+
+    rows = refresh_market_stats_incremental()
+    return {"ok": True, "rows": rows}
+
+# ---------------------------------------------------------------------
+# TASK: ночная полная пересборка market_stats + куба ставок, сброс скетчей
+# ---------------------------------------------------------------------
+@celery.task(name="market.stats.rebuild")
+def market_stats_rebuild():
+    """
+    Полный пересчёт по freights: market_stats и куб ставок (rate_cube, запасной уровень
+    MarketBaseline), затем пересборка дневных скетчей окна — убирает дрейф инкрементального
+    пути (перезаписанные грузы остаются в скетчах со старой ставкой).
+    """
+    import sys
+
+    opt_dir = Path(__file__).resolve().parents[1] / "optimization"
+    for p in (str(opt_dir), str(opt_dir / "legacy")):
+        if p not in sys.path:
+            sys.path.insert(0, p)
+    from market_stats import rebuild_market_stats
+    from market_sketches import backfill_market_sketches
+
+    rows = rebuild_market_stats()
+    sketched = backfill_market_sketches()
+    return {"ok": True, "rows": rows, "sketched_freights": sketched}
+
 # --- Регистрация внешних тасков FoxProFlow ---
 from src.worker.register_tasks import (
     task_planner_nextload_search,